@@ -0,0 +1,176 @@
+"""
+checks query plans of the API endpoints (and of the scraper's listing index load): fails with
+exit code 1 if a query does a full table scan or a full index scan instead of using the indexes
+from db/migrations. Run against a disposable copy of the database seeded with a large table,
+connection from DB_* env variables (see database.py; seeding needs a user with INSERT):
+
+    python explain_check.py --seed 200000
+"""
+import argparse
+import random
+import re
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from database import engine
+from queries import (
+    CITIES_QUERY, LISTINGS_QUERY, MAP_QUERY, TOP_AFFORDABLE_QUERY, TOP_EXPENSIVE_QUERY, area_stats_query,
+    city_data_query, city_stats_query, price_histogram_query, room_groups_query
+)
+
+# same as DatabaseHelper.get_existing_urls in the scraper
+EXISTING_URLS_QUERY = "SELECT url, scraped_ts FROM listings_current"
+
+CHECKED_CITIES = ["Gdańsk", "Sopot", "Rumia"]
+
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+
+QUERIES = {
+    "/listings": (LISTINGS_QUERY, {}),
+    "/listings/cities": (CITIES_QUERY, {}),
+    "/listings/map": (MAP_QUERY, {}),
+    "/listings/by-cities": (
+        city_data_query(len(CHECKED_CITIES)), {f"city{i}": city for i, city in enumerate(CHECKED_CITIES)}
+    ),
+    "/listings/top-expensive": (TOP_EXPENSIVE_QUERY, {}),
+    "/listings/top-affordable": (TOP_AFFORDABLE_QUERY, {}),
+    **{
+        endpoint: (query_builder(len(CHECKED_CITIES)), {f"city{i}": city for i, city in enumerate(CHECKED_CITIES)})
+        for endpoint, query_builder in [
+            ("/aggregates/cities", city_stats_query),
+            ("/aggregates/areas", area_stats_query),
+            ("/aggregates/rooms", room_groups_query),
+            ("/aggregates/price-histogram", price_histogram_query)
+        ]
+    },
+    "get_existing_urls": (EXISTING_URLS_QUERY, {})
+}
+
+# queries returning (almost) the whole table - a scan is the cheapest plan for them
+EXEMPT = {
+    "/listings": "returns every row",
+    "/listings/map": "returns nearly all rows",
+    "get_existing_urls": "returns every row"
+}
+
+SEED_CITIES = [
+    "Gdańsk", "Gdynia", "Sopot", "Rumia", "Reda", "Wejherowo", "Pruszcz Gdański", "Kolbudy",
+    "Żukowo", "Kartuzy", "Banino", "Chwaszczyno", "Kosakowo", "Straszyn", "Tczew", "Puck"
+]
+
+COLUMNS = [
+    "url", "title", "price", "price_per_sqr_meter", "rooms", "floor", "square_meters", "year", "address",
+    "city", "area", "latitude", "longitude", "created_ts"
+]
+
+def seed(conn, n: int, batch_size: int = 5000):
+    """
+    insert n synthetic listings (every 4th with an older version in listing_versions) and refresh table statistics
+    """
+    rng = random.Random(0)
+    (first_id,) = conn.execute(text("SELECT COALESCE(MAX(id), 0) + 1 FROM listings_current")).fetchone()
+    insert_listing = text(
+        f"INSERT INTO listings_current (id, {', '.join(COLUMNS)}, scraped_ts, first_seen_ts, versions) "
+        f"VALUES (:id, {', '.join(f':{c}' for c in COLUMNS)}, :scraped_ts, :first_seen_ts, :versions)"
+    )
+    insert_version = text(
+        f"INSERT INTO listing_versions (listing_id, {', '.join(COLUMNS)}) "
+        f"VALUES (:id, {', '.join(f':{c}' for c in COLUMNS)})"
+    )
+    now = datetime.now().replace(microsecond=0)
+    listings, versions = [], []
+    for i in range(n):
+        city = SEED_CITIES[i % len(SEED_CITIES)]
+        square_meters = round(rng.uniform(20, 140), 1)
+        price = rng.randrange(250_000, 2_500_000, 1000) if rng.random() > 0.05 else None
+        created_ts = now - timedelta(days=rng.randint(0, 365))
+        listing = {
+            "id": first_id + i,
+            "url": f"https://ogloszenia.trojmiasto.pl/nieruchomosci/seed{first_id + i}.html",
+            "title": "Mieszkanie na wynajem" if i % 10 == 0 else f"Mieszkanie {i}",
+            "price": price,
+            "price_per_sqr_meter": round(price / square_meters, 2) if price else None,
+            "rooms": rng.randint(1, 6),
+            "floor": rng.randint(0, 10),
+            "square_meters": square_meters,
+            "year": str(rng.randint(1950, 2024)),
+            "address": f"{city} Ulica {i % 500}",
+            "city": city,
+            "area": f"Dzielnica {i % 12}",
+            "latitude": rng.uniform(54.30, 54.62),
+            "longitude": rng.uniform(18.40, 18.72),
+            "created_ts": created_ts,
+            "scraped_ts": now,
+            "first_seen_ts": created_ts,
+            "versions": 1
+        }
+        if i % 4 == 0:
+            first_seen = created_ts - timedelta(days=30)
+            versions.append(dict(listing, price=round(price * 1.05) if price else None, created_ts=first_seen))
+            listing.update(first_seen_ts=first_seen, versions=2)
+        listings.append(listing)
+        versions.append(listing)
+        if len(listings) >= batch_size:
+            conn.execute(insert_listing, listings)
+            conn.execute(insert_version, versions)
+            listings, versions = [], []
+    if listings:
+        conn.execute(insert_listing, listings)
+        conn.execute(insert_version, versions)
+    conn.commit()
+    conn.execute(text("ANALYZE TABLE listings_current, listing_versions")).fetchall()
+
+def bounded_index_scan(row: dict, query: str) -> bool:
+    """
+    index scan that isn't a full scan: loose index scan for GROUP BY / DISTINCT, or an ordered scan
+    stopped by LIMIT (the index supplies the ORDER BY - no filesort), e.g. ORDER BY price LIMIT 5 over KEY price
+    """
+    extra = row["Extra"] or ""
+    if "for group-by" in extra:
+        return True
+    return bool(LIMIT_PATTERN.search(query)) and "ORDER BY" in query.upper() and "Using filesort" not in extra
+
+def full_scans(plan: list, query: str) -> list:
+    """
+    plan rows of listings_current read as a whole: type ALL (table scan) or an unbounded index scan
+    """
+    return [
+        row for row in plan
+        if row["table"] == "listings_current"
+        and (row["type"] == "ALL" or (row["type"] == "index" and not bounded_index_scan(row, query)))
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="fail on full scans in query plans of the API endpoints")
+    parser.add_argument("--seed", type=int, default=0, help="insert N synthetic listings first (disposable database only)")
+    args = parser.parse_args()
+
+    failed = []
+    with engine.connect() as conn:
+        if args.seed:
+            seed(conn, args.seed)
+        (rows,) = conn.execute(text("SELECT COUNT(*) FROM listings_current")).fetchone()
+        print(f"listings_current: {rows} rows")
+
+        for name, (query, params) in QUERIES.items():
+            plan = [row._asdict() for row in conn.execute(text(f"EXPLAIN {query}"), params).fetchall()]
+            scans = full_scans(plan, query)
+            if not scans:
+                verdict = "ok"
+            elif name in EXEMPT:
+                verdict = f"exempt ({EXEMPT[name]})"
+            else:
+                verdict = "FULL SCAN"
+                failed.append(name)
+            print(f"{name}: {verdict}")
+            for row in plan:
+                print(f"    {row['table']}: type={row['type']} key={row['key']} rows={row['rows']} extra={row['Extra']}")
+
+    if failed:
+        print(f"full scans in: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,10 @@ from fastapi import FastAPI, Depends, Query, HTTPException
 from fastapi.responses import Response
 from sqlalchemy import desc, text
 from database import get_db
+from queries import (
+    CITIES_QUERY, LISTINGS_QUERY, MAP_QUERY, TOP_AFFORDABLE_QUERY, TOP_EXPENSIVE_QUERY, area_stats_query,
+    city_data_query, city_stats_query, price_histogram_query, room_groups_query
+)
 
 app = FastAPI()
 
@@ -16,7 +20,7 @@ def status_check(db=Depends(get_db)):
 @app.get("/listings", description="Fetch all listings from the database")
 def get_listings(db=Depends(get_db)):
     try:
-        query = text("SELECT * FROM scraped_items")
+        query = text(LISTINGS_QUERY)
         result = db.execute(query)
         listings = result.fetchall()
         return [listing._asdict() for listing in listings]
@@ -26,7 +30,7 @@ def get_listings(db=Depends(get_db)):
 @app.get("/listings/cities", description="Fetch unique cities from the database")
 def get_cities(db=Depends(get_db)):
     try:
-        query = text("SELECT DISTINCT city FROM scraped_items WHERE city is NOT NULL ORDER BY city ASC")
+        query = text(CITIES_QUERY)
         result = db.execute(query)
         cities = [row[0] for row in result.fetchall()]
         return cities
@@ -36,12 +40,7 @@ def get_cities(db=Depends(get_db)):
 @app.get("/listings/map", description="Fetch data required for map visualization")
 def get_map_data(db=Depends(get_db)):
     try:
-        query = text("""
-            SELECT title, latitude, longitude, price, square_meters, rooms, year, url, city, area, price_per_sqr_meter
-            FROM scraped_items
-            WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND price IS NOT NULL
-            AND square_meters IS NOT NULL AND city IS NOT NULL
-        """)
+        query = text(MAP_QUERY)
         result = db.execute(query)
         return [row._asdict() for row in result.fetchall()]
     except Exception as e:
@@ -57,14 +56,7 @@ def get_city_data(city: list[str] = Query(None), db=Depends(get_db)):
         # tuple for SQL 
         cities_tuple = tuple(city)
          
-        query = text(f"""
-            SELECT title,  price, square_meters, rooms, 
-                   year, url, city, area, price_per_sqr_meter
-            FROM scraped_items
-            WHERE city IN ({",".join([f":city{i}" for i in range(len(cities_tuple))])})
-            AND price IS NOT NULL
-            AND square_meters IS NOT NULL
-        """)
+        query = text(city_data_query(len(cities_tuple)))
         
         params = {f"city{i}": c for i, c in enumerate(cities_tuple)}
         
@@ -73,19 +65,46 @@ def get_city_data(city: list[str] = Query(None), db=Depends(get_db)):
     except Exception as e:
         return {"Error": str(e)}
 
+def get_aggregates(query_builder, city, db):
+    if not city:
+        return []
+    query = text(query_builder(len(city)))
+    params = {f"city{i}": c for i, c in enumerate(city)}
+    result = db.execute(query, params)
+    return [row._asdict() for row in result.fetchall()]
+
+@app.get("/aggregates/cities", description="Fetch listing counts and price quartiles of specific city/cities")
+def get_city_stats(city: list[str] = Query(None), db=Depends(get_db)):
+    try:
+        return get_aggregates(city_stats_query, city, db)
+    except Exception as e:
+        return {"Error": str(e)}
+
+@app.get("/aggregates/areas", description="Fetch listing counts and price quartiles of areas of specific city/cities")
+def get_area_stats(city: list[str] = Query(None), db=Depends(get_db)):
+    try:
+        return get_aggregates(area_stats_query, city, db)
+    except Exception as e:
+        return {"Error": str(e)}
+
+@app.get("/aggregates/rooms", description="Fetch listing counts per number of rooms for specific city/cities")
+def get_room_groups(city: list[str] = Query(None), db=Depends(get_db)):
+    try:
+        return get_aggregates(room_groups_query, city, db)
+    except Exception as e:
+        return {"Error": str(e)}
+
+@app.get("/aggregates/price-histogram", description="Fetch listing counts per price bin for specific city/cities")
+def get_price_histogram(city: list[str] = Query(None), db=Depends(get_db)):
+    try:
+        return get_aggregates(price_histogram_query, city, db)
+    except Exception as e:
+        return {"Error": str(e)}
+
 @app.get("/listings/top-expensive", description="Fetch top 5 most expensive properties")
 def get_top_expensive(db=Depends(get_db)):
     try:
-        query = text("""
-            SELECT city, price, square_meters, rooms, year, area, url
-            FROM scraped_items
-            WHERE 1=1
-                AND title NOT REGEXP 'najem|wynajem|wynajmę|wynajme'
-                AND price is NOT NULL
-                AND city is not NULL
-            ORDER BY price DESC
-            LIMIT 5
-        """)
+        query = text(TOP_EXPENSIVE_QUERY)
         result = db.execute(query)
         return [row._asdict() for row in result.fetchall()]
     except Exception as e:
@@ -94,16 +113,7 @@ def get_top_expensive(db=Depends(get_db)):
 @app.get("/listings/top-affordable", description="Fetch top 5 most affordable properties")
 def get_top_affordable(db=Depends(get_db)):
     try:
-        query = text("""
-            SELECT city, price, square_meters, rooms, year, area, url 
-            FROM scraped_items
-            WHERE 1=1 
-                AND title NOT REGEXP 'najem|wynajem|wynajmę|wynajme'
-                AND price is NOT NULL
-                AND city is not NULL
-            ORDER BY price ASC
-            LIMIT 5
-        """)
+        query = text(TOP_AFFORDABLE_QUERY)
         result = db.execute(query)
         return [row._asdict() for row in result.fetchall()]
     except Exception as e:
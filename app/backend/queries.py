@@ -0,0 +1,114 @@
+"""
+SQL of the API endpoints, kept apart from main.py so explain_check.py can check their plans.
+Endpoints read only listings_current (current version of every listing, indexes in
+db/migrations/0003_listings_current_versions.sql), price history is in listing_versions.
+/aggregates/... endpoints read the agg_* tables refreshed by the scraper (db/migrations/0005_aggregates.sql)
+"""
+
+LISTINGS_QUERY = "SELECT * FROM listings_current"
+
+CITIES_QUERY = """
+    SELECT DISTINCT city
+    FROM listings_current
+    WHERE city IS NOT NULL
+    ORDER BY city ASC
+"""
+
+MAP_QUERY = """
+    SELECT title, latitude, longitude, price, square_meters, rooms, year, url, city, area, price_per_sqr_meter
+    FROM listings_current
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND price IS NOT NULL
+    AND square_meters IS NOT NULL AND city IS NOT NULL
+"""
+
+def city_placeholders(n_cities: int) -> str:
+    """
+    bind parameters city0 ... city{n_cities - 1}
+    """
+    return ",".join([f":city{i}" for i in range(n_cities)])
+
+def city_data_query(n_cities: int) -> str:
+    """
+    /listings/by-cities query with bind parameters city0 ... city{n_cities - 1}
+    """
+    return f"""
+        SELECT title,  price, square_meters, rooms,
+               year, url, city, area, price_per_sqr_meter
+        FROM listings_current
+        WHERE city IN ({city_placeholders(n_cities)})
+        AND price IS NOT NULL
+        AND square_meters IS NOT NULL
+    """
+
+TOP_EXPENSIVE_QUERY = """
+    SELECT city, price, square_meters, rooms, year, area, url
+    FROM listings_current
+    WHERE 1=1
+        AND title NOT REGEXP 'najem|wynajem|wynajmę|wynajme'
+        AND price is NOT NULL
+        AND city is not NULL
+    ORDER BY price DESC
+    LIMIT 5
+"""
+
+TOP_AFFORDABLE_QUERY = """
+    SELECT city, price, square_meters, rooms, year, area, url
+    FROM listings_current
+    WHERE 1=1
+        AND title NOT REGEXP 'najem|wynajem|wynajmę|wynajme'
+        AND price is NOT NULL
+        AND city is not NULL
+    ORDER BY price ASC
+    LIMIT 5
+"""
+
+STAT_COLUMNS = """
+    listings, price_p25, price_median, price_p75,
+    price_per_sqr_meter_p25, price_per_sqr_meter_median, price_per_sqr_meter_p75
+"""
+
+def city_stats_query(n_cities: int) -> str:
+    """
+    /aggregates/cities query: listings and price quartiles per city
+    """
+    return f"""
+        SELECT city, {STAT_COLUMNS}
+        FROM agg_city_stats
+        WHERE city IN ({city_placeholders(n_cities)})
+        ORDER BY city
+    """
+
+def area_stats_query(n_cities: int) -> str:
+    """
+    /aggregates/areas query: listings and price quartiles per area of the cities
+    """
+    return f"""
+        SELECT city, area, {STAT_COLUMNS}
+        FROM agg_area_stats
+        WHERE city IN ({city_placeholders(n_cities)})
+        ORDER BY city, area
+    """
+
+def room_groups_query(n_cities: int) -> str:
+    """
+    /aggregates/rooms query: listings per room group, summed over the cities
+    """
+    return f"""
+        SELECT room_group, CAST(SUM(listings) AS SIGNED) AS listings
+        FROM agg_room_groups
+        WHERE city IN ({city_placeholders(n_cities)})
+        GROUP BY room_group
+        ORDER BY room_group
+    """
+
+def price_histogram_query(n_cities: int) -> str:
+    """
+    /aggregates/price-histogram query: listings per price bin, summed over the cities
+    """
+    return f"""
+        SELECT bin_start, bin_end, CAST(SUM(listings) AS SIGNED) AS listings
+        FROM agg_price_histogram
+        WHERE city IN ({city_placeholders(n_cities)})
+        GROUP BY bin_start, bin_end
+        ORDER BY bin_start
+    """
@@ -125,6 +125,34 @@ app.layout = html.Div([
 def update_map(n):
     return get_latest_map_path()
 
+# rows of /aggregates/<endpoint> for the selected cities as a DataFrame with the given columns
+def fetch_aggregates(endpoint, cities, columns):
+    city_params = "&".join([f"city={city}" for city in cities])
+    response = requests.get(f"{base_url}/aggregates/{endpoint}?{city_params}")
+    if response.status_code != 200:
+        raise ValueError("Failed to fetch data from the API")
+    return pd.DataFrame(response.json(), columns=columns)
+
+# histogram drawn from precomputed price bins (one bar per bin, as wide as the bin)
+def price_histogram(bins, title):
+    price_hist = px.bar(
+        bins,
+        x="bin_start",
+        y="listings",
+        title=title,
+        labels={"bin_start": "Price (PLN)"},
+        color_discrete_sequence=["skyblue"],
+        height=500
+    )
+    price_hist.update_traces(width=(bins["bin_end"] - bins["bin_start"]).tolist(), offset=0)
+    price_hist.update_layout(
+        bargap=0,
+        margin=dict(t=30, l=30, r=30, b=30),
+        xaxis_title="Price (PLN)",
+        yaxis_title="Number of properties"
+    )
+    return price_hist
+
 # callback to update the graphs based on selected cities
 @app.callback(
     [
@@ -141,63 +169,21 @@ def update_graphs(selected_cities):
         empty_fig = {} 
         return empty_fig, empty_fig, empty_fig, empty_fig
 
-    by_cities = f"{base_url}/listings/by-cities"
-    city_params = "&".join([f"city={city}" for city in selected_cities])
-    query_url = f"{by_cities}?{city_params}"
-
-    # fetch data from API
-    response = requests.get(query_url)
-    if response.status_code != 200:
-        raise ValueError("Failed to fetch data from the API")
-
-    data = pd.DataFrame(response.json()) 
+    # aggregates precomputed by the scraper at the end of every crawl
+    histogram = fetch_aggregates("price-histogram", selected_cities, ["bin_start", "bin_end", "listings"])
+    room_counts = fetch_aggregates("rooms", selected_cities, ["room_group", "listings"])
+    city_comparison = fetch_aggregates(
+        "cities", selected_cities, ["city", "listings", "price_median", "price_per_sqr_meter_median"]
+    )
 
     # hist 1: Price < 3M
-    filtered_price_1 = data[data["price"] < 3_000_000]
-    price_hist_1 = px.histogram(
-        filtered_price_1, 
-        x="price",
-        nbins=100,
-        title="Price distribution (< 3M PLN)",
-        labels={"price": "Price (PLN)"},
-        color_discrete_sequence=["skyblue"],
-        height=500
-    )
-    price_hist_1.update_layout(
-        margin=dict(t=30, l=30, r=30, b=30),
-        xaxis_title="Price (PLN)",
-        yaxis_title="Number of properties"
-    )
+    price_hist_1 = price_histogram(histogram[histogram["bin_start"] < 3_000_000], "Price distribution (< 3M PLN)")
 
     # hist 2: Price >= 3M
-    filtered_price_2 = data[data["price"] >= 3_000_000]
-    price_hist_2 = px.histogram(
-        filtered_price_2, 
-        x="price", 
-        nbins=100,
-        title="Price distribution (≥ 3M PLN)",
-        labels={"price": "Price (PLN)"},
-        color_discrete_sequence=["skyblue"],
-        height=500
-    )
-    price_hist_2.update_layout(
-        margin=dict(t=30, l=30, r=30, b=30),
-        xaxis_title="Price (PLN)",
-        yaxis_title="Number of properties"
-    )
+    price_hist_2 = price_histogram(histogram[histogram["bin_start"] >= 3_000_000], "Price distribution (≥ 3M PLN)")
 
     # barplot rooms:
-    temp_df = data.copy()
-
-    def categorize_rooms(x):
-        if pd.notnull(x):
-            return str(x) if x < 6 else "6+"
-        return "no data"
-
-    temp_df["room_group"] = temp_df["rooms"].apply(categorize_rooms)
-    
-    room_counts = temp_df["room_group"].value_counts().sort_index().reset_index()
-    room_counts.columns = ["Number of rooms", "Number of listings"]
+    room_counts = room_counts.rename(columns={"room_group": "Number of rooms", "listings": "Number of listings"})
     room_count_bar = px.bar(
         room_counts,
         x="Number of rooms",
@@ -211,14 +197,11 @@ def update_graphs(selected_cities):
     )
 
     # avg prices plot:
-    city_counts = data["city"].value_counts()
-    valid_cities = city_counts[city_counts >= 1].index # only include cities with 1 or more listings
-    filtered_city_data = data[data["city"].isin(valid_cities)]
-    city_comparison = filtered_city_data.groupby("city").agg(
-        median_price=("price", "median"),
-        median_price_per_sqr=("price_per_sqr_meter", "median"),
-        count=("price", "count")
-    ).reset_index()
+    city_comparison = city_comparison.rename(columns={
+        "price_median": "median_price",
+        "price_per_sqr_meter_median": "median_price_per_sqr",
+        "listings": "count"
+    })
     city_bar = px.bar(
         city_comparison, 
         x="city", 
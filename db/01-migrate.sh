@@ -0,0 +1,39 @@
+#!/bin/bash
+# applies db/migrations/*.sql in version order and records them in schema_migrations
+# (the scraper runs the same migrations on start, see scraper/ogloszenia_trojmiasto/migrations.py)
+set -euo pipefail
+
+MIGRATIONS_DIR="${MIGRATIONS_DIR:-/migrations}"
+DATABASE="${MYSQL_DATABASE:-ogloszenia_trojmiasto}"
+
+run_sql() {
+    mysql -u root -p"${MYSQL_ROOT_PASSWORD}" "${DATABASE}" "$@"
+}
+
+run_sql <<SQL
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    checksum CHAR(64) NOT NULL,
+    applied_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+SQL
+
+for path in $(ls "${MIGRATIONS_DIR}"/[0-9]*_*.sql | sort); do
+    file="$(basename "${path}" .sql)"
+    version=$((10#${file%%_*}))
+    name="${file#*_}"
+    checksum="$(sha256sum "${path}" | cut -d " " -f 1)"
+
+    applied="$(run_sql -N -e "SELECT checksum FROM schema_migrations WHERE version = ${version}")"
+    if [ -n "${applied}" ]; then
+        if [ "${applied}" != "${checksum}" ]; then
+            echo "Warning: migration ${version} ${name} changed after it was applied"
+        fi
+        continue
+    fi
+
+    echo "Applying migration ${version} ${name}"
+    run_sql < "${path}"
+    run_sql -e "INSERT INTO schema_migrations (version, name, checksum) VALUES (${version}, '${name}', '${checksum}')"
+done
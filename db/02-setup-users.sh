@@ -4,6 +4,14 @@ CREATE USER "scraper"@"%" IDENTIFIED BY "${SCRAPER_PASSWORD}";
 CREATE USER "backend"@"%" IDENTIFIED BY "${BACKEND_PASSWORD}";
 
 GRANT SELECT, INSERT, UPDATE ON ogloszenia_trojmiasto.* TO "scraper"@"%";
+GRANT DELETE ON ogloszenia_trojmiasto.crawl_frontier TO "scraper"@"%";
+-- aggregate tables are rewritten by the scraper at the end of every crawl
+GRANT DELETE ON ogloszenia_trojmiasto.agg_city_stats TO "scraper"@"%";
+GRANT DELETE ON ogloszenia_trojmiasto.agg_area_stats TO "scraper"@"%";
+GRANT DELETE ON ogloszenia_trojmiasto.agg_room_groups TO "scraper"@"%";
+GRANT DELETE ON ogloszenia_trojmiasto.agg_price_histogram TO "scraper"@"%";
+-- schema migrations applied by the scraper on start (see db/migrations)
+GRANT CREATE, ALTER, INDEX, DROP ON ogloszenia_trojmiasto.* TO "scraper"@"%";
 GRANT SELECT ON ogloszenia_trojmiasto.* TO "backend"@"%";
 FLUSH PRIVILEGES;
 EOF
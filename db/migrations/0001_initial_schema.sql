@@ -0,0 +1,42 @@
+-- initial schema (previously db/01-init.sql); safe to apply on databases created before migrations
+
+CREATE TABLE IF NOT EXISTS scraped_items (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    url VARCHAR(255) NOT NULL,
+    title VARCHAR(255),
+    price FLOAT,
+    price_per_sqr_meter FLOAT,
+    rooms INT,
+    floor INT,
+    square_meters FLOAT,
+    year VARCHAR(255),
+    address VARCHAR(255),
+    city VARCHAR(255),
+    area VARCHAR(255),
+    coastline_distance FLOAT,
+    gdynia_downtown_distance FLOAT,
+    gdansk_downtown_distance FLOAT,
+    sopot_downtown_distance FLOAT,
+    latitude DECIMAL(15, 12),
+    longitude DECIMAL(15, 12),
+    created_ts TIMESTAMP,
+    scraped_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_latest BOOLEAN NOT NULL DEFAULT 1,
+    UNIQUE KEY url_latest (url, is_latest)
+  );
+
+-- shared crawl frontier of scraper workers (see scraper/ogloszenia_trojmiasto/frontier.py)
+CREATE TABLE IF NOT EXISTS crawl_frontier (
+    crawl_id VARCHAR(32) NOT NULL,
+    url VARCHAR(255) NOT NULL,
+    kind VARCHAR(32) NOT NULL,
+    priority INT NOT NULL DEFAULT 0,
+    request TEXT NOT NULL,
+    status ENUM('pending', 'leased', 'done', 'failed') NOT NULL DEFAULT 'pending',
+    lease_owner VARCHAR(64),
+    lease_expires TIMESTAMP NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    updated_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (crawl_id, url),
+    KEY claim_idx (crawl_id, status, priority)
+);
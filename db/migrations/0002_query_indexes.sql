@@ -0,0 +1,8 @@
+-- indexes for every query pattern of the backend endpoints and the scraper
+-- (plans are checked by app/backend/explain_check.py); one ALTER so the table is rebuilt once
+ALTER TABLE scraped_items
+    ADD INDEX latest_city_price (is_latest, city, price), -- /listings/by-cities, /listings/cities
+    ADD INDEX latest_price (is_latest, price), -- /listings/top-expensive, /listings/top-affordable (ORDER BY price LIMIT)
+    ADD INDEX city_price_per_sqr_meter (city, price_per_sqr_meter), -- price per m2 ranges of a city
+    ADD INDEX latest_url (is_latest, url, scraped_ts), -- get_existing_urls, listing index load (covering)
+    ADD INDEX url_created (url, created_ts); -- listing history: versions and first_seen per url (covering)
@@ -0,0 +1,93 @@
+-- current listings (one row per url, updated in place) and append-only price history,
+-- replacing is_latest versioning in scraped_items (its UNIQUE (url, is_latest) key allowed
+-- only one superseded row per url)
+
+CREATE TABLE IF NOT EXISTS listings_current (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    url VARCHAR(255) NOT NULL,
+    title VARCHAR(255),
+    price FLOAT,
+    price_per_sqr_meter FLOAT,
+    rooms INT,
+    floor INT,
+    square_meters FLOAT,
+    year VARCHAR(255),
+    address VARCHAR(255),
+    city VARCHAR(255),
+    area VARCHAR(255),
+    coastline_distance FLOAT,
+    gdynia_downtown_distance FLOAT,
+    gdansk_downtown_distance FLOAT,
+    sopot_downtown_distance FLOAT,
+    latitude DECIMAL(15, 12),
+    longitude DECIMAL(15, 12),
+    created_ts TIMESTAMP NULL, -- when the current version was scraped first
+    scraped_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    first_seen_ts TIMESTAMP NULL, -- created_ts of the first version
+    versions INT NOT NULL DEFAULT 1,
+    UNIQUE KEY url (url),
+    KEY city_price (city, price), -- /listings/cities, /listings/by-cities
+    KEY price (price), -- /listings/top-expensive, /listings/top-affordable
+    KEY city_price_per_sqr_meter (city, price_per_sqr_meter)
+);
+
+CREATE TABLE IF NOT EXISTS listing_versions (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    listing_id INT NOT NULL, -- listings_current.id
+    url VARCHAR(255) NOT NULL,
+    title VARCHAR(255),
+    price FLOAT,
+    price_per_sqr_meter FLOAT,
+    rooms INT,
+    floor INT,
+    square_meters FLOAT,
+    year VARCHAR(255),
+    address VARCHAR(255),
+    city VARCHAR(255),
+    area VARCHAR(255),
+    coastline_distance FLOAT,
+    gdynia_downtown_distance FLOAT,
+    gdansk_downtown_distance FLOAT,
+    sopot_downtown_distance FLOAT,
+    latitude DECIMAL(15, 12),
+    longitude DECIMAL(15, 12),
+    created_ts TIMESTAMP NULL,
+    KEY listing_created (listing_id, created_ts)
+);
+
+-- latest row of every url (is_latest = 1, or the newest one if the flag was lost) keeps its id
+INSERT INTO listings_current (
+    id, url, title, price, price_per_sqr_meter, rooms, floor, square_meters, year, address, city, area,
+    coastline_distance, gdynia_downtown_distance, gdansk_downtown_distance, sopot_downtown_distance,
+    latitude, longitude, created_ts, scraped_ts, first_seen_ts, versions
+)
+SELECT
+    id, url, title, price, price_per_sqr_meter, rooms, floor, square_meters, year, address, city, area,
+    coastline_distance, gdynia_downtown_distance, gdansk_downtown_distance, sopot_downtown_distance,
+    latitude, longitude, created_ts, scraped_ts, first_seen_ts, versions
+FROM (
+    SELECT
+        s.*,
+        ROW_NUMBER() OVER (PARTITION BY url ORDER BY is_latest DESC, created_ts DESC, id DESC) AS version_rank,
+        MIN(created_ts) OVER (PARTITION BY url) AS first_seen_ts,
+        COUNT(*) OVER (PARTITION BY url) AS versions
+    FROM scraped_items s
+) ranked
+WHERE version_rank = 1;
+
+-- every row is a version, in the order they were scraped
+INSERT INTO listing_versions (
+    listing_id, url, title, price, price_per_sqr_meter, rooms, floor, square_meters, year, address, city, area,
+    coastline_distance, gdynia_downtown_distance, gdansk_downtown_distance, sopot_downtown_distance,
+    latitude, longitude, created_ts
+)
+SELECT
+    c.id, s.url, s.title, s.price, s.price_per_sqr_meter, s.rooms, s.floor, s.square_meters, s.year, s.address,
+    s.city, s.area, s.coastline_distance, s.gdynia_downtown_distance, s.gdansk_downtown_distance,
+    s.sopot_downtown_distance, s.latitude, s.longitude, s.created_ts
+FROM scraped_items s
+JOIN listings_current c ON c.url = s.url
+ORDER BY s.created_ts, s.id;
+
+-- kept for a manual check of the migrated data, can be dropped afterwards
+RENAME TABLE scraped_items TO scraped_items_legacy;
@@ -0,0 +1,60 @@
+-- monthly range partitions of listing_versions by created_ts (UTC months, bounds as unix timestamps)
+-- so expired months can be archived and dropped without touching the rest of the table
+-- (scraper/ogloszenia_trojmiasto/archive.py). p_start holds versions before 2024, monthly partitions
+-- pYYYYMM are created here up to 2026-12 and split off the empty p_future ahead of time by the same job.
+-- Partitioning copies the table once, while the migration runs on scraper start (not during a crawl)
+
+-- partitioning column has to be a part of the primary key, so it can't be NULL
+UPDATE listing_versions v
+JOIN listings_current c ON c.id = v.listing_id
+SET v.created_ts = COALESCE(c.first_seen_ts, c.scraped_ts)
+WHERE v.created_ts IS NULL;
+
+UPDATE listing_versions SET created_ts = FROM_UNIXTIME(1) WHERE created_ts IS NULL;
+
+ALTER TABLE listing_versions
+    MODIFY created_ts TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (id, created_ts);
+
+ALTER TABLE listing_versions
+    PARTITION BY RANGE (UNIX_TIMESTAMP(created_ts)) (
+        PARTITION p_start VALUES LESS THAN (1704067200), -- 2024-01-01 00:00 UTC
+        PARTITION p202401 VALUES LESS THAN (1706745600), -- 2024-02-01
+        PARTITION p202402 VALUES LESS THAN (1709251200), -- 2024-03-01
+        PARTITION p202403 VALUES LESS THAN (1711929600), -- 2024-04-01
+        PARTITION p202404 VALUES LESS THAN (1714521600), -- 2024-05-01
+        PARTITION p202405 VALUES LESS THAN (1717200000), -- 2024-06-01
+        PARTITION p202406 VALUES LESS THAN (1719792000), -- 2024-07-01
+        PARTITION p202407 VALUES LESS THAN (1722470400), -- 2024-08-01
+        PARTITION p202408 VALUES LESS THAN (1725148800), -- 2024-09-01
+        PARTITION p202409 VALUES LESS THAN (1727740800), -- 2024-10-01
+        PARTITION p202410 VALUES LESS THAN (1730419200), -- 2024-11-01
+        PARTITION p202411 VALUES LESS THAN (1733011200), -- 2024-12-01
+        PARTITION p202412 VALUES LESS THAN (1735689600), -- 2025-01-01
+        PARTITION p202501 VALUES LESS THAN (1738368000), -- 2025-02-01
+        PARTITION p202502 VALUES LESS THAN (1740787200), -- 2025-03-01
+        PARTITION p202503 VALUES LESS THAN (1743465600), -- 2025-04-01
+        PARTITION p202504 VALUES LESS THAN (1746057600), -- 2025-05-01
+        PARTITION p202505 VALUES LESS THAN (1748736000), -- 2025-06-01
+        PARTITION p202506 VALUES LESS THAN (1751328000), -- 2025-07-01
+        PARTITION p202507 VALUES LESS THAN (1754006400), -- 2025-08-01
+        PARTITION p202508 VALUES LESS THAN (1756684800), -- 2025-09-01
+        PARTITION p202509 VALUES LESS THAN (1759276800), -- 2025-10-01
+        PARTITION p202510 VALUES LESS THAN (1761955200), -- 2025-11-01
+        PARTITION p202511 VALUES LESS THAN (1764547200), -- 2025-12-01
+        PARTITION p202512 VALUES LESS THAN (1767225600), -- 2026-01-01
+        PARTITION p202601 VALUES LESS THAN (1769904000), -- 2026-02-01
+        PARTITION p202602 VALUES LESS THAN (1772323200), -- 2026-03-01
+        PARTITION p202603 VALUES LESS THAN (1775001600), -- 2026-04-01
+        PARTITION p202604 VALUES LESS THAN (1777593600), -- 2026-05-01
+        PARTITION p202605 VALUES LESS THAN (1780272000), -- 2026-06-01
+        PARTITION p202606 VALUES LESS THAN (1782864000), -- 2026-07-01
+        PARTITION p202607 VALUES LESS THAN (1785542400), -- 2026-08-01
+        PARTITION p202608 VALUES LESS THAN (1788220800), -- 2026-09-01
+        PARTITION p202609 VALUES LESS THAN (1790812800), -- 2026-10-01
+        PARTITION p202610 VALUES LESS THAN (1793491200), -- 2026-11-01
+        PARTITION p202611 VALUES LESS THAN (1796083200), -- 2026-12-01
+        PARTITION p202612 VALUES LESS THAN (1798761600), -- 2027-01-01
+        PARTITION p_future VALUES LESS THAN MAXVALUE
+    );
@@ -0,0 +1,52 @@
+-- aggregates of listings_current served by the backend (/aggregates/...), refreshed by the scraper
+-- at the end of every crawl (scraper/ogloszenia_trojmiasto/aggregates.py). Only listings with price,
+-- area and city are counted, the same ones /listings/by-cities returns
+
+CREATE TABLE IF NOT EXISTS agg_city_stats (
+    city VARCHAR(255) NOT NULL,
+    listings INT NOT NULL,
+    price_p25 FLOAT,
+    price_median FLOAT,
+    price_p75 FLOAT,
+    price_per_sqr_meter_p25 FLOAT,
+    price_per_sqr_meter_median FLOAT,
+    price_per_sqr_meter_p75 FLOAT,
+    PRIMARY KEY (city)
+);
+
+CREATE TABLE IF NOT EXISTS agg_area_stats (
+    city VARCHAR(255) NOT NULL,
+    area VARCHAR(255) NOT NULL, -- '' for listings without area
+    listings INT NOT NULL,
+    price_p25 FLOAT,
+    price_median FLOAT,
+    price_p75 FLOAT,
+    price_per_sqr_meter_p25 FLOAT,
+    price_per_sqr_meter_median FLOAT,
+    price_per_sqr_meter_p75 FLOAT,
+    PRIMARY KEY (city, area)
+);
+
+CREATE TABLE IF NOT EXISTS agg_room_groups (
+    city VARCHAR(255) NOT NULL,
+    room_group VARCHAR(16) NOT NULL, -- 1 ... 5, 6+, no data
+    listings INT NOT NULL,
+    PRIMARY KEY (city, room_group)
+);
+
+-- fixed price bins: 30 000 PLN below 3M, 250 000 PLN from 3M (only non-empty bins are stored)
+CREATE TABLE IF NOT EXISTS agg_price_histogram (
+    city VARCHAR(255) NOT NULL,
+    bin_start INT NOT NULL,
+    bin_end INT NOT NULL,
+    listings INT NOT NULL,
+    PRIMARY KEY (city, bin_start)
+);
+
+CREATE TABLE IF NOT EXISTS aggregate_refreshes (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    mode ENUM('full', 'incremental') NOT NULL,
+    cities INT NOT NULL,
+    refreshed_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    KEY mode_refreshed (mode, refreshed_ts)
+);
@@ -0,0 +1,68 @@
+"""
+geocoding cache keys: cleaned addresses (previous keys) vs canonical address keys
+
+reads a corpus of cleaned addresses - by default all rows of listing_versions (connection from
+DB_* env variables), or one address per line from --file - and reports the number of distinct
+keys and the hit rate of an initially empty, unbounded geocoding cache over the corpus.
+The canonical keys merging most spelling variants are listed for a manual check
+
+run from the scraper directory:
+    python -m benchmarks.address_keys [--file benchmarks/fixtures/addresses.txt] [--show 10]
+"""
+import argparse
+from collections import defaultdict
+
+from ogloszenia_trojmiasto.address_keys import address_key
+
+def load_from_db():
+    from ogloszenia_trojmiasto.db_helper import DatabaseHelper
+
+    db_helper = DatabaseHelper()
+    try:
+        # every scraped version of a listing was geocoded, so all rows are lookups
+        query = "SELECT address FROM listing_versions WHERE address IS NOT NULL ORDER BY created_ts, id"
+        return [address for (address,) in db_helper.iter_rows(query)]
+    finally:
+        db_helper.close()
+
+def load_from_file(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def cache_report(keys: list) -> dict:
+    distinct = len(set(keys))
+    return {
+        "distinct_keys": distinct,
+        "hit_rate": (len(keys) - distinct) / len(keys) if keys else 0.0 # every first occurrence is a miss
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="distinct geocoding keys and cache hit rate before/after canonicalization")
+    parser.add_argument("--file", help="cleaned addresses, one per line (default: listing_versions table)")
+    parser.add_argument("--show", type=int, default=10, help="number of merged keys to list")
+    args = parser.parse_args()
+
+    addresses = load_from_file(args.file) if args.file else load_from_db()
+    if not addresses:
+        print("no addresses found")
+        return
+
+    before = cache_report(addresses)
+    after = cache_report([address_key(address) for address in addresses])
+    print(f"addresses:        {len(addresses)}")
+    print(f"{'':18}{'distinct keys':>15}{'hit rate':>10}")
+    print(f"{'cleaned address':18}{before['distinct_keys']:>15}{before['hit_rate']:>10.1%}")
+    print(f"{'canonical key':18}{after['distinct_keys']:>15}{after['hit_rate']:>10.1%}")
+
+    variants = defaultdict(set)
+    for address in addresses:
+        variants[address_key(address)].add(address)
+    merged = sorted(variants.items(), key=lambda entry: len(entry[1]), reverse=True)[:args.show]
+    if merged and len(merged[0][1]) > 1:
+        print("\nmost merged keys:")
+        for key, group in merged:
+            if len(group) > 1:
+                print(f"  {key}: {' / '.join(sorted(group))}")
+
+if __name__ == "__main__":
+    main()
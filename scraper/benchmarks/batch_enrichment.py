@@ -0,0 +1,159 @@
+"""
+micro-benchmark of item enrichment: per-item pipelines (CleaningPipeline, PricePipeline,
+get_all_geodata) vs BatchEnrichmentPipeline's vectorized batches of 1, 64 and 1024 items
+
+geocoding is served from a temporary cache filled beforehand (no nominatim requests) and
+distances from a distance grid built over the Tricity (some addresses lie outside of it
+and fall back to exact calculations). Both paths have to return the same items
+
+run from the scraper directory:
+    python -m benchmarks.batch_enrichment [--items 4096] [--batch-sizes 1 64 1024]
+"""
+import argparse
+import copy
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from ogloszenia_trojmiasto import geodistance
+from ogloszenia_trojmiasto.distance_grid import build_distance_grid
+from ogloszenia_trojmiasto.enrichment import clean_address, enrich_items
+from ogloszenia_trojmiasto.geodistance import geocoding_cache, get_all_geodata
+from ogloszenia_trojmiasto.pipelines import CleaningPipeline, PricePipeline
+
+# grid covers the Tricity, addresses are spread over a slightly larger box
+GRID_BBOX = (54.33, 54.56, 18.45, 18.68)
+ADDRESS_BBOX = (54.30, 54.62, 18.40, 18.72)
+
+CITIES = ["Gdańsk", "Gdynia", "Sopot", "Rumia", "Reda"]
+STREETS = ["Grunwaldzka", "Świętojańska", "Morska", "Abrahama", "Kościuszki", "Chwaszczyńska", "Słowackiego"]
+
+def format_price(value):
+    return f"{value:,}".replace(",", " ") + " zł"
+
+def make_items(n: int, n_addresses: int, seed: int = 0):
+    """
+    raw items as yielded by the spider, including the edge cases of the converters
+    """
+    rng = random.Random(seed)
+    addresses = []
+    for i in range(n_addresses):
+        city = rng.choice(CITIES)
+        address = [f"{city}, {rng.choice(STREETS)} {i} ", "(gm) "]
+        if rng.random() < 0.3:
+            address = [f"{city} {city}, ", f"{rng.choice(STREETS)} {i}"] # duplicated words
+        addresses.append(address)
+
+    items = []
+    for i in range(n):
+        square_meters = round(rng.uniform(20, 140), rng.choice([0, 1, 2]))
+        price = rng.randrange(250_000, 2_500_000, 1000)
+        item = {
+            "url": f"https://ogloszenia.trojmiasto.pl/nieruchomosci/ogl{i}.html",
+            "title": f"Mieszkanie {i}",
+            "address": list(rng.choice(addresses)),
+            "price": format_price(price),
+            "price_per_sqr_meter": f"{price / square_meters:.2f}".replace(".", ","),
+            "square_meters": f"{square_meters}".replace(".", ","),
+            "rooms": str(rng.randint(1, 6)),
+            "floor": rng.choice(["Parter", "1", "2", "3", "4", "10"]),
+            "year": str(rng.randint(1950, 2024)),
+            "scraped_ts": datetime(2024, 1, 1)
+        }
+        case = rng.random()
+        if case < 0.1:
+            item["price"] = None # filled in from price per m2
+        elif case < 0.2:
+            item["price_per_sqr_meter"] = None # filled in from price
+        elif case < 0.25:
+            item["square_meters"] = None
+        elif case < 0.3:
+            item["floor"] = rng.choice(["", "poddasze", " 3"]) # not convertible / scalar fallback
+        elif case < 0.32:
+            item["price"] = "Zapytaj o cenę"
+        elif case < 0.34:
+            item["address"] = []
+        items.append(item)
+    return items, addresses
+
+def fill_geocoding_cache(addresses, seed: int = 0):
+    """
+    fake locations of all addresses; every 20th address is cached as not found
+    """
+    rng = random.Random(seed)
+    lat_min, lat_max, lon_min, lon_max = ADDRESS_BBOX
+    geocoding_cache.set("", None) # listings without address
+    for i, address in enumerate(addresses):
+        key = clean_address(address)
+        if i % 20 == 0:
+            geocoding_cache.set(key, None)
+            continue
+        geocoding_cache.set(key, {
+            "latitude": rng.uniform(lat_min, lat_max),
+            "longitude": rng.uniform(lon_min, lon_max),
+            "area": f"Dzielnica {i % 12}",
+            "city": key.split(",")[0]
+        })
+
+def enrich_per_item(items, distance_grid):
+    cleaning, price = CleaningPipeline(), PricePipeline()
+    for item in items:
+        cleaning.process_item(item, None)
+        price.process_item(item, None)
+        item.update(get_all_geodata(item["address"], None, distance_grid))
+    return items
+
+def enrich_batched(items, distance_grid, batch_size):
+    results = []
+    for i in range(0, len(items), batch_size):
+        results += enrich_items(items[i:i + batch_size], distance_grid)
+    return results
+
+def without_created_ts(items):
+    return [{key: value for key, value in item.items() if key != "created_ts"} for item in items]
+
+def timed(run, items, repeat):
+    """
+    best of `repeat` runs on fresh copies of the raw items, returns (items/s, last output)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        batch = copy.deepcopy(items)
+        start = time.perf_counter()
+        output = run(batch)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best, output
+
+def main():
+    parser = argparse.ArgumentParser(description="per-item vs batched item enrichment")
+    parser.add_argument("--items", type=int, default=4096)
+    parser.add_argument("--addresses", type=int, default=500, help="number of distinct addresses")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 64, 1024])
+    parser.add_argument("--grid-step", type=float, default=0.01, help="distance grid step [deg]")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        geocoding_cache.configure(path=os.path.join(tmp, "geocoding.sqlite"))
+        items, addresses = make_items(args.items, args.addresses)
+        fill_geocoding_cache(addresses)
+
+        start = time.perf_counter()
+        distance_grid = build_distance_grid(geodistance.get_coastline(), os.path.join(tmp, "grid"), GRID_BBOX, args.grid_step)
+        print(f"distance grid {distance_grid.values.shape[:2]} built in {time.perf_counter() - start:.1f} s")
+
+        per_item, expected = timed(lambda batch: enrich_per_item(batch, distance_grid), items, args.repeat)
+        expected = without_created_ts(expected)
+        print(f"per item:         {per_item:10.0f} items/s")
+
+        for batch_size in args.batch_sizes:
+            throughput, output = timed(lambda batch: enrich_batched(batch, distance_grid, batch_size), items, args.repeat)
+            assert without_created_ts(output) == expected, f"batch size {batch_size}: different results than per item path"
+            print(f"batch size {batch_size:>5}: {throughput:10.0f} items/s ({throughput / per_item:.1f}x)")
+
+        geocoding_cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+benchmark of coastline distance lookups: spatial index vs linear scan over coastline parts
+
+run from the scraper directory:
+    python -m benchmarks.coastline_distance [n_points]
+"""
+import random
+import sys
+import time
+
+from shapely.geometry import Point
+from shapely.ops import nearest_points
+from ogloszenia_trojmiasto.geodistance import load_coastline, calculate_distance
+
+# Pomeranian bounding box where most listings are located
+BBOX = {"lat": (54.05, 54.85), "lon": (17.9, 19.1)}
+
+def linear_coastline_distance(address_point, coastline) -> float:
+    """
+    previous implementation - nearest point on every coastline part
+    """
+    min_distance = float("inf")
+    for line in coastline.geoms:
+        nearest_point = nearest_points(address_point, line)[1]
+        distance = calculate_distance(
+            (address_point.y, address_point.x), (nearest_point.y, nearest_point.x)
+            )
+        min_distance = min(min_distance, distance)
+
+    return min_distance
+
+def main(n_points: int = 500):
+    random.seed(0)
+    points = [
+        Point(random.uniform(*BBOX["lon"]), random.uniform(*BBOX["lat"]))
+        for _ in range(n_points)
+    ]
+
+    start = time.perf_counter()
+    index = load_coastline()
+    print(f"coastline load + index build: {time.perf_counter() - start:.2f} s ({len(index.segments)} segments)")
+
+    start = time.perf_counter()
+    linear = [linear_coastline_distance(p, index.coastline) for p in points]
+    linear_time = (time.perf_counter() - start) / n_points
+
+    start = time.perf_counter()
+    indexed = [index.distance(p) for p in points]
+    indexed_time = (time.perf_counter() - start) / n_points
+
+    errors = [abs(a - b) for a, b in zip(linear, indexed)]
+    print(f"linear scan:   {linear_time * 1000:.3f} ms/item")
+    print(f"spatial index: {indexed_time * 1000:.3f} ms/item ({linear_time / indexed_time:.1f}x faster)")
+    print(f"abs difference [km]: mean {sum(errors) / n_points:.4f}, max {max(errors):.4f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,28 @@
+"""
+benchmark of coastline startup time: clipping the source shapefiles vs loading the cached artifact
+
+run from the scraper directory:
+    python -m benchmarks.coastline_startup
+"""
+import resource
+import tempfile
+import time
+
+from ogloszenia_trojmiasto.geodistance import load_coastline
+
+def timed_load(cache_dir: str) -> float:
+    start = time.perf_counter()
+    load_coastline(cache_dir)
+    return time.perf_counter() - start
+
+def main():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = timed_load(cache_dir) # no artifact yet - shapefiles are read, dissolved and clipped
+        cold_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        warm = timed_load(cache_dir) # artifact loaded from WKB
+
+    print(f"clip from shapefiles: {cold:.2f} s (peak RSS {cold_rss:.0f} MB)")
+    print(f"cached artifact:      {warm:.2f} s ({cold / warm:.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
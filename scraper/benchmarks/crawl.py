@@ -0,0 +1,413 @@
+"""
+offline end-to-end crawl benchmark
+
+OgloszeniaSpider runs with the project settings and the real ITEM_PIPELINES against
+fixture pages served from a local HTTP server. Nominatim is replaced by a local fake
+service and MySQL by an in-memory stand-in (or a disposable database with --db mysql,
+connection taken from DB_* env variables - don't point it at production data).
+
+Reports pages/s, items/s, peak RSS, download latency percentiles and per-stage metrics of
+pipelines and callbacks (ogloszenia_trojmiasto.metrics) to a JSON file, compared with
+a previous result when --baseline is given (exit code 1 on regression).
+
+run from the scraper directory:
+    python -m benchmarks.crawl [--pages 20] [--output results.json] [--baseline old.json]
+    python -m benchmarks.crawl --db mysql --workers 3 # sharded crawl through the crawl frontier
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+from geopy.geocoders import Nominatim
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from ogloszenia_trojmiasto import geodistance, state
+from ogloszenia_trojmiasto.aggregates import LISTING_COLUMNS, compute_aggregates
+from ogloszenia_trojmiasto.metrics import registry
+from ogloszenia_trojmiasto.spiders.ogloszenia import OgloszeniaSpider
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SITE_URL = "https://ogloszenia.trojmiasto.pl"
+START_PATHS = [
+    "/nieruchomosci-rynek-wtorny/mieszkanie/",
+    "/nieruchomosci-rynek-pierwotny/mieszkanie/"
+]
+LISTING_PATTERN = re.compile(r"ogl(\d+)\.html")
+
+# Tricity bounding box for fake geocoding results
+GEOCODING_BBOX = {"lat": (54.33, 54.56), "lon": (18.45, 18.68)}
+
+def make_site_handler(pages: int, addresses: int):
+    """
+    serves list pages (`pages` per start path, then an empty page) and detail pages rendered
+    from the fixtures; every listing gets a unique url, price and one of `addresses` addresses
+    """
+    with open(os.path.join(FIXTURES_DIR, "list.html"), encoding="utf-8") as f:
+        list_page = f.read()
+    with open(os.path.join(FIXTURES_DIR, "detail.html"), encoding="utf-8") as f:
+        detail_page = f.read()
+    empty_page = re.sub(r'<div class="list__items">.*?</div>\s*<div class="pages">', '<div class="pages">', list_page, flags=re.S)
+
+    def render_list(path, page, base_url):
+        if page > pages:
+            body = empty_page
+        else:
+            listing_ids = count(START_PATHS.index(path) * 1_000_000 + page * 100)
+            body = LISTING_PATTERN.sub(lambda m: f"ogl{next(listing_ids)}.html", list_page)
+        body = body.replace("strona=120", f"strona={pages}").replace(">120<", f">{pages}<")
+        body = re.sub(r'(pages__controls--right"><a href="[^"]*strona=)\d+', rf"\g<1>{page + 1}", body)
+        return body.replace(START_PATHS[0], path).replace(SITE_URL, base_url)
+
+    def render_detail(listing_id):
+        body = detail_page.replace("749 000 zł", f"{500 + listing_id % 500} 000 zł")
+        address = int(hashlib.md5(str(listing_id).encode()).hexdigest(), 16) % addresses + 1
+        return body.replace("de Gaulle'a", f"de Gaulle'a {address}")
+
+    class SiteHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            base_url = f"http://{self.headers['Host']}"
+            if url.path in START_PATHS:
+                page = int(parse_qs(url.query).get("strona", ["1"])[0])
+                self.send_body(render_list(url.path, page, base_url))
+            elif match := LISTING_PATTERN.search(url.path):
+                self.send_body(render_detail(int(match.group(1))))
+            else:
+                self.send_error(404)
+
+        def send_body(self, body):
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SiteHandler
+
+def make_nominatim_handler(latency: float):
+    """
+    fake nominatim /search endpoint - deterministic location inside the Tricity for every query
+    """
+    class NominatimHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+            digest = hashlib.sha1(query.encode("utf-8")).digest()
+            lat = GEOCODING_BBOX["lat"][0] + digest[0] / 255 * (GEOCODING_BBOX["lat"][1] - GEOCODING_BBOX["lat"][0])
+            lon = GEOCODING_BBOX["lon"][0] + digest[1] / 255 * (GEOCODING_BBOX["lon"][1] - GEOCODING_BBOX["lon"][0])
+            result = [{
+                "lat": f"{lat:.7f}",
+                "lon": f"{lon:.7f}",
+                "display_name": query,
+                "address": {"city": query.split()[0] if query else "Gdańsk", "suburb": "Wrzeszcz"}
+            }]
+
+            time.sleep(latency)
+            data = json.dumps(result).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return NominatimHandler
+
+def serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_port}"
+
+class MemoryDatabase:
+    """
+    in-memory stand-in for DatabaseHelper keeping the current version of every listing
+    """
+    def __init__(self):
+        self.rows = {} # url -> (id, item, versions, first_seen)
+        self.ids = count(1)
+        self.aggregates = {}
+
+    def ensure_connection(self):
+        pass
+
+    def iter_latest_listings(self, batch_size=10_000):
+        for url, (row_id, item, versions, first_seen) in self.rows.items():
+            yield (
+                row_id, url, item["scraped_ts"], item["price"], item["price_per_sqr_meter"],
+                item["square_meters"], versions, first_seen
+            )
+
+    def write_batch(self, new_items, changed_items, unchanged_urls):
+        ids = {}
+        for item in new_items:
+            if item["url"] not in self.rows:
+                self.rows[item["url"]] = (next(self.ids), dict(item), 1, item["created_ts"])
+        for item in changed_items:
+            if item["url"] in self.rows:
+                row_id, _, versions, first_seen = self.rows[item["url"]]
+                self.rows[item["url"]] = (row_id, dict(item), versions + 1, first_seen)
+        for item in (*new_items, *changed_items):
+            if item["url"] in self.rows:
+                ids[item["url"]] = self.rows[item["url"]][0]
+        counts = {
+            "updated": len(changed_items),
+            "inserted": len(new_items),
+            "versions": len(ids),
+            "touched": len(unchanged_urls)
+        }
+        return counts, ids
+
+    def update_scraped_ts_many(self, urls):
+        pass
+
+    def refresh_aggregates(self, cities=None, full_refresh_days=7):
+        listings = pd.DataFrame([item for _, item, _, _ in self.rows.values()], columns=LISTING_COLUMNS)
+        self.aggregates = compute_aggregates(listings) # always a full refresh
+        return "full", len(self.aggregates["agg_city_stats"])
+
+    def close(self):
+        pass
+
+class Recorder:
+    """
+    download latency samples (seconds); pipelines and callbacks are timed by the metrics registry
+    """
+    def __init__(self):
+        self.samples = {"download": []}
+
+    def response_received(self, response, request, spider):
+        if "download_latency" in request.meta:
+            self.samples["download"].append(request.meta["download_latency"])
+
+def benchmark_spider(site_url, recorder):
+    class BenchmarkSpider(OgloszeniaSpider):
+        allowed_domains = [urlparse(site_url).hostname]
+        start_urls = [site_url + path for path in START_PATHS]
+
+        @classmethod
+        def from_crawler(cls, crawler, *args, **kwargs):
+            spider = super().from_crawler(crawler, *args, **kwargs)
+            crawler.signals.connect(recorder.response_received, signal=signals.response_received)
+            return spider
+
+    return BenchmarkSpider
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3)
+    }
+
+def run_crawl(args, site_url, nominatim_host, cache_dir):
+    """
+    run one crawl in this process, returns result dict with raw latency samples
+    """
+    geodistance.geolocator = Nominatim(user_agent="geo_distance_benchmark", domain=nominatim_host, scheme="http")
+    if args.db == "memory":
+        state.set_db_helper(MemoryDatabase())
+
+    settings = get_project_settings()
+    settings.set("LOG_FILE", None)
+    settings.set("LOG_STDOUT", False) # keep the report on stdout
+    settings.set("LOG_LEVEL", args.log_level)
+    settings.set("TELNETCONSOLE_ENABLED", False)
+    settings.set("DOWNLOAD_DELAY", args.download_delay)
+    settings.set("CONCURRENT_REQUESTS", args.concurrency)
+    settings.set("CONCURRENT_REQUESTS_PER_DOMAIN", args.concurrency)
+    settings.set("GEOCODING_RATE", 1000.0) # no usage policy for the fake service
+    settings.set("GEOCODING_CACHE_PATH", os.path.join(cache_dir, "geocoding.sqlite"))
+    settings.set("GAZETTEER_PATH", args.gazetteer or os.path.join(cache_dir, "gazetteer.sqlite")) # missing file - disabled
+    settings.set("CONDITIONAL_REQUESTS_PATH", os.path.join(cache_dir, "http_validators.sqlite"))
+    settings.set("METRICS_ENABLED", True)
+    settings.set("METRICS_PORT", 0)
+    settings.set("LOG_DIR", cache_dir) # metrics summary is included in the results instead
+    if args.distance_grid is not None:
+        settings.set("DISTANCE_GRID_PATH", args.distance_grid or None)
+
+    recorder = Recorder()
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(benchmark_spider(site_url, recorder))
+    process.crawl(crawler)
+
+    start = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - start
+
+    stats = crawler.stats.get_stats()
+    return {
+        "elapsed_s": elapsed,
+        "pages": stats.get("response_received_count", 0),
+        "items": stats.get("item_scraped_count", 0),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # kB on linux
+        "samples": recorder.samples,
+        "stages": registry.summary()["stages"],
+        "stats": {
+            key: value for key, value in stats.items()
+            if key.startswith(("db/", "aggregates/", "geocoding_cache/", "geocoding/", "gazetteer/", "pagination/", "frontier/", "item_dropped", "log_count/ERROR"))
+        }
+    }
+
+def run_workers(args, site_url, nominatim_host):
+    """
+    sharded crawl - worker processes share the crawl through the crawl frontier
+    """
+    crawl_id = f"bench-{datetime.now():%H%M%S}"
+    env = {**os.environ, "FRONTIER_ENABLED": "1", "FRONTIER_CRAWL_ID": crawl_id, "SCRAPER_WORKERS": str(args.workers)}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workers = []
+        for worker in range(args.workers):
+            output = os.path.join(tmp_dir, f"worker_{worker}.json")
+            command = [
+                sys.executable, "-m", "benchmarks.crawl", "--db", "mysql", "--worker-output", output,
+                "--site", site_url, "--nominatim", nominatim_host, "--concurrency", str(args.concurrency),
+                "--download-delay", str(args.download_delay), "--log-level", args.log_level
+            ]
+            if args.gazetteer:
+                command += ["--gazetteer", args.gazetteer]
+            workers.append((subprocess.Popen(command, env={**env, "SCRAPER_WORKER_ID": f"{crawl_id}-{worker}"}), output))
+
+        start = time.perf_counter()
+        for process, _ in workers:
+            process.wait()
+        elapsed = time.perf_counter() - start
+
+        results = []
+        for process, output in workers:
+            if process.returncode != 0:
+                raise RuntimeError(f"worker failed with exit code {process.returncode}")
+            with open(output) as f:
+                results.append(json.load(f))
+
+    return {
+        "elapsed_s": elapsed,
+        "pages": sum(result["pages"] for result in results),
+        "items": sum(result["items"] for result in results),
+        "peak_rss_mb": max(result["peak_rss_mb"] for result in results),
+        "samples": {
+            stage: [sample for result in results for sample in result["samples"][stage]]
+            for stage in results[0]["samples"]
+        },
+        "stages": {"workers": [result["stages"] for result in results]},
+        "stats": {"workers": [result["stats"] for result in results]}
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(result, baseline_path, tolerance):
+    """
+    print throughput change against a previous result, returns False on regression
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    ok = True
+    for metric in ("pages_per_s", "items_per_s"):
+        change = result[metric] / baseline[metric] - 1 if baseline.get(metric) else 0
+        print(f"{metric}: {baseline.get(metric)} -> {result[metric]} ({change:+.1%})")
+        if change < -tolerance:
+            ok = False
+    return ok
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="offline end-to-end crawl benchmark")
+    parser.add_argument("--pages", type=int, default=20, help="list pages per start url")
+    parser.add_argument("--addresses", type=int, default=50, help="number of distinct listing addresses")
+    parser.add_argument("--geocoding-latency", type=float, default=0.0, help="fake nominatim response time [s]")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--download-delay", type=float, default=0.0)
+    parser.add_argument("--db", choices=["memory", "mysql"], default="memory")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (requires --db mysql)")
+    parser.add_argument("--distance-grid", help="distance grid dir (empty string disables the grid)")
+    parser.add_argument("--gazetteer", help="offline gazetteer file (not used by default)")
+    parser.add_argument("--output", default="crawl_benchmark.json")
+    parser.add_argument("--baseline", help="previous result to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative throughput drop")
+    parser.add_argument("--log-level", default="WARNING")
+    # used by worker processes of a sharded run
+    parser.add_argument("--site", help=argparse.SUPPRESS)
+    parser.add_argument("--nominatim", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.workers > 1 and args.db != "mysql":
+        sys.exit("--workers requires --db mysql (workers share the crawl frontier table)")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if args.worker_output: # worker process of a sharded run
+            result = run_crawl(args, args.site, args.nominatim, cache_dir)
+            with open(args.worker_output, "w") as f:
+                json.dump(result, f, default=str)
+            return
+
+        site, site_host = serve(make_site_handler(args.pages, args.addresses))
+        nominatim, nominatim_host = serve(make_nominatim_handler(args.geocoding_latency))
+        if args.workers > 1:
+            result = run_workers(args, f"http://{site_host}", nominatim_host)
+        else:
+            result = run_crawl(args, f"http://{site_host}", nominatim_host, cache_dir)
+        site.shutdown()
+        nominatim.shutdown()
+
+    samples = result.pop("samples")
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("site", "nominatim", "worker_output")},
+        **result,
+        "pages_per_s": round(result["pages"] / result["elapsed_s"], 2),
+        "items_per_s": round(result["items"] / result["elapsed_s"], 2),
+        "latency": {stage: percentiles(values) for stage, values in samples.items()}
+    }
+    result["elapsed_s"] = round(result["elapsed_s"], 3)
+    result["peak_rss_mb"] = round(result["peak_rss_mb"], 1)
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, default=str)
+
+    print(f"{result['pages']} pages, {result['items']} items in {result['elapsed_s']} s")
+    print(f"pages/s: {result['pages_per_s']}, items/s: {result['items_per_s']}, peak RSS: {result['peak_rss_mb']} MB")
+    for stage, summary in result["latency"].items():
+        print(f"  {stage}: {summary}")
+    for stage, summary in result["stages"].items():
+        print(f"  {stage}: {summary}")
+    print(f"results written to {args.output}")
+
+    if args.baseline and not compare(result, args.baseline, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
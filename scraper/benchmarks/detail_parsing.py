@@ -0,0 +1,75 @@
+"""
+micro-benchmark of detail page extraction: one :contains() css query per field vs
+single pass over the parameter block
+
+run from the scraper directory:
+    python -m benchmarks.detail_parsing [saved_page.html ...]
+"""
+import os
+import sys
+import time
+
+from scrapy.http import HtmlResponse
+from ogloszenia_trojmiasto.spiders.ogloszenia import extract_detail_fields
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# previous selector strategy
+CSS_FIELDS = {
+    "title": "h1.xogIndex__title::text",
+    "price": ".xogParams p::text",
+    "rooms": "span:contains('Liczba pokoi') + span::text",
+    "floor": "span:contains('Piętro') + span::text",
+    "year": "span:contains('Rok budowy') + span::text",
+    "price_per_sqr_meter": "span:contains('Cena za m') + span::text",
+    "square_meters": "span:contains('Pow. nieruchomości') + span::text",
+    "address": "i.trm.trm-location + span::text"
+}
+
+def extract_with_css(response):
+    fields = {}
+    for field, selector in CSS_FIELDS.items():
+        if field == "address":
+            fields[field] = response.css(selector).getall()
+        else:
+            value = response.css(selector).get()
+            fields[field] = value.strip() if value else None
+    return fields
+
+def timed(extract, responses, repeat):
+    """
+    average extraction time per page (documents are parsed beforehand)
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for response in responses:
+            extract(response)
+    return (time.perf_counter() - start) / (repeat * len(responses))
+
+def main(paths, repeat: int = 200):
+    pages = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pages.append((f"file://{os.path.abspath(path)}", f.read()))
+
+    # both strategies have to return the same values
+    for url, body in pages:
+        response = HtmlResponse(url, body=body, encoding="utf-8")
+        fields, missing = extract_detail_fields(response)
+        assert fields == extract_with_css(response), f"different results for {url}"
+        print(f"{os.path.basename(url)}: missing fields {missing or 'none'}")
+
+    start = time.perf_counter()
+    responses = [HtmlResponse(url, body=body, encoding="utf-8") for url, body in pages]
+    for response in responses:
+        response.selector # parse html
+    parse_time = (time.perf_counter() - start) / len(responses)
+
+    baseline = timed(extract_with_css, responses, repeat)
+    single_pass = timed(lambda response: extract_detail_fields(response), responses, repeat)
+    print(f"html parsing:          {parse_time * 1000:.3f} ms/page")
+    print(f":contains() selectors: {baseline * 1000:.3f} ms/page")
+    print(f"single pass:           {single_pass * 1000:.3f} ms/page ({baseline / single_pass:.1f}x faster)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or [os.path.join(FIXTURES_DIR, "detail.html")])
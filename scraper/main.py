@@ -1,11 +1,19 @@
-import time
+import signal
 import logging
 from datetime import datetime, timedelta
-from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
-from ogloszenia_trojmiasto.spiders.ogloszenia import OgloszeniaSpider
+from scrapy.utils.reactor import install_reactor
 from pathlib import Path
 
+settings = get_project_settings()
+install_reactor(settings["TWISTED_REACTOR"]) # must be installed before anything imports twisted.internet.reactor
+
+from twisted.internet import defer, reactor, threads
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.log import configure_logging
+from ogloszenia_trojmiasto.archive import run_retention
+from ogloszenia_trojmiasto.spiders.ogloszenia import OgloszeniaSpider
+
 # log dir setup
 log_dir = Path("/scraper/logs")
 log_dir.mkdir(exist_ok=True)
@@ -32,42 +40,110 @@ def setup_logger():
 
 scheduler_logger = setup_logger()
 
-def run_spider():
+class Scheduler:
     """
-    run the spider
-    """
-    scheduler_logger.info("Starting spider...")
-    try:
-        process = CrawlerProcess(get_project_settings())
-        process.crawl(OgloszeniaSpider)
-        process.start()
-        scheduler_logger.info("Spider run completed successfully")
-    except Exception as e:
-        scheduler_logger.error(f"Error during spider startup: {str(e)}")
+    long-lived scheduler - all scraping sessions run in one process on a single reactor,
+    so imports, coastline, geocoding cache, db connection and listing index stay warm.
 
-def run_scraping_session(is_initial=False):
+    Send SIGUSR1 to the process to start a session immediately
+    (e.g. docker compose exec scraper pkill -USR1 -f main.py)
     """
-    run scraping session and log its duration
-    returns end time for scheduling next run
-    """
-    session_type = "initial" if is_initial else "scheduled"
-    start_time = datetime.now()
-    scheduler_logger.info(f"Starting {session_type} scraping session at: {start_time}")
-    
-    run_spider()
-    
-    end_time = datetime.now()
-    duration = end_time - start_time
-    scheduler_logger.info(f"{session_type.capitalize()} scraping session completed. Duration: {duration}")
-    
-    return end_time
+    def __init__(self):
+        self.runner = CrawlerRunner(settings)
+        self.running = False
+        self.next_call = None
+
+    @defer.inlineCallbacks
+    def run_spider(self):
+        """
+        run the spider
+        """
+        scheduler_logger.info("Starting spider...")
+        try:
+            yield self.runner.crawl(OgloszeniaSpider)
+            scheduler_logger.info("Spider run completed successfully")
+        except Exception as e:
+            scheduler_logger.error(f"Error during spider run: {str(e)}")
+
+    @defer.inlineCallbacks
+    def maintain_history(self):
+        """
+        add upcoming monthly partitions of the listing history and archive expired months (ARCHIVE_* settings);
+        runs in a worker thread on its own db connection
+        """
+        try:
+            added, archived = yield threads.deferToThread(
+                run_retention,
+                settings.get("ARCHIVE_DIR"),
+                settings.getint("ARCHIVE_RETENTION_MONTHS", 12),
+                settings.getint("ARCHIVE_PARTITIONS_AHEAD", 2),
+                settings.getbool("ARCHIVE_ENABLED")
+            )
+            if added:
+                scheduler_logger.info(f"Added listing history partitions: {', '.join(added)}")
+            for name, rows, path in archived:
+                scheduler_logger.info(f"Archived listing history partition {name} ({rows} rows) to {path}")
+        except Exception as e:
+            scheduler_logger.error(f"Error during listing history maintenance: {str(e)}")
+
+    @defer.inlineCallbacks
+    def run_scraping_session(self, is_initial=False):
+        """
+        run scraping session, log its duration and schedule the next one
+        """
+        if self.running:
+            scheduler_logger.info("Scraping session already running")
+            return
+        self.running = True
+
+        session_type = "initial" if is_initial else "scheduled"
+        start_time = datetime.now()
+        scheduler_logger.info(f"Starting {session_type} scraping session at: {start_time}")
+
+        try:
+            yield self.run_spider()
+            yield self.maintain_history()
+        finally:
+            self.running = False
+
+        end_time = datetime.now()
+        duration = end_time - start_time
+        scheduler_logger.info(f"{session_type.capitalize()} scraping session completed. Duration: {duration}")
+
+        self.schedule(calculate_next_run(end_time))
+
+    def schedule(self, next_run):
+        delay = max((next_run - datetime.now()).total_seconds(), 0)
+        self.next_call = reactor.callLater(delay, self.run_scraping_session)
+
+    def trigger(self):
+        """
+        start a session now ("crawl now"), the scheduled one is moved after it
+        """
+        scheduler_logger.info("Crawl triggered manually")
+        if self.running:
+            scheduler_logger.info("Scraping session already running")
+            return
+        if self.next_call is not None and self.next_call.active():
+            self.next_call.cancel()
+        self.run_scraping_session()
 
 def calculate_next_run(end_time):
     """
     calculate and log the next run time
     returns datetime object for next scheduled run
+
+    sessions are short - only listings due for recrawl (see RECRAWL_* settings) are fetched.
+    Runs are aligned to midnight of the session's day: the first interval step after end_time,
+    so intervals shorter than a day (e.g. 0.25 - every 6 hours) don't start the next run immediately
     """
-    next_run = end_time.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=3)
+    interval = timedelta(days=settings.getfloat("SCHEDULE_INTERVAL_DAYS", 1))
+    if interval <= timedelta(0):
+        raise ValueError("SCHEDULE_INTERVAL_DAYS must be positive")
+
+    next_run = end_time.replace(hour=0, minute=0, second=0, microsecond=0) + interval
+    if next_run <= end_time:
+        next_run += interval * ((end_time - next_run) // interval + 1)
     scheduler_logger.info(f"Next scheduled run at: {next_run}")
 
     return next_run
@@ -78,15 +154,13 @@ def main():
     handles initial run and subsequent scheduled runs
     """
     scheduler_logger.info("Starting scheduler...")
-    
-    end_time = run_scraping_session(is_initial=True)
-    next_run = calculate_next_run(end_time)
-    
-    while True:
-        if datetime.now() >= next_run:
-            end_time = run_scraping_session()
-            next_run = calculate_next_run(end_time)
-        time.sleep(60*60) # check every hour
+    configure_logging(settings)
+
+    scheduler = Scheduler()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: reactor.callFromThread(scheduler.trigger))
+
+    reactor.callWhenRunning(scheduler.run_scraping_session, is_initial=True)
+    reactor.run()
 
 if __name__ == "__main__":
     try:
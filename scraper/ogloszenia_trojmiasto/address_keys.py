@@ -0,0 +1,105 @@
+import unicodedata
+
+# street prefixes and listing markers ignored when matching
+STOPWORDS = {"ul", "ulica", "al", "aleja", "aleje", "os", "osiedle", "pl", "plac", "gm", "gw", "im"}
+
+# months - "3 Maja", "11 Listopada" etc. are street names, not house numbers
+MONTHS = {
+    "stycznia", "lutego", "marca", "kwietnia", "maja", "czerwca",
+    "lipca", "sierpnia", "wrzesnia", "pazdziernika", "listopada", "grudnia"
+}
+
+CITIES = [
+    "Gdańsk", "Gdynia", "Sopot", "Rumia", "Reda", "Wejherowo", "Puck", "Władysławowo", "Jastarnia", "Hel",
+    "Pruszcz Gdański", "Kolbudy", "Żukowo", "Kartuzy", "Banino", "Chwaszczyno", "Kosakowo", "Pierwoszyno",
+    "Straszyn", "Juszkowo", "Rotmanka", "Borkowo", "Przejazdowo", "Tczew", "Nowy Dwór Gdański", "Kościerzyna"
+]
+
+# districts (and common parts of their names) as used in listings - not a part of the geocoding key
+DISTRICTS = {
+    "Gdańsk": [
+        "Aniołki", "Brętowo", "Brzeźno", "Chełm", "Jasień", "Kokoszki", "Krakowiec", "Górki Zachodnie",
+        "Letnica", "Matarnia", "Młyniska", "Nowy Port", "Oliwa", "Olszynka", "Orunia Górna", "Gdańsk Południe",
+        "Orunia", "Św. Wojciech", "Lipce", "Osowa", "Piecki-Migowo", "Piecki", "Migowo", "Morena", "Przeróbka",
+        "Przymorze Małe", "Przymorze Wielkie", "Przymorze", "Rudniki", "Siedlce", "Stogi", "Strzyża", "Suchanino",
+        "Śródmieście", "Ujeścisko", "Łostowice", "VII Dwór", "Wrzeszcz Dolny", "Wrzeszcz Górny", "Wrzeszcz",
+        "Wyspa Sobieszewska", "Wzgórze Mickiewicza", "Zaspa-Młyniec", "Zaspa-Rozstaje", "Zaspa", "Żabianka",
+        "Jelitkowo", "Kiełpinek", "Karczemki", "Maćkowy", "Sobieszewo", "Południe"
+    ],
+    "Gdynia": [
+        "Babie Doły", "Chwarzno-Wiczlino", "Chwarzno", "Wiczlino", "Chylonia", "Cisowa", "Dąbrowa", "Działki Leśne",
+        "Grabówek", "Kamienna Góra", "Karwiny", "Leszczynki", "Mały Kack", "Obłuże", "Oksywie", "Orłowo", "Pogórze",
+        "Pustki Cisowskie-Demptowo", "Pustki Cisowskie", "Demptowo", "Redłowo", "Śródmieście", "Wielki Kack",
+        "Witomino-Leśniczówka", "Witomino-Radiostacja", "Witomino", "Wzgórze Św. Maksymiliana", "Fikakowo"
+    ],
+    "Sopot": [
+        "Dolny Sopot", "Górny Sopot", "Kamienny Potok", "Karlikowo", "Brodwino", "Przylesie", "Stawowie",
+        "Świemirowo", "Sopot Wyścigi", "Wyścigi",
+        "Dolny", "Górny" # "Sopot Dolny Sopot" is cleaned to "Sopot Dolny"
+    ]
+}
+
+def normalize_tokens(text: str) -> list:
+    """
+    lowercase tokens without diacritics and punctuation, e.g. "Gdańsk Wrzeszcz Górny de Gaulle'a"
+    -> ["gdansk", "wrzeszcz", "gorny", "de", "gaulle"]
+    """
+    text = unicodedata.normalize("NFKD", text.lower().replace("ł", "l"))
+    text = "".join(char if char.isalnum() else " " for char in text if not unicodedata.combining(char))
+    return [token for token in text.split() if token not in STOPWORDS and (len(token) > 1 or token.isdigit())]
+
+def phrases(names) -> list:
+    """
+    normalized token tuples, longest first
+    """
+    return sorted({tuple(normalize_tokens(name)) for name in names}, key=len, reverse=True)
+
+CITY_PHRASES = phrases(CITIES)
+DISTRICT_PHRASES = {normalize_tokens(city)[0]: phrases(names) for city, names in DISTRICTS.items()}
+
+def find_phrase(tokens: list, phrase: tuple) -> int:
+    for i in range(len(tokens) - len(phrase) + 1):
+        if tuple(tokens[i:i + len(phrase)]) == phrase:
+            return i
+    return -1
+
+def address_key(address):
+    """
+    canonical geocoding key "city|street|number" of a cleaned listing address
+
+    matching is diacritics and case insensitive, districts are dropped and street tokens sorted,
+    so e.g. "Gdańsk Wrzeszcz Górny de Gaulle'a" and "Gdansk de Gaulle'a (gm)" share one key.
+    If no street is left, the district stays in the key (different districts are different places)
+    """
+    if not isinstance(address, str):
+        return address
+
+    tokens = normalize_tokens(address)
+    if not tokens:
+        return ""
+
+    # listings start with the city; known cities are also found elsewhere (different word order)
+    city = next((phrase for phrase in CITY_PHRASES if find_phrase(tokens, phrase) == 0), None)
+    if city is None:
+        city = next((phrase for phrase in CITY_PHRASES if find_phrase(tokens, phrase) > 0), (tokens[0],))
+    start = find_phrase(tokens, city)
+    rest = tokens[:start] + tokens[start + len(city):]
+
+    street = list(rest)
+    for phrase in DISTRICT_PHRASES.get(" ".join(city), ()):
+        i = find_phrase(street, phrase)
+        if i >= 0:
+            street = street[:i] + street[i + len(phrase):]
+    if not any(not token.isdigit() for token in street):
+        street = rest # only district (and number) - keep the district
+
+    number = ""
+    words = []
+    for i, token in enumerate(street):
+        if token[0].isdigit() and not (i + 1 < len(street) and street[i + 1] in MONTHS):
+            if not number:
+                number = token # house number, following numbers are flats
+            continue
+        words.append(token)
+
+    return f"{' '.join(city)}|{' '.join(sorted(words))}|{number}"
@@ -0,0 +1,84 @@
+"""
+aggregates of current listings for the frontend graphs (tables from db/migrations/0005_aggregates.sql):
+per-city and per-area counts with price and price per m2 quartiles, listings per room group and
+a fixed-bin price histogram. Computed from listings_current by DatabaseHelper.refresh_aggregates
+at the end of every crawl, so the backend serves rows per city instead of rows per listing
+"""
+import numpy as np
+import pandas as pd
+
+# columns read from listings_current
+LISTING_COLUMNS = ["city", "area", "price", "price_per_sqr_meter", "square_meters", "rooms"]
+
+# fixed histogram bins: HISTOGRAM_LOW_BIN wide below HISTOGRAM_SPLIT (the "< 3M" graph), HISTOGRAM_HIGH_BIN above
+HISTOGRAM_SPLIT = 3_000_000
+HISTOGRAM_LOW_BIN = 30_000
+HISTOGRAM_HIGH_BIN = 250_000
+
+QUANTILES = {"p25": 0.25, "median": 0.5, "p75": 0.75}
+STAT_COLUMNS = ["listings"] + [f"{column}_{name}" for column in ("price", "price_per_sqr_meter") for name in QUANTILES]
+
+# table -> columns, in insert order
+AGGREGATE_TABLES = {
+    "agg_city_stats": ["city", *STAT_COLUMNS],
+    "agg_area_stats": ["city", "area", *STAT_COLUMNS],
+    "agg_room_groups": ["city", "room_group", "listings"],
+    "agg_price_histogram": ["city", "bin_start", "bin_end", "listings"]
+}
+
+def room_groups(rooms: pd.Series) -> pd.Series:
+    """
+    "1" ... "5", "6+" or "no data" (same groups as the frontend used)
+    """
+    groups = rooms.astype("Int64").astype(str)
+    groups[rooms >= 6] = "6+"
+    groups[rooms.isna()] = "no data"
+    return groups
+
+def price_bins(price: pd.Series) -> pd.DataFrame:
+    """
+    start and end of the fixed histogram bin of every price
+    """
+    low = np.floor(price / HISTOGRAM_LOW_BIN) * HISTOGRAM_LOW_BIN
+    high = HISTOGRAM_SPLIT + np.floor((price - HISTOGRAM_SPLIT) / HISTOGRAM_HIGH_BIN) * HISTOGRAM_HIGH_BIN
+    above = price >= HISTOGRAM_SPLIT
+    start = np.where(above, high, low).astype(np.int64)
+    return pd.DataFrame({
+        "bin_start": start,
+        "bin_end": start + np.where(above, HISTOGRAM_HIGH_BIN, HISTOGRAM_LOW_BIN)
+    }, index=price.index)
+
+def group_stats(listings: pd.DataFrame, keys: list) -> pd.DataFrame:
+    grouped = listings.groupby(keys, sort=True)
+    stats = grouped.size().rename("listings").to_frame()
+    for column in ("price", "price_per_sqr_meter"):
+        quantiles = grouped[column].quantile(list(QUANTILES.values())).unstack().reindex(columns=list(QUANTILES.values()))
+        quantiles.columns = [f"{column}_{name}" for name in QUANTILES]
+        stats = stats.join(quantiles)
+    return stats.reset_index()
+
+def compute_aggregates(listings: pd.DataFrame) -> dict:
+    """
+    aggregate tables (table -> DataFrame with AGGREGATE_TABLES columns) of listings with LISTING_COLUMNS;
+    listings without city, price or square meters are left out
+    """
+    listings = listings[listings["city"].notna() & listings["price"].notna() & listings["square_meters"].notna()]
+    listings = listings.astype({"price": float, "price_per_sqr_meter": float, "rooms": float})
+    listings = listings.assign(area=listings["area"].fillna(""))
+
+    rooms = listings.assign(room_group=room_groups(listings["rooms"]))
+    bins = listings[["city"]].join(price_bins(listings["price"]))
+    tables = {
+        "agg_city_stats": group_stats(listings, ["city"]),
+        "agg_area_stats": group_stats(listings, ["city", "area"]),
+        "agg_room_groups": rooms.groupby(["city", "room_group"]).size().rename("listings").reset_index(),
+        "agg_price_histogram": bins.groupby(["city", "bin_start", "bin_end"]).size().rename("listings").reset_index()
+    }
+    return {table: frame.reindex(columns=AGGREGATE_TABLES[table]) for table, frame in tables.items()}
+
+def to_rows(frame: pd.DataFrame) -> list:
+    """
+    rows as tuples of python values (NaN -> None) for executemany
+    """
+    values = frame.astype(object).where(frame.notna(), None)
+    return [tuple(row) for row in values.itertuples(index=False, name=None)]
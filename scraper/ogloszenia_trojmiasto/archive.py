@@ -0,0 +1,298 @@
+"""
+retention of the listing history - listing_versions is range-partitioned by month of created_ts
+(db/migrations/0004_partition_listing_versions.sql). Monthly partitions are added ahead of time,
+months older than the retention period are exported to zstd-compressed Parquet files (one per
+month) and dropped from MySQL, so the table - and its share of the buffer pool - stays bounded.
+read_versions() reads archived months back together with the rows still in MySQL
+
+run from the scraper directory (the scheduler in main.py runs it after every session):
+    python -m ogloszenia_trojmiasto.archive [--retention-months 12] [--archive-dir /scraper/archive]
+"""
+import argparse
+import calendar
+import os
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ogloszenia_trojmiasto.db_helper import ITEM_COLUMNS, DatabaseHelper
+
+TABLE = "listing_versions"
+VERSION_COLUMNS = ["id", "listing_id", *ITEM_COLUMNS]
+LOCK_NAME = "listing_versions_retention"
+
+# upper bound of p_start, see migration 0004
+FIRST_MONTH = (2024, 1)
+
+ARCHIVE_DIR = "/scraper/archive"
+
+# types of listing_versions columns, so files of all months share one schema
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("listing_id", pa.int32()),
+    ("url", pa.string()),
+    ("title", pa.string()),
+    ("price", pa.float32()),
+    ("price_per_sqr_meter", pa.float32()),
+    ("rooms", pa.int32()),
+    ("floor", pa.int32()),
+    ("square_meters", pa.float32()),
+    ("year", pa.string()),
+    ("address", pa.string()),
+    ("city", pa.string()),
+    ("area", pa.string()),
+    ("coastline_distance", pa.float32()),
+    ("gdynia_downtown_distance", pa.float32()),
+    ("gdansk_downtown_distance", pa.float32()),
+    ("sopot_downtown_distance", pa.float32()),
+    ("latitude", pa.decimal128(15, 12)),
+    ("longitude", pa.decimal128(15, 12)),
+    ("created_ts", pa.timestamp("s"))
+])
+
+def month_start(year: int, month: int) -> int:
+    """
+    unix timestamp of the first second of the month (UTC)
+    """
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+def add_months(year: int, month: int, months: int) -> tuple:
+    year, month = divmod(year * 12 + month - 1 + months, 12)
+    return year, month + 1
+
+def current_month(now=None) -> tuple:
+    date = datetime.fromtimestamp(now or time.time(), timezone.utc)
+    return date.year, date.month
+
+def partition_name(year: int, month: int) -> str:
+    return f"p{year:04d}{month:02d}"
+
+def archive_path(archive_dir: str, name: str) -> str:
+    """
+    file of an archived partition: YYYY-MM.parquet, p_start as before-YYYY-MM.parquet
+    """
+    if name == "p_start":
+        label = f"before-{FIRST_MONTH[0]:04d}-{FIRST_MONTH[1]:02d}"
+    else:
+        label = f"{name[1:5]}-{name[5:7]}"
+    return os.path.join(archive_dir, TABLE, f"{label}.parquet")
+
+def archived_months(archive_dir: str) -> list:
+    """
+    (path, start, end) of archived files, start/end as naive UTC datetimes (None = unbounded)
+    """
+    directory = os.path.join(archive_dir, TABLE)
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".parquet"):
+            continue
+        label = filename[:-len(".parquet")]
+        if label.startswith("before-"):
+            year, month = map(int, label[len("before-"):].split("-"))
+            start, end = None, (year, month)
+        else:
+            year, month = map(int, label.split("-"))
+            start, end = (year, month), add_months(year, month, 1)
+        files.append((
+            os.path.join(directory, filename),
+            datetime(*start, 1) if start else None,
+            datetime(*end, 1)
+        ))
+    return files
+
+def list_partitions(cursor) -> list:
+    """
+    (name, upper bound or None for MAXVALUE, estimated rows) in partition order; empty if not partitioned
+    """
+    cursor.execute(
+        """
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY PARTITION_ORDINAL_POSITION
+        """,
+        (TABLE,)
+    )
+    partitions = []
+    for name, description, rows in cursor.fetchall():
+        if name is None:
+            return [] # table exists but isn't partitioned (migration 0004 not applied)
+        partitions.append((name, None if description == "MAXVALUE" else int(description), rows))
+    return partitions
+
+def ensure_partitions(conn, months_ahead: int = 2, now=None, allow_copy: bool = False) -> list:
+    """
+    split monthly partitions off p_future up to `months_ahead` months after the current one;
+    returns names of added partitions. Migration 0004 creates the months up to 2026-12 and every
+    run adds the upcoming ones, so p_future is normally empty and reorganizing it is cheap.
+    If p_future holds rows (the job didn't run for longer than `months_ahead` months), reorganizing
+    copies them under a metadata lock on listing_versions - that is done only with `allow_copy`
+    (python -m ogloszenia_trojmiasto.archive --allow-copy, outside of crawls), otherwise it's skipped
+    """
+    cursor = conn.cursor()
+    try:
+        partitions = list_partitions(cursor)
+        if len(partitions) < 2 or partitions[-1][0] != "p_future":
+            return []
+
+        bound = datetime.fromtimestamp(partitions[-2][1], timezone.utc)
+        year, month = bound.year, bound.month # first month not covered yet
+        last = add_months(*current_month(now), months_ahead)
+        added = []
+        while (year, month) <= last:
+            added.append((partition_name(year, month), month_start(*add_months(year, month, 1))))
+            year, month = add_months(year, month, 1)
+        if not added:
+            return []
+
+        cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {TABLE} PARTITION (p_future))")
+        (has_rows,) = cursor.fetchone()
+        if has_rows and not allow_copy:
+            print(
+                f"Warning: partition p_future of {TABLE} holds rows, splitting it would copy them - "
+                "run python -m ogloszenia_trojmiasto.archive --allow-copy outside of crawls"
+            )
+            return []
+
+        definitions = ", ".join(f"PARTITION {name} VALUES LESS THAN ({bound})" for name, bound in added)
+        cursor.execute(
+            f"ALTER TABLE {TABLE} REORGANIZE PARTITION p_future INTO "
+            f"({definitions}, PARTITION p_future VALUES LESS THAN MAXVALUE)"
+        )
+        return [name for name, _ in added]
+    finally:
+        cursor.close()
+
+def export_partition(conn, name: str, path: str, batch_size: int = 50_000) -> int:
+    """
+    write rows of the partition to a Parquet file (written to a temporary file first), returns number of rows
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    rows_written = 0
+    cursor = conn.cursor(buffered=False) # rows are fetched from the server in batches
+    writer = pq.ParquetWriter(tmp_path, SCHEMA, compression="zstd")
+    try:
+        cursor.execute(f"SELECT {', '.join(VERSION_COLUMNS)} FROM {TABLE} PARTITION ({name}) ORDER BY created_ts, id")
+        while rows := cursor.fetchmany(batch_size):
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, SCHEMA)], schema=SCHEMA
+            ))
+            rows_written += len(rows)
+    finally:
+        writer.close()
+        cursor.close()
+
+    if pq.ParquetFile(tmp_path).metadata.num_rows != rows_written:
+        raise RuntimeError(f"archive of partition {name} is incomplete")
+    os.replace(tmp_path, path)
+    return rows_written
+
+def archive_partitions(conn, archive_dir: str = ARCHIVE_DIR, retention_months: int = 12, now=None) -> list:
+    """
+    export partitions of months older than `retention_months` full months before the current one
+    and drop them; a partition is dropped only after its file was written.
+    returns (partition, rows, path) of archived partitions
+    """
+    cutoff = month_start(*add_months(*current_month(now), -retention_months))
+    cursor = conn.cursor()
+    archived = []
+    try:
+        for name, bound, _ in list_partitions(cursor):
+            if bound is None or bound > cutoff:
+                break
+            path = archive_path(archive_dir, name)
+            rows = export_partition(conn, name, path)
+            cursor.execute(f"ALTER TABLE {TABLE} DROP PARTITION {name}")
+            archived.append((name, rows, path))
+    finally:
+        cursor.close()
+    return archived
+
+def run_retention(archive_dir: str = ARCHIVE_DIR, retention_months: int = 12, months_ahead: int = 2, archive: bool = True,
+                  allow_copy: bool = False):
+    """
+    add upcoming partitions and (if `archive`) archive expired ones on one pooled connection
+    (holding the lock); skipped if another scraper worker is running it. `allow_copy` - see ensure_partitions.
+    Returns (added partitions, archived partitions)
+    """
+    with DatabaseHelper().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (LOCK_NAME,))
+            (locked,) = cursor.fetchone()
+            if not locked:
+                return [], []
+            try:
+                added = ensure_partitions(conn, months_ahead, allow_copy=allow_copy)
+                archived = archive_partitions(conn, archive_dir, retention_months) if archive else []
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+                cursor.fetchone()
+            return added, archived
+        finally:
+            cursor.close()
+
+def read_versions(start=None, end=None, url=None, conn=None, archive_dir: str = ARCHIVE_DIR) -> pd.DataFrame:
+    """
+    listing versions created in [start, end) (naive UTC datetimes, None = unbounded), optionally of one url.
+    Archived months are read from their Parquet files, the rest from MySQL if `conn` is given
+    """
+    filters = []
+    if start is not None:
+        filters.append(("created_ts", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("created_ts", "<", pd.Timestamp(end)))
+    if url is not None:
+        filters.append(("url", "==", url))
+
+    frames = []
+    for path, file_start, file_end in archived_months(archive_dir):
+        if (start is not None and file_end <= start) or (end is not None and file_start is not None and file_start >= end):
+            continue # month outside of the range, file isn't opened
+        frames.append(pq.read_table(path, filters=filters or None).to_pandas())
+
+    if conn is not None:
+        conditions, params = [], []
+        for column, operator, value in filters:
+            conditions.append(f"{column} {'=' if operator == '==' else operator} %s")
+            params.append(value.to_pydatetime() if isinstance(value, pd.Timestamp) else value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT {', '.join(VERSION_COLUMNS)} FROM {TABLE} {where}", tuple(params))
+            frames.append(pd.DataFrame.from_records(cursor.fetchall(), columns=VERSION_COLUMNS))
+        finally:
+            cursor.close()
+
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return SCHEMA.empty_table().to_pandas()
+    versions = pd.concat(frames, ignore_index=True)
+    # a month can be both archived and in MySQL if dropping its partition failed
+    versions = versions.drop_duplicates(subset="id").sort_values(["created_ts", "id"], ignore_index=True)
+    return versions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="add monthly partitions of listing_versions and archive expired months")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--retention-months", type=int, default=12)
+    parser.add_argument("--months-ahead", type=int, default=2)
+    parser.add_argument("--no-archive", action="store_true", help="only add partitions")
+    parser.add_argument(
+        "--allow-copy", action="store_true", help="split p_future even if it holds rows (copies them, locks the table)"
+    )
+    args = parser.parse_args()
+
+    added, archived = run_retention(
+        args.archive_dir, args.retention_months, args.months_ahead, not args.no_archive, args.allow_copy
+    )
+    print(f"added partitions: {', '.join(added) or 'none'}")
+    for name, rows, path in archived:
+        print(f"archived {name}: {rows} rows -> {path}")
@@ -1,167 +1,297 @@
 import mysql.connector
-from dotenv import load_dotenv
-import os
+import time
 
-load_dotenv()
+import pandas as pd
+
+from ogloszenia_trojmiasto.aggregates import AGGREGATE_TABLES, LISTING_COLUMNS, compute_aggregates, to_rows
+from ogloszenia_trojmiasto.db_pool import get_pool, is_connection_error
+from ogloszenia_trojmiasto.metrics import registry
+from ogloszenia_trojmiasto.migrations import apply_migrations
+
+# scraped values of a listing, stored in listings_current and in every listing_versions row
+ITEM_COLUMNS = [
+    "url", "title", "price", "price_per_sqr_meter", "rooms", "floor", "square_meters", "year", "address", "city", "area",
+    "coastline_distance", "gdynia_downtown_distance", "gdansk_downtown_distance", "sopot_downtown_distance",
+    "latitude", "longitude", "created_ts"
+]
+
+# new listing: first version is also the current one
+INSERT_LISTING_QUERY = f"""
+INSERT IGNORE INTO listings_current ({", ".join(ITEM_COLUMNS)}, scraped_ts, first_seen_ts, versions)
+VALUES ({", ".join(["%s"] * len(ITEM_COLUMNS))}, %s, %s, 1)
+"""
+
+# changed listing: current row updated in place
+UPDATE_LISTING_QUERY = f"""
+UPDATE listings_current
+SET {", ".join(f"{column} = %s" for column in ITEM_COLUMNS if column != "url")}, scraped_ts = %s, versions = versions + 1
+WHERE url = %s
+"""
+
+# every new and changed listing appends a version
+INSERT_VERSION_QUERY = f"""
+INSERT INTO listing_versions (listing_id, {", ".join(ITEM_COLUMNS)})
+VALUES (%s, {", ".join(["%s"] * len(ITEM_COLUMNS))})
+"""
 
 class DatabaseHelper:
-    def __init__(self):
+    """
+    database access on the process-wide connection pool (db_pool.py): every operation checks out
+    a connection and returns it afterwards, every batch is written in its own transaction
+    """
+    def __init__(self, pool=None, retries=3):
         """
-        init db connection
+        init db connection pool
         """
+        self.pool = pool or get_pool()
+        self.retries = retries # attempts of a transaction on a new connection after the connection was lost
         try:
-            self.conn = mysql.connector.connect(
-                host=os.getenv("DB_HOST"),
-                port=os.getenv("DB_PORT"),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                database=os.getenv("DB_NAME"),
-                auth_plugin="caching_sha2_password"
-            )
-            
-            print("sucessfully connected to database")
+            with self.pool.connection():
+                pass # fail early if the database is unreachable
 
-            self.cursor = self.conn.cursor()
-            # self.create_table()
+            print("sucessfully connected to database")
 
         except mysql.connector.Error as error:
             print(f"Error: {error}")
             raise
 
-    def create_table(self):
-        create_table_sql = """
-        CREATE TABLE IF NOT EXISTS scraped_items (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            url VARCHAR(255) NOT NULL,
-            title VARCHAR(255),
-            price FLOAT,
-            price_per_sqr_meter FLOAT,
-            rooms INT,
-            floor INT,
-            square_meters FLOAT,
-            year VARCHAR(255),
-            address VARCHAR(255),
-            city VARCHAR(255),
-            area VARCHAR(255),
-            coastline_distance FLOAT,
-            gdynia_downtown_distance FLOAT,
-            gdansk_downtown_distance FLOAT,
-            sopot_downtown_distance FLOAT,
-            latitude DECIMAL(15, 12),
-            longitude DECIMAL(15, 12),
-            created_ts TIMESTAMP,
-            scraped_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_latest BOOLEAN NOT NULL DEFAULT 1,
-            UNIQUE KEY url_latest (url, is_latest)
-        )
+    def connection(self):
         """
+        pooled connection for a block of work (e.g. GET_LOCK held until the block ends):
+        with db_helper.connection() as conn: ...
+        """
+        return self.pool.connection()
 
+    def ensure_connection(self):
+        """
+        health check before a scraping session - reconnects if connections were dropped (e.g. wait_timeout)
+        """
         try:
-            self.cursor.execute(create_table_sql)
-            self.conn.commit()
+            with self.pool.connection():
+                pass
         except mysql.connector.Error as error:
-            print(f"Error creating table: {error}")
+            print(f"Error reconnecting to database: {error}")
+            raise
+
+    def run_in_transaction(self, work):
+        """
+        run work(cursor) in a single transaction and return its result; rolled back on error.
+        If the connection is lost before commit, the transaction is retried on a new connection
+        with backoff. A connection lost during commit isn't retried - the commit may have been applied
+        """
+        for attempt in range(self.retries + 1):
+            committing = False
+            try:
+                with self.pool.connection() as conn:
+                    conn.start_transaction()
+                    cursor = conn.cursor()
+                    try:
+                        result = work(cursor)
+                        committing = True
+                        conn.commit()
+                        return result
+                    except Exception:
+                        try:
+                            conn.rollback()
+                        except mysql.connector.Error:
+                            pass # connection lost, the server rolls the transaction back
+                        raise
+                    finally:
+                        cursor.close()
+            except mysql.connector.Error as error:
+                if committing or attempt == self.retries or not is_connection_error(error):
+                    raise
+                registry.inc("db_connections", "retried_transactions")
+                delay = self.pool.backoff_delay(attempt)
+                print(f"Lost database connection ({error}), retrying transaction in {delay} s")
+                time.sleep(delay)
 
-    def update_scraped_ts(self, url):
+    def iter_rows(self, query, params=(), batch_size=10_000):
         """
-        update scraped_ts column for the given url
+        stream rows of a query through an unbuffered (server-side) cursor in batches;
+        the connection is held until the rows are consumed
         """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(buffered=False)
+            try:
+                cursor.execute(query, params)
+                while rows := cursor.fetchmany(batch_size):
+                    yield from rows
+            finally:
+                cursor.close()
 
-        query = "UPDATE scraped_items SET scraped_ts = NOW() WHERE url = %s AND is_latest = 1"
+    def fetch_all(self, query, params=()):
+        """
+        all rows of a small query (the read snapshot ends when the connection is returned)
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def create_table(self):
+        """
+        create or upgrade the schema by applying pending migrations (db/migrations)
+        returns versions of applied migrations
+        """
         try:
-            self.cursor.execute(query, (url,))
-            self.conn.commit()
+            with self.pool.connection() as conn:
+                return apply_migrations(conn)
         except mysql.connector.Error as error:
-            print(f"Error updating scraped_ts: {error}")
+            print(f"Error applying schema migrations: {error}")
+            raise
 
-    def update_is_latest(self, url):
+    def update_scraped_ts_many(self, urls):
         """
-        set is_latest column to 0 for the given url
+        update scraped_ts column for all given urls in a single transaction
         """
 
-        query = "UPDATE scraped_items SET is_latest = 0 WHERE url = %s AND is_latest = 1"
+        query = "UPDATE listings_current SET scraped_ts = NOW() WHERE url = %s"
         try:
-            self.cursor.execute(query, (url,))
-            self.conn.commit()
+            self.run_in_transaction(lambda cursor: cursor.executemany(query, [(url,) for url in urls]))
         except mysql.connector.Error as error:
-            print(f"Error updating is_latest: {error}")
+            print(f"Error updating scraped_ts: {error}")
 
     def get_existing_urls(self):
         """
-        get all urls and their last scraped timestamps currently in the db where is_latest = 1
+        get all current urls and their last scraped timestamps
         """
 
-        self.cursor.execute("SELECT url, scraped_ts FROM scraped_items WHERE is_latest = 1")
-        return {row[0]: row[1] for row in self.cursor.fetchall()}
+        return {url: scraped_ts for url, scraped_ts in self.iter_rows("SELECT url, scraped_ts FROM listings_current")}
 
 
-    def is_changed(self, url, item):
+    def iter_latest_listings(self, batch_size=10_000):
         """
-        check if the new item differs from the existing item in the db 
-        returns True if data has changed, False otherwise
+        stream (id, url, scraped_ts, price, price_per_sqr_meter, square_meters, versions, first_seen)
+        of all current listings; versions and first_seen describe the listing's history
         """
         query = """
-        SELECT price, price_per_sqr_meter 
-        FROM scraped_items 
-        WHERE url = %s AND is_latest = 1
+        SELECT id, url, scraped_ts, price, price_per_sqr_meter, square_meters, versions, first_seen_ts
+        FROM listings_current
         """
-        self.cursor.execute(query, (url,))
-        result = self.cursor.fetchone()
-        
-        if not result:
-            return True  # new entry
-        
-        fields_to_compare = ["price", "price_per_sqr_meter"] 
-        
-        for field, db_value in zip(fields_to_compare, result):
-            if str(item.get(field)) != str(db_value):
-                return True  # data has changed
-                
-        return False  # no changes detected
-
+        return self.iter_rows(query, batch_size=batch_size)
 
-    def insert_item(self, item):
+    def write_batch(self, new_items, changed_items, unchanged_urls):
         """
-        insert new item into the database.
+        write a batch of items in a single transaction:
+        - new items: insert into listings_current
+        - changed items: update their listings_current row in place
+        - new and changed items: append a row to listing_versions
+        - unchanged items: update scraped_ts
+        returns number of affected rows per operation and listing ids of written items (url -> id)
         """
+        def write(cursor):
+            counts = {"updated": 0, "inserted": 0, "versions": 0, "touched": 0}
+            ids = {}
+            if new_items:
+                cursor.executemany(
+                    INSERT_LISTING_QUERY,
+                    [
+                        (*(item[column] for column in ITEM_COLUMNS), item["scraped_ts"], item["created_ts"])
+                        for item in new_items
+                    ]
+                )
+                counts["inserted"] = cursor.rowcount
 
-        query = """
-        INSERT IGNORE INTO scraped_items (url, title, price, price_per_sqr_meter, rooms, floor, square_meters, year, address, city, area,
-        coastline_distance, gdynia_downtown_distance, gdansk_downtown_distance, sopot_downtown_distance, latitude, longitude, created_ts, scraped_ts, is_latest)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            if changed_items:
+                cursor.executemany(
+                    UPDATE_LISTING_QUERY,
+                    [
+                        (*(item[column] for column in ITEM_COLUMNS if column != "url"), item["scraped_ts"], item["url"])
+                        for item in changed_items
+                    ]
+                )
+                counts["updated"] = cursor.rowcount
+
+            if new_items or changed_items:
+                written_urls = [item["url"] for item in (*new_items, *changed_items)]
+                placeholders = ", ".join(["%s"] * len(written_urls))
+                cursor.execute(
+                    f"SELECT url, id FROM listings_current WHERE url IN ({placeholders})", tuple(written_urls)
+                )
+                ids = dict(cursor.fetchall())
+
+                versions = [
+                    (ids[item["url"]], *(item[column] for column in ITEM_COLUMNS))
+                    for item in (*new_items, *changed_items) if item["url"] in ids
+                ]
+                if versions:
+                    cursor.executemany(INSERT_VERSION_QUERY, versions)
+                    counts["versions"] = cursor.rowcount
+
+            if unchanged_urls:
+                cursor.executemany(
+                    "UPDATE listings_current SET scraped_ts = NOW() WHERE url = %s",
+                    [(url,) for url in unchanged_urls]
+                )
+                counts["touched"] = cursor.rowcount
+
+            return counts, ids
+
+        try:
+            return self.run_in_transaction(write)
+        except mysql.connector.Error as error:
+            print(f"Error writing batch: {error}")
+            raise
 
+    def refresh_aggregates(self, cities=None, full_refresh_days=7):
+        """
+        recompute aggregate tables (see aggregates.py) from listings_current in a single transaction:
+        only the given cities (e.g. of listings written during the crawl), or all of them - also when
+        cities is None or the last full refresh is older than full_refresh_days (it drops cities
+        without listings and catches listings that moved to another city).
+        returns refresh mode and number of refreshed cities
         """
+        ((recent_full,),) = self.fetch_all(
+            "SELECT MAX(refreshed_ts) >= NOW() - INTERVAL %s DAY FROM aggregate_refreshes WHERE mode = 'full'",
+            (full_refresh_days,)
+        )
+        if cities is None or not recent_full:
+            cities, mode = None, "full"
+        elif not cities:
+            return "incremental", 0
+        else:
+            cities, mode = sorted(cities), "incremental"
+
+        query = f"SELECT {', '.join(LISTING_COLUMNS)} FROM listings_current WHERE city IS NOT NULL"
+        city_filter, params = "", ()
+        if cities is not None:
+            placeholders = ", ".join(["%s"] * len(cities))
+            city_filter = f" WHERE city IN ({placeholders})"
+            query += f" AND city IN ({placeholders})"
+            params = tuple(cities)
+
+        tables = compute_aggregates(pd.DataFrame.from_records(self.iter_rows(query, params), columns=LISTING_COLUMNS))
+        refreshed = len(tables["agg_city_stats"]) if cities is None else len(cities)
+
+        def write(cursor):
+            for table, frame in tables.items():
+                # DELETE instead of TRUNCATE - readers see the old aggregates until commit
+                cursor.execute(f"DELETE FROM {table}{city_filter}", params)
+                rows = to_rows(frame)
+                if rows:
+                    columns = AGGREGATE_TABLES[table]
+                    cursor.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})", rows
+                    )
+            cursor.execute("INSERT INTO aggregate_refreshes (mode, cities) VALUES (%s, %s)", (mode, refreshed))
+
         try:
-            self.cursor.execute(query, (
-                item["url"],
-                item["title"],
-                item["price"],
-                item["price_per_sqr_meter"],
-                item["rooms"],
-                item["floor"],
-                item["square_meters"],
-                item["year"],
-                item["address"],
-                item["city"],
-                item["area"],
-                item["coastline_distance"],
-                item["gdynia_downtown_distance"],
-                item["gdansk_downtown_distance"],
-                item["sopot_downtown_distance"],
-                item["latitude"],
-                item["longitude"],
-                item["created_ts"],
-                item["scraped_ts"],
-                item["is_latest"],
-            ))
-
-            self.conn.commit()
+            self.run_in_transaction(write)
         except mysql.connector.Error as error:
-            print(f"Error inserting values to the table: {error}")
+            print(f"Error refreshing aggregates: {error}")
+            raise
+
+        return mode, refreshed
 
     def close(self):
-        self.cursor.close()
-        self.conn.close()
+        """
+        close idle connections of the shared pool (e.g. when warm state is dropped)
+        """
+        self.pool.close_idle()
 
 if __name__ == "__main__":
     db_helper = DatabaseHelper()
@@ -0,0 +1,177 @@
+"""
+bounded pool of MySQL connections shared by all DatabaseHelper instances of the process
+(spider, pipelines, crawl frontier and the history retention running in a thread)
+
+connections are checked out per operation or batch and returned afterwards, so a dropped
+connection (MySQL restart, wait_timeout during a long crawl) costs a reconnect instead of
+the remaining writes. Connections idle longer than DB_HEALTH_CHECK_INTERVAL are pinged before
+reuse and failed connects are retried with exponential backoff. Pool wait and hold times are
+recorded in the metrics registry as db_pool stages, connection churn as db_connections counters
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from dotenv import load_dotenv
+
+from ogloszenia_trojmiasto.metrics import registry
+
+load_dotenv()
+
+# client errors of an unusable connection: can't connect, server has gone away, lost connection
+# during query, lost connection to server; -1 is "MySQL Connection not available"
+CONNECTION_ERRORS = {-1, 2003, 2006, 2013, 2055}
+
+def is_connection_error(error) -> bool:
+    return isinstance(error, (mysql.connector.InterfaceError, mysql.connector.OperationalError)) \
+        and error.errno in CONNECTION_ERRORS
+
+class ConnectionPool:
+    """
+    at most `size` open connections; callers wait up to `timeout` seconds for a free one.
+    The last returned connection is reused first, so surplus connections stay idle and are
+    health-checked (and replaced) when they are needed again
+    """
+    def __init__(self, size=5, timeout=30, health_check_interval=30, connect_attempts=5, backoff=1, max_backoff=30,
+                 **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_attempts = connect_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_args = connect_args
+        self.slots = threading.BoundedSemaphore(size) # one per open (idle or checked out) connection
+        self.lock = threading.Lock()
+        self.idle = [] # (connection, time it was returned)
+
+    def backoff_delay(self, attempt: int) -> float:
+        return min(self.backoff * 2 ** attempt, self.max_backoff)
+
+    def connect(self):
+        """
+        open a new connection, retried with backoff while the server is unreachable (e.g. restarting)
+        """
+        for attempt in range(self.connect_attempts):
+            try:
+                conn = mysql.connector.connect(**self.connect_args)
+                registry.inc("db_connections", "opened")
+                return conn
+            except mysql.connector.Error as error:
+                registry.inc("db_connections", "connect_failed")
+                if attempt == self.connect_attempts - 1 or not is_connection_error(error):
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(f"Error connecting to database: {error}, retrying in {delay} s")
+                time.sleep(delay)
+
+    def take_idle(self):
+        """
+        most recently returned idle connection that passes the health check, None if there is none
+        """
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                conn, returned = self.idle.pop()
+            if time.monotonic() - returned < self.health_check_interval or conn.is_connected():
+                return conn
+            registry.inc("db_connections", "dropped") # failed health check
+            self.discard(conn)
+
+    def acquire(self):
+        start = time.perf_counter()
+        registry.start("db_pool", "wait")
+        if not self.slots.acquire(timeout=self.timeout):
+            registry.finish("db_pool", "wait", time.perf_counter() - start, "error")
+            raise mysql.connector.PoolError(f"no database connection available within {self.timeout} s (pool size {self.size})")
+        registry.finish("db_pool", "wait", time.perf_counter() - start)
+
+        try:
+            return self.take_idle() or self.connect()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        """
+        return the connection to the pool; an open transaction (e.g. a read snapshot) is rolled back
+        """
+        if not broken:
+            try:
+                if conn.unread_result: # result of an abandoned unbuffered cursor
+                    conn.consume_results()
+                if conn.in_transaction:
+                    conn.rollback()
+            except mysql.connector.Error:
+                broken = True
+
+        if broken:
+            self.discard(conn)
+            with self.lock:
+                # other connections were likely dropped too (e.g. server restart) - check them before reuse
+                self.idle = [(idle_conn, float("-inf")) for idle_conn, _ in self.idle]
+        else:
+            with self.lock:
+                self.idle.append((conn, time.monotonic()))
+        self.slots.release()
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+        registry.inc("db_connections", "closed")
+
+    @contextmanager
+    def connection(self):
+        """
+        checked out connection, returned to the pool when the block ends (closed if it was lost)
+        """
+        conn = self.acquire()
+        start = time.perf_counter()
+        registry.start("db_pool", "held")
+        broken = False
+        try:
+            yield conn
+        except mysql.connector.Error as error:
+            broken = is_connection_error(error)
+            raise
+        finally:
+            registry.finish("db_pool", "held", time.perf_counter() - start, "error" if broken else "ok")
+            self.release(conn, broken)
+
+    def close_idle(self):
+        """
+        close idle connections; checked out ones are returned to the pool as usual
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self.discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """
+    process-wide pool, configured from DB_* env variables
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                size=int(os.getenv("DB_POOL_SIZE", 5)),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+                health_check_interval=float(os.getenv("DB_HEALTH_CHECK_INTERVAL", 30)),
+                connect_attempts=int(os.getenv("DB_CONNECT_ATTEMPTS", 5)),
+                host=os.getenv("DB_HOST"),
+                port=os.getenv("DB_PORT"),
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD"),
+                database=os.getenv("DB_NAME"),
+                auth_plugin="caching_sha2_password"
+            )
+        return _pool
@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+
+import numpy as np
+from ogloszenia_trojmiasto.geodistance import load_coastline, calculate_distances
+from ogloszenia_trojmiasto.geocoding_cache import CACHE_DIR
+
+FEATURES = [
+    "coastline_distance",
+    "gdynia_downtown_distance",
+    "gdansk_downtown_distance",
+    "sopot_downtown_distance"
+]
+
+# Pomeranian bounding box (lat_min, lat_max, lon_min, lon_max)
+BBOX = (54.05, 54.85, 17.9, 19.1)
+
+DEFAULT_PATH = os.path.join(CACHE_DIR, "distance_grid")
+
+class DistanceGrid:
+    """
+    precomputed distances on a regular lat/lon grid, memory-mapped from .npy files
+
+    values are bilinearly interpolated; every cell stores the max interpolation error
+    (measured at its center during the build) and cells above `max_error` km are rejected
+    """
+    def __init__(self, path: str = DEFAULT_PATH, max_error: float = 0.05):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        self.lat0, self.lon0, self.step = meta["lat0"], meta["lon0"], meta["step"]
+        self.features = meta.get("features", FEATURES)
+        self.values = np.load(os.path.join(path, "values.npy"), mmap_mode="r") # (rows, cols, features)
+        self.error = np.load(os.path.join(path, "error.npy"), mmap_mode="r") # (rows - 1, cols - 1)
+        self.max_error = max_error
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_PATH, max_error: float = 0.05):
+        """
+        returns None if the grid was not built yet
+        """
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        return cls(path, max_error)
+
+    def lookup_many(self, lats, lons):
+        """
+        vectorized lookup, returns (values, valid) where values has shape (n, len(FEATURES))
+        and valid marks points inside the grid and in accurate cells
+        """
+        fi = (np.asarray(lats, dtype=np.float64) - self.lat0) / self.step
+        fj = (np.asarray(lons, dtype=np.float64) - self.lon0) / self.step
+        rows, cols = self.error.shape
+
+        valid = (fi >= 0) & (fj >= 0) & (fi < rows) & (fj < cols)
+        i = np.where(valid, fi, 0).astype(np.intp)
+        j = np.where(valid, fj, 0).astype(np.intp)
+        valid &= self.error[i, j] <= self.max_error
+
+        ti = (fi - i)[:, None]
+        tj = (fj - j)[:, None]
+        values = (
+            self.values[i, j] * (1 - ti) * (1 - tj)
+            + self.values[i + 1, j] * ti * (1 - tj)
+            + self.values[i, j + 1] * (1 - ti) * tj
+            + self.values[i + 1, j + 1] * ti * tj
+        )
+        return values, valid
+
+    def lookup(self, lat: float, lon: float):
+        """
+        interpolated distances as dict, None if the exact calculation is needed
+        """
+        values, valid = self.lookup_many([lat], [lon])
+        if not valid[0]:
+            return None
+        return {feature: float(value) for feature, value in zip(self.features, values[0])}
+
+def build_distance_grid(coastline, path: str = DEFAULT_PATH, bbox: tuple = BBOX, step: float = 0.005):
+    """
+    calculate exact distances on every grid node and interpolation error at every cell center
+    """
+    lat_min, lat_max, lon_min, lon_max = bbox
+    lats = np.arange(lat_min, lat_max + step / 2, step)
+    lons = np.arange(lon_min, lon_max + step / 2, step)
+    os.makedirs(path, exist_ok=True)
+
+    values = np.lib.format.open_memmap(
+        os.path.join(path, "values.npy"), mode="w+", dtype=np.float32, shape=(len(lats), len(lons), len(FEATURES))
+    )
+    for i, lat in enumerate(lats):
+        for j, lon in enumerate(lons):
+            distances = calculate_distances(float(lat), float(lon), coastline)
+            values[i, j] = [distances[feature] for feature in FEATURES]
+
+    # interpolated value at cell center is the mean of its 4 corners
+    error = np.lib.format.open_memmap(
+        os.path.join(path, "error.npy"), mode="w+", dtype=np.float32, shape=(len(lats) - 1, len(lons) - 1)
+    )
+    for i, lat in enumerate(lats[:-1] + step / 2):
+        for j, lon in enumerate(lons[:-1] + step / 2):
+            distances = calculate_distances(float(lat), float(lon), coastline)
+            exact = np.array([distances[feature] for feature in FEATURES])
+            interpolated = values[i:i + 2, j:j + 2].mean(axis=(0, 1))
+            error[i, j] = np.abs(exact - interpolated).max()
+
+    values.flush()
+    error.flush()
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"lat0": lat_min, "lon0": lon_min, "step": step, "features": FEATURES}, f)
+
+    return DistanceGrid(path)
+
+if __name__ == "__main__":
+    # build step: python -m ogloszenia_trojmiasto.distance_grid [output_dir]
+    grid = build_distance_grid(load_coastline(), sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH)
+    print(f"grid {grid.values.shape[:2]} built, {np.mean(grid.error <= grid.max_error):.1%} of cells usable")
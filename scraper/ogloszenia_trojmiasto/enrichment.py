@@ -0,0 +1,157 @@
+import re
+import unicodedata
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ogloszenia_trojmiasto.geodistance import get_all_geodata_many
+
+def clean_address(x):
+    address = "".join(x).strip()
+    address = re.sub(r"\s*\([^)]*\)", "", address) # remove (gw), (gm) etc.
+
+    # get rid of duplicates in address (e.g. Sopot Dolny Sopot -> Sopot Dolny):
+    words = address.split()
+    seen = set()
+    cleaned_words = []
+    for word in words:
+        if word not in seen:
+            cleaned_words.append(word)
+            seen.add(word)
+
+    return unicodedata.normalize("NFKC", " ".join(cleaned_words))
+
+def convert_floor(x):
+    return 0 if x == "Parter" else int(x)
+
+def convert_price(x):
+    return float(x[:-2].replace(" ", ""))
+
+def convert_decimal(x):
+    return float(x.replace(",", "."))
+
+# scalar converters of scraped strings, used by CleaningPipeline and as fallback of the vectorized path
+CONVERSIONS = {
+    "floor": convert_floor,
+    "price": convert_price,
+    "price_per_sqr_meter": convert_decimal,
+    "rooms": int,
+    "square_meters": convert_decimal
+}
+
+# vectorized fast path per field: (string preprocessing, pattern the preprocessed value must match, dtype);
+# values not matching the pattern (e.g. "Parter") are converted with the scalar converter
+INTEGER = r"[0-9]{1,15}" # ascii digits only (int() accepts other scripts too), fits in int64
+DECIMAL = r"[0-9]{1,15}(?:\.[0-9]+)?"
+FAST_PATHS = {
+    "floor": (lambda s: s, INTEGER, np.int64),
+    "price": (lambda s: s.str[:-2].str.replace(" ", "", regex=False), DECIMAL, np.float64),
+    "price_per_sqr_meter": (lambda s: s.str.replace(",", ".", regex=False), DECIMAL, np.float64),
+    "rooms": (lambda s: s, INTEGER, np.int64),
+    "square_meters": (lambda s: s.str.replace(",", ".", regex=False), DECIMAL, np.float64)
+}
+
+def convert_column(values: list, field: str) -> list:
+    """
+    convert one field of the batch, same results as CONVERSIONS[field] applied to every
+    value (falsy values and failed conversions become None)
+    """
+    column = pd.Series(values, dtype=object)
+    result = pd.Series([None] * len(column), dtype=object)
+
+    is_str = column.map(lambda x: isinstance(x, str) and bool(x)).to_numpy(dtype=bool)
+    preprocess, pattern, dtype = FAST_PATHS[field]
+    if is_str.any():
+        strings = preprocess(column[is_str].astype(str))
+        fast = strings.str.fullmatch(pattern).to_numpy(dtype=bool)
+        if fast.any():
+            # tolist() gives python int/float, like the scalar converters
+            result[strings.index[fast]] = strings[fast].astype(dtype).tolist()
+
+    converter = CONVERSIONS[field]
+    slow = np.flatnonzero(~is_str)
+    if is_str.any():
+        slow = np.concatenate([slow, strings.index[~fast].to_numpy()])
+    for i in slow:
+        value = column.iat[i]
+        try:
+            result.iat[i] = converter(value) if value else None
+        except Exception:
+            result.iat[i] = None
+
+    return result.tolist()
+
+def clean_items(items: list, created_ts=None):
+    """
+    batch version of CleaningPipeline - conversions run column by column on the whole batch,
+    addresses are cleaned once per distinct raw value
+    """
+    created_ts = created_ts or datetime.now()
+
+    addresses = {}
+    for item in items:
+        raw = item.get("address")
+        key = tuple(raw) if isinstance(raw, list) else raw
+        if key not in addresses:
+            try:
+                addresses[key] = clean_address(raw)
+            except Exception:
+                addresses[key] = None
+        item["address"] = addresses[key]
+        item["created_ts"] = created_ts
+
+    for field in CONVERSIONS:
+        for item, value in zip(items, convert_column([item.get(field) for item in items], field)):
+            item[field] = value
+
+    return items
+
+def fill_missing_prices(items: list) -> dict:
+    """
+    batch version of PricePipeline, returns number of filled in values per field
+    """
+    def column(field):
+        values = [item[field] for item in items]
+        missing = np.array([value is None for value in values], dtype=bool)
+        return np.array([0.0 if value is None else value for value in values], dtype=np.float64), missing
+
+    price, price_missing = column("price")
+    per_sqr_meter, per_sqr_meter_missing = column("price_per_sqr_meter")
+    square_meters, square_meters_missing = column("square_meters")
+
+    # 1. missing price but have price_per_sqr_meter and square_meters
+    fill_price = price_missing & ~per_sqr_meter_missing & ~square_meters_missing
+    # 2. missing price_per_sqr_meter but have price and square_meters (> 0 to avoid division by zero)
+    fill_per_sqr_meter = ~price_missing & per_sqr_meter_missing & ~square_meters_missing & (square_meters > 0)
+
+    calculated_price = per_sqr_meter * square_meters
+    with np.errstate(divide="ignore", invalid="ignore"):
+        calculated_per_sqr_meter = price / square_meters
+
+    # python round on the selected rows only - np.round rounds differently
+    for i in np.flatnonzero(fill_price):
+        items[i]["price"] = round(float(calculated_price[i]), 2)
+    for i in np.flatnonzero(fill_per_sqr_meter):
+        items[i]["price_per_sqr_meter"] = round(float(calculated_per_sqr_meter[i]), 2)
+
+    return {"price": int(fill_price.sum()), "price_per_sqr_meter": int(fill_per_sqr_meter.sum())}
+
+def enrich_items(items: list, distance_grid=None, created_ts=None) -> list:
+    """
+    cleaning, price backfill and geodata of a whole batch - same output as CleaningPipeline,
+    PricePipeline and SyntheticFeaturesPipeline applied to every item
+
+    returns list of items, or exceptions raised while geocoding them
+    """
+    clean_items(items, created_ts)
+    fill_missing_prices(items)
+
+    results = []
+    for item, geodata in zip(items, get_all_geodata_many([item["address"] for item in items], None, distance_grid)):
+        if isinstance(geodata, Exception):
+            results.append(geodata)
+        else:
+            item.update(geodata)
+            results.append(item)
+    return results
@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+from ogloszenia_trojmiasto.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        data = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsExtension:
+    """
+    exports per-stage metrics of pipelines and callbacks (see metrics.py):
+    - prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics during the crawl
+    - copied into the scrapy stats (metrics/<kind>/<stage>/...) every METRICS_INTERVAL seconds
+    - per-run summary written to LOG_DIR/metrics_<timestamp>.json when the spider closes
+    """
+    def __init__(self, crawler, host, port, interval, summary_dir):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.summary_dir = summary_dir
+        self.server = None
+        self.sample_task = None
+        self.started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+
+        ext = cls(
+            crawler,
+            host=settings.get("METRICS_HOST", "127.0.0.1"),
+            port=settings.getint("METRICS_PORT", 0), # 0 - no http endpoint
+            interval=settings.getfloat("METRICS_INTERVAL", 15),
+            summary_dir=settings.get("LOG_DIR")
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        registry.reset()
+        self.started = datetime.now()
+
+        if self.port:
+            try:
+                self.server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+                logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+            except OSError as e:
+                logger.warning(f"Metrics endpoint not started: {e}")
+                self.server = None
+
+        self.sample_task = task.LoopingCall(self.sample)
+        self.sample_task.start(self.interval, now=False)
+
+    def sample(self):
+        """
+        record queue depths and copy stage metrics into the stats collector
+        """
+        engine = self.crawler.engine
+        slot = getattr(engine, "slot", None)
+        if slot is not None:
+            registry.set_gauge("queue_depth", "scheduler", len(slot.scheduler))
+        registry.set_gauge("queue_depth", "downloader", len(engine.downloader.active))
+        if engine.scraper.slot is not None:
+            registry.set_gauge("queue_depth", "item_processing", engine.scraper.slot.itemproc_size)
+
+        for stage, values in registry.summary()["stages"].items():
+            for key in ("count", "errors", "dropped", "p50_ms", "p95_ms", "max_ms", "in_flight_max"):
+                self.stats.set_value(f"metrics/{stage}/{key}", values[key])
+        for counter, value in registry.summary()["counters"].items():
+            self.stats.set_value(f"metrics/{counter}", value)
+
+    def spider_closed(self, spider, reason):
+        if self.sample_task is not None and self.sample_task.running:
+            self.sample_task.stop()
+        self.sample()
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+        if self.summary_dir:
+            finished = datetime.now()
+            stats = self.stats.get_stats()
+            summary = {
+                "spider": spider.name,
+                "finish_reason": reason,
+                "started": self.started.isoformat(timespec="seconds"),
+                "finished": finished.isoformat(timespec="seconds"),
+                "elapsed_s": round((finished - self.started).total_seconds(), 3),
+                "responses": stats.get("response_received_count", 0),
+                "items": stats.get("item_scraped_count", 0),
+                **registry.summary()
+            }
+            path = os.path.join(self.summary_dir, f"metrics_{self.started:%Y-%m-%d_%H-%M-%S}.json")
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+            logger.info(f"Metrics summary written to {path}")
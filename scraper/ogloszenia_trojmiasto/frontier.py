@@ -0,0 +1,137 @@
+import json
+
+import mysql.connector
+
+class CrawlFrontier:
+    """
+    crawl frontier shared by all scraper workers, stored in the crawl_frontier table
+    (created by migration 0001_initial_schema.sql, applied when the scraper starts)
+
+    urls are added once per crawl (primary key deduplicates them across workers) and claimed
+    with a lease: claimed rows are locked with SKIP LOCKED, so two workers never get the same url.
+    Rows of a worker that died are claimed again once their lease expires; urls failing
+    `max_attempts` times are marked as failed. Every operation runs in its own transaction on
+    a pooled connection of `db_helper`
+    """
+    def __init__(self, db_helper, crawl_id, worker_id, lease_seconds=600, max_attempts=3):
+        self.db_helper = db_helper
+        self.crawl_id = crawl_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def add(self, entries):
+        """
+        add (url, kind, priority, request) entries; urls already in the crawl are ignored
+        returns number of new rows
+        """
+        if not entries:
+            return 0
+
+        def insert(cursor):
+            cursor.executemany(
+                "INSERT IGNORE INTO crawl_frontier (crawl_id, url, kind, priority, request) VALUES (%s, %s, %s, %s, %s)",
+                [(self.crawl_id, url, kind, priority, json.dumps(request)) for url, kind, priority, request in entries]
+            )
+            return cursor.rowcount
+
+        try:
+            return self.db_helper.run_in_transaction(insert)
+        except mysql.connector.Error as error:
+            print(f"Error adding urls to the frontier: {error}")
+            raise
+
+    def claim(self, limit):
+        """
+        lease up to `limit` pending (or expired) urls, highest priority first
+        returns list of (url, request) tuples
+        """
+        def lease(cursor):
+            cursor.execute(
+                """
+                SELECT url, request FROM crawl_frontier
+                WHERE crawl_id = %s AND attempts < %s
+                    AND (status = 'pending' OR (status = 'leased' AND lease_expires < NOW()))
+                ORDER BY priority DESC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+                """,
+                (self.crawl_id, self.max_attempts, limit)
+            )
+            rows = cursor.fetchall()
+
+            if rows:
+                placeholders = ", ".join(["%s"] * len(rows))
+                cursor.execute(
+                    f"""
+                    UPDATE crawl_frontier
+                    SET status = 'leased', lease_owner = %s, lease_expires = NOW() + INTERVAL %s SECOND,
+                        attempts = attempts + 1
+                    WHERE crawl_id = %s AND url IN ({placeholders})
+                    """,
+                    (self.worker_id, self.lease_seconds, self.crawl_id, *(url for url, _ in rows))
+                )
+            return rows
+
+        try:
+            rows = self.db_helper.run_in_transaction(lease)
+        except mysql.connector.Error as error:
+            print(f"Error claiming urls from the frontier: {error}")
+            raise
+
+        return [(url, json.loads(request)) for url, request in rows]
+
+    def done(self, url):
+        self._update(
+            "UPDATE crawl_frontier SET status = 'done', lease_owner = NULL, lease_expires = NULL "
+            "WHERE crawl_id = %s AND url = %s",
+            (self.crawl_id, url)
+        )
+
+    def release(self, url, failed=True):
+        """
+        give the url back to the frontier; failed attempts count towards `max_attempts`,
+        released unfinished work (e.g. on shutdown) does not
+        """
+        if failed:
+            query = (
+                "UPDATE crawl_frontier SET status = IF(attempts >= %s, 'failed', 'pending'), "
+                "lease_owner = NULL, lease_expires = NULL WHERE crawl_id = %s AND url = %s AND lease_owner = %s"
+            )
+            params = (self.max_attempts, self.crawl_id, url, self.worker_id)
+        else:
+            query = (
+                "UPDATE crawl_frontier SET status = 'pending', attempts = GREATEST(attempts - 1, 0), "
+                "lease_owner = NULL, lease_expires = NULL WHERE crawl_id = %s AND url = %s AND lease_owner = %s"
+            )
+            params = (self.crawl_id, url, self.worker_id)
+        self._update(query, params)
+
+    def has_work(self):
+        """
+        check if any url of the crawl is still pending or leased (possibly by another worker)
+        """
+        # new snapshot on every check (connection is returned right away), so it sees other workers' updates
+        ((exists,),) = self.db_helper.fetch_all(
+            "SELECT EXISTS(SELECT 1 FROM crawl_frontier WHERE crawl_id = %s AND status IN ('pending', 'leased') "
+            "AND attempts < %s)",
+            (self.crawl_id, self.max_attempts)
+        )
+        return bool(exists)
+
+    def status_counts(self):
+        return dict(self.db_helper.fetch_all(
+            "SELECT status, COUNT(*) FROM crawl_frontier WHERE crawl_id = %s GROUP BY status", (self.crawl_id,)
+        ))
+
+    def purge(self, keep_days=7):
+        """
+        delete rows of old crawls
+        """
+        self._update("DELETE FROM crawl_frontier WHERE updated_ts < NOW() - INTERVAL %s DAY", (keep_days,))
+
+    def _update(self, query, params):
+        try:
+            self.db_helper.run_in_transaction(lambda cursor: cursor.execute(query, params))
+        except mysql.connector.Error as error:
+            print(f"Error updating the frontier: {error}")
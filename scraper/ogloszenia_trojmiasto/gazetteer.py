@@ -0,0 +1,281 @@
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from ogloszenia_trojmiasto.address_keys import normalize_tokens
+from ogloszenia_trojmiasto.geocoding_cache import CACHE_DIR
+from ogloszenia_trojmiasto.metrics import Histogram
+
+DEFAULT_PATH = os.path.join(CACHE_DIR, "gazetteer.sqlite")
+
+# type of area returned for a city (same as requested from nominatim). If city name not in the dict, it's a county town
+CITY_AREA_MAPPINGS = {
+    "sopot": "quarter",
+    "gdynia": "suburb",
+    "gdańsk": "suburb"
+}
+
+def trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class Gazetteer:
+    """
+    offline geocoder over an OSM address extract (see build_gazetteer), used before nominatim
+
+    places are streets, areas and cities with the centroid of their address points. Addresses
+    are matched token by token: every query token is paired with the most similar token of
+    the place (trigram similarity, so "Gaulle'a" matches "Gaulle" and "Gorny" matches "Górny"),
+    the score is the matched share of the query (weighted by token length). The place has to
+    match the city and reach `min_score`, otherwise the lookup is a miss
+    """
+    def __init__(self, path=None, min_score=0.8, min_similarity=0.5):
+        self.path = path or DEFAULT_PATH
+        self.min_score = min_score
+        self.min_similarity = min_similarity
+
+        self.places = None # loaded on first lookup
+        self.hits = 0
+        self.misses = 0
+        self.latency = Histogram()
+        self._lock = threading.Lock()
+
+    def configure(self, path=None, min_score=None):
+        """
+        override parameters (e.g. from scrapy settings) before first use
+        """
+        if path and path != self.path:
+            self.path = path
+            self.places = None
+        if min_score is not None:
+            self.min_score = min_score
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self.places is None:
+                self._load()
+
+    def _load(self):
+        """
+        read places and build the token/trigram index; empty if the gazetteer wasn't built
+        """
+        self.places = []
+        self.postings = defaultdict(list) # token -> place ids
+        self.token_trigrams = defaultdict(set) # trigram -> tokens
+        if not os.path.exists(self.path):
+            return
+
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute("SELECT city, area, street, latitude, longitude FROM places").fetchall()
+        finally:
+            conn.close()
+
+        for place_id, (city, area, street, lat, lon) in enumerate(rows):
+            city_tokens = normalize_tokens(city)
+            tokens = list(dict.fromkeys(city_tokens + normalize_tokens(area or "") + normalize_tokens(street or "")))
+            self.places.append({
+                "loc": {"latitude": lat, "longitude": lon, "area": area, "city": city},
+                "tokens": tokens,
+                "city_tokens": set(city_tokens),
+                "specificity": 2 if street else 1 if area else 0
+            })
+            for token in tokens:
+                self.postings[token].append(place_id)
+        for token in self.postings:
+            for trigram in trigrams(token):
+                self.token_trigrams[trigram].add(token)
+
+    def similar_tokens(self, token: str) -> dict:
+        """
+        indexed tokens similar to `token` -> trigram (jaccard) similarity
+        """
+        if token in self.postings:
+            return {token: 1.0}
+        if len(token) < 3:
+            return {} # too short for fuzzy matching
+        query = trigrams(token)
+        shared = Counter(candidate for trigram in query for candidate in self.token_trigrams.get(trigram, ()))
+        similar = {}
+        for candidate, count in shared.items():
+            similarity = count / (len(query) + len(trigrams(candidate)) - count)
+            if similarity >= self.min_similarity:
+                similar[candidate] = similarity
+        return similar
+
+    def match(self, address: str):
+        """
+        best matching place as (loc, score), or (None, 0.0)
+        """
+        self._ensure_loaded()
+        tokens = list(dict.fromkeys(normalize_tokens(address)))
+        if not tokens or not self.places:
+            return None, 0.0
+
+        similar = [self.similar_tokens(token) for token in tokens]
+        candidates = Counter()
+        for token_matches in similar:
+            for place_token in token_matches:
+                candidates.update(self.postings[place_token])
+
+        total = sum(len(token) for token in tokens)
+        best, best_key = None, None
+        for place_id, _ in candidates.most_common(50):
+            place = self.places[place_id]
+            matched_weight = 0.0
+            matched = set()
+            for token, token_matches in zip(tokens, similar):
+                similarity, place_token = max(
+                    ((token_matches[t], t) for t in place["tokens"] if t in token_matches), default=(0.0, None)
+                )
+                if place_token is not None:
+                    matched_weight += similarity * len(token)
+                    matched.add(place_token)
+            if not place["city_tokens"] <= matched:
+                continue
+            score = matched_weight / total
+            # ties: more place tokens explained, then the more specific place
+            key = (score, len(matched) / len(place["tokens"]), place["specificity"])
+            if best_key is None or key > best_key:
+                best, best_key = place, key
+
+        if best is None:
+            return None, 0.0
+        return dict(best["loc"]), best_key[0]
+
+    def lookup(self, address) -> dict:
+        """
+        returns location dict (same shape as from nominatim) or None on miss
+        """
+        self._ensure_loaded()
+        if not isinstance(address, str) or not self.places:
+            return None
+
+        start = time.perf_counter()
+        loc, score = self.match(address)
+        if loc is not None and score < self.min_score:
+            loc = None
+
+        with self._lock:
+            self.latency.observe(time.perf_counter() - start)
+            if loc is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return loc
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "gazetteer/hits": self.hits,
+                "gazetteer/misses": self.misses,
+                "gazetteer/hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "gazetteer/lookup_ms_p50": round(self.latency.quantile(0.5) * 1000, 3),
+                "gazetteer/lookup_ms_p95": round(self.latency.quantile(0.95) * 1000, 3),
+                "gazetteer/lookup_ms_max": round(self.latency.max * 1000, 3)
+            }
+
+def column(row: dict, *names):
+    for name in names:
+        if row.get(name):
+            return row[name].strip()
+    return None
+
+def counties_from_cache(cache_path: str) -> dict:
+    """
+    county of every county town geocoded by nominatim so far (city -> most common area)
+    """
+    if not os.path.exists(cache_path):
+        return {}
+    conn = sqlite3.connect(cache_path)
+    try:
+        rows = conn.execute("SELECT location FROM geocoding_cache WHERE location IS NOT NULL").fetchall()
+    finally:
+        conn.close()
+
+    counts = defaultdict(Counter)
+    for (location,) in rows:
+        loc = json.loads(location)
+        if loc.get("city") and loc.get("area") and loc["city"].lower() not in CITY_AREA_MAPPINGS:
+            counts[loc["city"]][loc["area"]] += 1
+    return {city: areas.most_common(1)[0][0] for city, areas in counts.items()}
+
+def build_gazetteer(csv_path: str, path: str = DEFAULT_PATH, counties: dict = None) -> int:
+    """
+    aggregate address points of an overpass CSV extract into places (street, area and city
+    centroids) stored in SQLite. Expected columns: ::lat, ::lon, addr:city, addr:street and
+    addr:suburb / addr:quarter / county (area type depends on the city, see CITY_AREA_MAPPINGS;
+    counties can also be given as city -> county dict). Points without area are skipped,
+    nominatim returns an area for them
+
+    overpass query (https://overpass-turbo.eu, export as CSV):
+        [out:csv(::lat, ::lon, "addr:city", "addr:suburb", "addr:quarter", "addr:street"; true; ",")][timeout:300];
+        area["name"="województwo pomorskie"]["admin_level"="4"]->.a;
+        nwr["addr:city"]["addr:street"](area.a);
+        out center;
+
+    returns number of places
+    """
+    counties = counties or {}
+    sums = defaultdict(lambda: [0.0, 0.0, 0]) # (city, area, street) -> [lat sum, lon sum, points]
+    with open(csv_path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            city = column(row, "addr:city", "city")
+            street = column(row, "addr:street", "street")
+            lat, lon = column(row, "::lat", "@lat", "lat"), column(row, "::lon", "@lon", "lon")
+            if not city or not lat or not lon:
+                continue
+
+            area_type = CITY_AREA_MAPPINGS.get(city.lower(), "county")
+            area = column(row, f"addr:{area_type}", area_type) or (counties.get(city) if area_type == "county" else None)
+            if not area:
+                continue
+
+            # city level place of a county town has the county as area, like from nominatim
+            city_key = (city, area if area_type == "county" else None, None)
+            for key in {(city, area, street), (city, area, None), city_key}:
+                entry = sums[key]
+                entry[0] += float(lat)
+                entry[1] += float(lon)
+                entry[2] += 1
+
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("""
+            CREATE TABLE places (
+                city TEXT NOT NULL,
+                area TEXT,
+                street TEXT,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                points INTEGER NOT NULL
+            )
+        """)
+        conn.executemany(
+            "INSERT INTO places VALUES (?, ?, ?, ?, ?, ?)",
+            [(city, area, street, lat / n, lon / n, n) for (city, area, street), (lat, lon, n) in sums.items()]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path) # running scrapers keep reading the old file until reload
+
+    return len(sums)
+
+if __name__ == "__main__":
+    # build step: python -m ogloszenia_trojmiasto.gazetteer extract.csv [output.sqlite]
+    from ogloszenia_trojmiasto.geocoding_cache import GeocodingCache
+    places = build_gazetteer(
+        sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else DEFAULT_PATH, counties_from_cache(GeocodingCache().path)
+    )
+    print(f"gazetteer with {places} places built")
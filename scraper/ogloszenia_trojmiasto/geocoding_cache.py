@@ -0,0 +1,163 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ogloszenia_trojmiasto.address_keys import address_key
+
+CACHE_DIR = os.getenv("SCRAPER_CACHE_DIR", "/scraper/cache")
+
+KEY_VERSION = 1 # bump when address_key changes - stored keys are recalculated on open
+
+class GeocodingCache:
+    """
+    persistent geocoding cache stored in a local SQLite file
+
+    successful lookups are kept for `ttl` seconds, failed lookups (address not found)
+    for `negative_ttl` seconds. Once the cache holds more than `max_entries` rows,
+    the least recently used entries are evicted
+
+    entries are stored under canonical address keys (address_keys.address_key), so spelling
+    variants of the same address share one entry
+    """
+    def __init__(self, path=None, ttl=90 * 24 * 3600, negative_ttl=7 * 24 * 3600, max_entries=100_000):
+        self.path = path or os.path.join(CACHE_DIR, "geocoding.sqlite")
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        self._lock = threading.Lock() # connection is shared between geocoding threads
+        self._writes_since_eviction = 0
+
+    def configure(self, path=None, ttl=None, negative_ttl=None, max_entries=None):
+        """
+        override cache parameters (e.g. from scrapy settings) before first use
+        """
+        if path and path != self.path:
+            self.close()
+            self.path = path
+        if ttl is not None:
+            self.ttl = ttl
+        if negative_ttl is not None:
+            self.negative_ttl = negative_ttl
+        if max_entries is not None:
+            self.max_entries = max_entries
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocoding_cache (
+                    address TEXT PRIMARY KEY,
+                    location TEXT,
+                    expires_ts REAL NOT NULL,
+                    accessed_ts REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS accessed_idx ON geocoding_cache (accessed_ts)")
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+            if version < KEY_VERSION:
+                self._rekey(self._conn)
+            self._conn.commit()
+        return self._conn
+
+    def _rekey(self, conn):
+        """
+        recalculate keys of stored entries (cache written by an older version); of entries
+        sharing a key, positive ones and then the most recently used are kept
+        """
+        rows = conn.execute("SELECT address, location, expires_ts, accessed_ts FROM geocoding_cache").fetchall()
+        entries = {}
+        for address, location, expires_ts, accessed_ts in rows:
+            key = address_key(address)
+            rank = (location is not None, accessed_ts)
+            if key not in entries or rank > entries[key][0]:
+                entries[key] = (rank, (key, location, expires_ts, accessed_ts))
+
+        conn.execute("DELETE FROM geocoding_cache")
+        conn.executemany("INSERT INTO geocoding_cache VALUES (?, ?, ?, ?)", [row for _, row in entries.values()])
+        conn.execute(f"PRAGMA user_version = {KEY_VERSION}")
+
+    def get(self, address):
+        """
+        returns (found, location) tuple; location is None for negatively cached addresses
+        """
+        address = address_key(address)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT location, expires_ts FROM geocoding_cache WHERE address = ?", (address,)
+            ).fetchone()
+
+            # counters are updated under the lock - get() is called from the geocoding threads
+            if not row or row[1] < now:
+                self.misses += 1
+                return False, None
+
+            conn.execute("UPDATE geocoding_cache SET accessed_ts = ? WHERE address = ?", (now, address))
+            conn.commit()
+
+            if row[0] is None:
+                self.negative_hits += 1
+                return True, None
+
+            self.hits += 1
+        return True, json.loads(row[0])
+
+    def set(self, address, location):
+        """
+        store geocoded location; pass location=None to remember a failed lookup
+        """
+        address = address_key(address)
+        now = time.time()
+        ttl = self.ttl if location is not None else self.negative_ttl
+        value = json.dumps(location) if location is not None else None
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO geocoding_cache (address, location, expires_ts, accessed_ts) VALUES (?, ?, ?, ?)",
+                (address, value, now + ttl, now)
+            )
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= 100:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        """
+        drop expired entries and trim the cache down to max_entries (least recently used first)
+        """
+        self._writes_since_eviction = 0
+        conn.execute("DELETE FROM geocoding_cache WHERE expires_ts < ?", (now,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM geocoding_cache").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM geocoding_cache WHERE address IN "
+                "(SELECT address FROM geocoding_cache ORDER BY accessed_ts ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "geocoding_cache/hits": self.hits,
+                "geocoding_cache/negative_hits": self.negative_hits,
+                "geocoding_cache/misses": self.misses
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._evict(self._conn, time.time())
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
@@ -1,13 +1,75 @@
 from geopy.geocoders import Nominatim
 from shapely.geometry import Point
 from shapely.ops import nearest_points
-import geopandas as gpd
+from shapely import STRtree
+from pyproj import Transformer
+import shapely
 from geographiclib.geodesic import Geodesic
+from ogloszenia_trojmiasto.address_keys import address_key
+from ogloszenia_trojmiasto.geocoding_cache import GeocodingCache, CACHE_DIR
+from ogloszenia_trojmiasto.gazetteer import Gazetteer, CITY_AREA_MAPPINGS
+from contextlib import contextmanager
+import hashlib
 import os
+import threading
 import time
 
+class RateLimiter:
+    """
+    thread-safe token bucket limiting calls to `rate` per second (with bursts up to `capacity`)
+    """
+    def __init__(self, rate: float = 1.0, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        block the calling thread until a token is available
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class KeyedLock:
+    """
+    one lock per key, created on demand and dropped once no thread holds or waits for it
+    """
+    def __init__(self):
+        self.locks = {} # key -> [lock, number of users]
+        self.lock = threading.Lock()
+        self.waits = 0 # acquisitions of a key already held by another thread
+
+    @contextmanager
+    def hold(self, key):
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            if entry[1]:
+                self.waits += 1
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[key]
+
 geolocator = Nominatim(user_agent="geo_distance")
-geocoding_cache = {} # store processed data for current scraping session
+geocoding_cache = GeocodingCache() # persisted between scraping sessions
+gazetteer = Gazetteer() # offline geocoder, nominatim is asked only for addresses it can't match
+rate_limiter = RateLimiter(rate=1.0) # nominatim usage policy: max 1 request per second
+address_locks = KeyedLock() # geocoding threads wait for an in-flight lookup of the same address key
 
 downtown_coordinates = {
     "Gdańsk": (54.3495703, 18.6477211),
@@ -17,24 +79,32 @@ downtown_coordinates = {
 
 def get_location_data(address: str, retry_count: int = 3) -> dict:
     """
-    get geo data with single api call 
+    get geo data with single api call; concurrent lookups of addresses with the same
+    canonical key are made once - the other threads read the result from the cache
     """
-    if address in geocoding_cache:
-        return geocoding_cache[address]
-   
-    # type of area to return from API json response
-    CITY_AREA_MAPPINGS = {
-        "sopot": "quarter",
-        "gdynia": "suburb",
-        "gdańsk": "suburb"
-    }
+    with address_locks.hold(address_key(address)):
+        return geocode(address, retry_count)
+
+def geocode(address: str, retry_count: int = 3) -> dict:
+    found, cached = geocoding_cache.get(address)
+    if found:
+        if cached is None:
+            raise ValueError(f"address {address} not found (cached)")
+        return cached
+
+    loc = gazetteer.lookup(address)
+    if loc is not None:
+        geocoding_cache.set(address, loc) # variants of the address get the same location
+        return loc
  
     for attempt in range(retry_count):
+        not_found = False
         try:
-            time.sleep(1) # respect api rate limits 
+            rate_limiter.acquire() # respect api rate limits 
             location = geolocator.geocode(address, addressdetails=True)
             
             if not location:
+                not_found = True
                 raise ValueError(f"address {address} not found")
 
             raw_data = location.raw
@@ -50,25 +120,65 @@ def get_location_data(address: str, retry_count: int = 3) -> dict:
                 "city": address_data.get("city") or address_data.get("town") or address_data.get("village")
             }
             
-            geocoding_cache[address] = loc
+            geocoding_cache.set(address, loc)
 
             return loc
 
         except Exception as e:
             if attempt == retry_count - 1:
+                if not_found:
+                    geocoding_cache.set(address, None) # negative caching - don't retry unknown addresses
                 raise ValueError(f"failed to geocode address after {retry_count} attempts: {e}")
             time.sleep(5)
 
-def load_coastline():
+class CoastlineIndex:
     """
-    load and clip europe's coastline shapefile
+    spatial index over the coastline
+
+    coastline is split into single segments projected to EPSG:2180 (metric CRS for Poland)
+    and stored in a STRtree. Nearest segment lookups are logarithmic, the exact geodesic
+    distance is calculated only for the winning candidates
     """
+    def __init__(self, coastline, tolerance: float = 0.005):
+        self.coastline = coastline
+        self.tolerance = tolerance # relative margin for EPSG:2180 scale distortion
+        self.to_metric = Transformer.from_crs("EPSG:4326", "EPSG:2180", always_xy=True)
+        self.to_geographic = Transformer.from_crs("EPSG:2180", "EPSG:4326", always_xy=True)
 
-    project_root = os.path.dirname(os.path.abspath(__file__))
-    coastline_shapefile_path = os.path.join(project_root, "shapefiles", "Europe_coastline_shapefile", "Europe_coastline.shp")
-    world_shapefile_path = os.path.join(project_root, "shapefiles", "ne_110m_admin_0_countries", "ne_110m_admin_0_countries.shp")
-    country = "Poland"
+        segments = []
+        for line in getattr(coastline, "geoms", [coastline]):
+            x, y = self.to_metric.transform(*line.xy)
+            coords = list(zip(x, y))
+            segments.extend(zip(coords[:-1], coords[1:]))
 
+        self.segments = shapely.linestrings(segments)
+        self.tree = STRtree(self.segments)
+
+    def distance(self, address_point: Point) -> float:
+        """
+        geodesic distance (km) from (lon, lat) point to the nearest coastline segment
+        """
+        projected = Point(*self.to_metric.transform(address_point.x, address_point.y))
+        _, planar_distance = self.tree.query_nearest(projected, return_distance=True)
+        candidates = self.tree.query(
+            projected, predicate="dwithin", distance=planar_distance.min() * (1 + self.tolerance) + 1
+        )
+
+        min_distance = float("inf")
+        for idx in candidates:
+            nearest_point = nearest_points(projected, self.segments[idx])[1]
+            lon, lat = self.to_geographic.transform(nearest_point.x, nearest_point.y)
+            distance = calculate_distance((address_point.y, address_point.x), (lat, lon))
+            if distance < min_distance:
+                min_distance = distance
+
+        return min_distance
+
+def clip_coastline(coastline_shapefile_path: str, world_shapefile_path: str, country: str = "Poland"):
+    """
+    load and clip europe's coastline shapefile
+    """
+    import geopandas as gpd # heavy import, only needed when the cached artifact is rebuilt
 
     # load the world's shapefile and filter it by country name:
     world = gpd.read_file(world_shapefile_path)
@@ -82,6 +192,73 @@ def load_coastline():
     
     return coastline
 
+def hash_files(paths: list) -> str:
+    """
+    sha256 of the files content; a missing file is hashed as a sentinel with its name,
+    so the hash of an incomplete set of files never matches the complete one
+    """
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        if not os.path.exists(path):
+            digest.update(b"missing:" + os.path.basename(path).encode())
+            continue
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def load_coastline(cache_dir: str = CACHE_DIR):
+    """
+    load clipped coastline and return spatial index over it
+
+    the clipped coastline is cached as WKB keyed by hash of the source shapefiles,
+    so it's rebuilt only when the shapefiles change. Missing source files without a matching
+    cached artifact raise FileNotFoundError
+    """
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    coastline_shapefile_path = os.path.join(project_root, "shapefiles", "Europe_coastline_shapefile", "Europe_coastline.shp")
+    world_shapefile_path = os.path.join(project_root, "shapefiles", "ne_110m_admin_0_countries", "ne_110m_admin_0_countries.shp")
+
+    source_files = [
+        os.path.splitext(path)[0] + extension
+        for path in (coastline_shapefile_path, world_shapefile_path)
+        for extension in (".shp", ".shx", ".dbf", ".prj")
+    ]
+    artifact_path = os.path.join(cache_dir, f"coastline_{hash_files(source_files)[:16]}.wkb")
+
+    if os.path.exists(artifact_path):
+        with open(artifact_path, "rb") as f:
+            coastline = shapely.from_wkb(f.read())
+    else:
+        missing = [path for path in source_files if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(
+                f"coastline source files not found: {', '.join(missing)} "
+                f"(no cached coastline {artifact_path} built from the complete shapefiles)"
+            )
+        coastline = clip_coastline(coastline_shapefile_path, world_shapefile_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{artifact_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(shapely.to_wkb(coastline))
+        os.replace(tmp_path, artifact_path) # atomic - concurrent workers never read partial files
+
+    return CoastlineIndex(coastline)
+
+_coastline = None
+_coastline_lock = threading.Lock()
+
+def get_coastline():
+    """
+    lazily loaded coastline index shared by all callers in the process
+    """
+    global _coastline
+    with _coastline_lock:
+        if _coastline is None:
+            _coastline = load_coastline()
+    return _coastline
+
 def calculate_distance(coord1: tuple, coord2: tuple) -> float:
     """
     calculate geodesic distance between coordinates using Vincenty's Formula
@@ -96,46 +273,51 @@ def calculate_distance(coord1: tuple, coord2: tuple) -> float:
     
     return result["s12"] / 1000 # return distance in kilometers
 
-def calculate_coastline_distance(address_point: Point, coastline) -> float:
+def calculate_coastline_distance(address_point: Point, coastline: CoastlineIndex) -> float:
     """
     calculate the distance from an address to the nearest point on the coastline
     """
-    min_distance = float("inf")
-    # calculate distance to the nearest point on the coastline:
-    for line in coastline.geoms:
-        nearest_point = nearest_points(address_point, line)[1]
-        distance = calculate_distance(
-            (address_point.y, address_point.x), (nearest_point.y, nearest_point.x)
-            )
+    return coastline.distance(address_point)
+
+def calculate_distances(lat: float, lon: float, coastline) -> dict:
+    """
+    exact distances (km) from (lat, lon) to the coastline and to the downtowns
+    """
+    # calculate coastline distance
+    coastline_distance = calculate_coastline_distance(Point(lon, lat), coastline)
 
-        if distance < min_distance:
-            min_distance = distance
+    # calculate downtown distances
+    downtown_distances = {
+        city: calculate_distance((lat, lon), coords)
+        for city, coords in downtown_coordinates.items()
+    }
 
-    return min_distance
+    return {
+        "coastline_distance": coastline_distance,
+        "gdynia_downtown_distance": downtown_distances["Gdynia"],
+        "gdansk_downtown_distance": downtown_distances["Gdańsk"],
+        "sopot_downtown_distance": downtown_distances["Sopot"]
+    }
 
-def get_all_geodata(address: str, coastline) -> dict:
+def get_all_geodata(address: str, coastline=None, distance_grid=None) -> dict:
     """
     calculate distances to coastline and downtowns and return adressess district/area/county
+
+    if coastline is None, the shared coastline index is loaded on first use
+
+    if precomputed distance_grid is given, distances are interpolated from the grid;
+    points outside the grid (or in low accuracy cells) fall back to exact calculations
     """
     try:
         loc_data = get_location_data(address)
         lon, lat = loc_data["longitude"], loc_data["latitude"]
-        point = Point(lon, lat)
-
-        # calculate coastline distance
-        coastline_distance = calculate_coastline_distance(point, coastline)
 
-        # calculate downtown distances
-        downtown_distances = {
-            city: calculate_distance((lat, lon), coords)
-            for city, coords in downtown_coordinates.items()
-        }
+        distances = distance_grid.lookup(lat, lon) if distance_grid is not None else None
+        if distances is None:
+            distances = calculate_distances(lat, lon, coastline if coastline is not None else get_coastline())
 
         return {
-            "coastline_distance": coastline_distance,
-            "gdynia_downtown_distance": downtown_distances["Gdynia"],
-            "gdansk_downtown_distance": downtown_distances["Gdańsk"],
-            "sopot_downtown_distance": downtown_distances["Sopot"],
+            **distances,
             "city": loc_data["city"],
             "area": loc_data["area"],
             "latitude": lat,
@@ -143,16 +325,81 @@ def get_all_geodata(address: str, coastline) -> dict:
         }
 
     except ValueError:
-        return {
-            "coastline_distance": None,
-            "gdynia_downtown_distance": None,
-            "gdansk_downtown_distance": None, 
-            "sopot_downtown_distance": None,
-            "city": None,
-            "area": None,
-            "latitude": None,
-            "longitude": None
-        }
+        return empty_geodata()
+
+def empty_geodata() -> dict:
+    """
+    geodata of addresses that couldn't be located
+    """
+    return {
+        "coastline_distance": None,
+        "gdynia_downtown_distance": None,
+        "gdansk_downtown_distance": None, 
+        "sopot_downtown_distance": None,
+        "city": None,
+        "area": None,
+        "latitude": None,
+        "longitude": None
+    }
+
+def get_all_geodata_many(addresses: list, coastline=None, distance_grid=None) -> list:
+    """
+    batch version of get_all_geodata - every distinct address key is geocoded once and distances
+    of all located points are interpolated from the distance grid in a single vectorized lookup
+    (points outside the grid fall back to exact calculations)
+
+    returns geodata dict per address, or the exception raised while geocoding it
+    """
+    locations = {}
+    by_key = {} # spelling variants of one address are geocoded once
+    for address in dict.fromkeys(addresses):
+        key = address_key(address)
+        if key not in by_key:
+            try:
+                by_key[key] = get_location_data(address)
+            except ValueError:
+                by_key[key] = None
+            except Exception as e:
+                by_key[key] = e
+        locations[address] = by_key[key]
+
+    located = [address for address, loc in locations.items() if isinstance(loc, dict)]
+    distances = {}
+    if distance_grid is not None and located:
+        values, valid = distance_grid.lookup_many(
+            [locations[address]["latitude"] for address in located],
+            [locations[address]["longitude"] for address in located]
+        )
+        for address, row, is_valid in zip(located, values, valid):
+            if is_valid:
+                distances[address] = {feature: float(value) for feature, value in zip(distance_grid.features, row)}
+
+    for address in located:
+        if address not in distances:
+            loc = locations[address]
+            try:
+                distances[address] = calculate_distances(
+                    loc["latitude"], loc["longitude"], coastline if coastline is not None else get_coastline()
+                )
+            except ValueError:
+                locations[address] = None
+
+    results = []
+    for address in addresses:
+        loc = locations[address]
+        if isinstance(loc, Exception):
+            results.append(loc)
+        elif loc is None:
+            results.append(empty_geodata())
+        else:
+            results.append({
+                **distances[address],
+                "city": loc["city"],
+                "area": loc["area"],
+                "latitude": loc["latitude"],
+                "longitude": loc["longitude"]
+            })
+    return results
 
 if __name__ == "__main__":
     coastline = load_coastline()
@@ -31,4 +31,3 @@ class OgloszenieItem(scrapy.Item):
     longitude = scrapy.Field()
     created_ts = scrapy.Field()
     scraped_ts = scrapy.Field()
-    is_latest = scrapy.Field()
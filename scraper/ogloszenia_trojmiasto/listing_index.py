@@ -0,0 +1,196 @@
+import math
+import sys
+import time
+from array import array
+from datetime import datetime
+
+NULL = float("nan") # missing values in numeric columns
+DAY = 24 * 3600
+
+def to_float32(value) -> float:
+    """
+    round value the same way as mysql FLOAT column
+    """
+    return NULL if value is None else array("f", [float(value)])[0]
+
+class RecrawlPolicy:
+    """
+    per-listing recrawl interval learned from how often the listing changed
+
+    changes are modeled as a Poisson process with rate estimated from the number of detected
+    changes over the observed lifetime of the listing (with a prior of `prior_changes` per
+    `prior_days` for listings with short history). Listing is due when the probability that
+    it changed since the last scrape reaches `change_probability`
+    """
+    def __init__(self, min_days=1, max_days=60, change_probability=0.5, prior_changes=1, prior_days=10):
+        self.min_days = min_days
+        self.max_days = max_days
+        self.change_probability = change_probability
+        self.prior_changes = prior_changes
+        self.prior_days = prior_days
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            min_days=settings.getfloat("RECRAWL_MIN_DAYS", 1),
+            max_days=settings.getfloat("RECRAWL_MAX_DAYS", 60),
+            change_probability=settings.getfloat("RECRAWL_CHANGE_PROBABILITY", 0.5),
+            prior_changes=settings.getfloat("RECRAWL_PRIOR_CHANGES", 1),
+            prior_days=settings.getfloat("RECRAWL_PRIOR_DAYS", 10)
+        )
+
+    def interval(self, changes: int, observed_days: float) -> float:
+        """
+        recrawl interval in days
+        """
+        rate = (changes + self.prior_changes) / (max(observed_days, 0) + self.prior_days) # changes per day
+        interval = -math.log(1 - self.change_probability) / rate
+        return min(max(interval, self.min_days), self.max_days)
+
+class ListingIndex:
+    """
+    crawl-scoped state of the latest version of every listing:
+    url -> (row id, scraped_ts, price, price_per_sqr_meter, square_meters, changes, first_seen)
+
+    urls are interned and mapped to a row position; numeric values are kept in
+    array-backed columns, so the index stays small with hundreds of thousands of listings
+    """
+    def __init__(self):
+        self.positions = {}
+        self.ids = array("q")
+        self.scraped_ts = array("d") # unix timestamp
+        self.price = array("f") # float32, same precision as mysql FLOAT
+        self.price_per_sqr_meter = array("f")
+        self.square_meters = array("f")
+        self.changes = array("I") # number of detected changes (versions - 1)
+        self.first_seen = array("d") # unix timestamp of the first version
+        self.recrawl_policy = RecrawlPolicy()
+
+    @classmethod
+    def from_db(cls, db_helper, batch_size: int = 10_000):
+        """
+        load the index with a single streamed query
+        """
+        index = cls()
+        for row in db_helper.iter_latest_listings(batch_size):
+            row_id, url, scraped_ts, price, price_per_sqr_meter, square_meters, versions, first_seen = row
+            index.upsert(url, row_id, scraped_ts, price, price_per_sqr_meter, square_meters)
+            index.set_history(url, versions - 1, first_seen)
+        return index
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, url):
+        return url in self.positions
+
+    def upsert(self, url, row_id, scraped_ts, price, price_per_sqr_meter, square_meters=None):
+        """
+        add new listing or replace values of the existing one
+        """
+        ts = scraped_ts.timestamp() if isinstance(scraped_ts, datetime) else (scraped_ts or time.time())
+        position = self.positions.get(url)
+        if position is None:
+            self.positions[sys.intern(url)] = len(self.ids)
+            self.ids.append(row_id or 0)
+            self.scraped_ts.append(ts)
+            self.price.append(to_float32(price))
+            self.price_per_sqr_meter.append(to_float32(price_per_sqr_meter))
+            self.square_meters.append(to_float32(square_meters))
+            self.changes.append(0)
+            self.first_seen.append(ts)
+        else:
+            self.ids[position] = row_id or self.ids[position]
+            self.scraped_ts[position] = ts
+            self.price[position] = to_float32(price)
+            self.price_per_sqr_meter[position] = to_float32(price_per_sqr_meter)
+            self.square_meters[position] = to_float32(square_meters)
+
+    def set_history(self, url, changes, first_seen):
+        position = self.positions[url]
+        self.changes[position] = changes
+        if first_seen is not None:
+            self.first_seen[position] = first_seen.timestamp() if isinstance(first_seen, datetime) else first_seen
+
+    def record_change(self, url):
+        """
+        count detected change - listing will be checked more often
+        """
+        position = self.positions.get(url)
+        if position is not None:
+            self.changes[position] += 1
+
+    def recrawl_interval(self, url, now=None):
+        """
+        learned recrawl interval in days, None for unknown urls
+        """
+        position = self.positions.get(url)
+        if position is None:
+            return None
+        observed_days = ((now or time.time()) - self.first_seen[position]) / DAY
+        return self.recrawl_policy.interval(self.changes[position], observed_days)
+
+    def is_due(self, url, now=None) -> bool:
+        """
+        check if listing should be scraped again (always True for new listings)
+        """
+        position = self.positions.get(url)
+        if position is None:
+            return True
+        now = now or time.time()
+        return now - self.scraped_ts[position] >= self.recrawl_interval(url, now) * DAY
+
+    def touch(self, url, scraped_ts=None):
+        """
+        update last scraped timestamp of unchanged listing
+        """
+        position = self.positions.get(url)
+        if position is not None:
+            self.scraped_ts[position] = scraped_ts or time.time()
+
+    def get_scraped_ts(self, url):
+        """
+        returns datetime of the last scrape or None for unknown urls
+        """
+        position = self.positions.get(url)
+        if position is None:
+            return None
+        return datetime.fromtimestamp(self.scraped_ts[position])
+
+    def get_id(self, url):
+        position = self.positions.get(url)
+        return None if position is None else self.ids[position]
+
+    def is_changed(self, item) -> bool:
+        """
+        check if item differs from the latest stored version (True for new listings)
+        """
+        position = self.positions.get(item["url"])
+        if position is None:
+            return True
+
+        stored_values = (self.price[position], self.price_per_sqr_meter[position])
+        new_values = (item.get("price"), item.get("price_per_sqr_meter"))
+        return not values_match(stored_values, new_values)
+
+    def matches_card(self, url, price, square_meters) -> bool:
+        """
+        check if price and area shown on the listing card match the latest stored version
+        """
+        position = self.positions.get(url)
+        if position is None or price is None or square_meters is None:
+            return False
+        return values_match((self.price[position], self.square_meters[position]), (price, square_meters))
+
+def values_match(stored_values, new_values) -> bool:
+    """
+    compare float32 values stored in the index with new values (NaN/None means missing)
+    """
+    for stored, new in zip(stored_values, map(to_float32, new_values)):
+        if math.isnan(stored) and math.isnan(new):
+            continue
+        # mysql returns FLOAT values rounded to 6 significant digits
+        if math.isnan(stored) or math.isnan(new) or not math.isclose(stored, new, rel_tol=1e-5):
+            return False
+
+    return True
@@ -0,0 +1,226 @@
+import functools
+import threading
+import time
+
+from scrapy.exceptions import DropItem
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+# histogram bucket upper bounds in seconds (prometheus default buckets extended for slow geocoding)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """
+    cumulative latency histogram with fixed buckets (prometheus style)
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        quantile estimated by linear interpolation inside the bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip((*self.buckets, self.max), self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                return min(lower + (bound - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+            lower = bound
+        return self.max
+
+class MetricsRegistry:
+    """
+    per-stage latency histograms, outcome counters and in-flight gauges of pipelines,
+    spider callbacks and the database pool; stages are identified by (kind, name), e.g.
+    ("pipeline", "PricePipeline") or ("db_pool", "wait"). Event counters (e.g. connection churn) by (name, event)
+    """
+    def __init__(self):
+        self.lock = threading.Lock() # rendered from the metrics http server thread
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.outcomes = {} # (kind, name, outcome) -> count
+            self.in_flight = {} # (kind, name) -> current count
+            self.in_flight_max = {}
+            self.gauges = {} # (name, label) -> value, e.g. ("queue_depth", "scheduler")
+            self.counters = {} # (name, event) -> count, e.g. ("db_connections", "opened")
+
+    def start(self, kind, name):
+        with self.lock:
+            key = (kind, name)
+            self.in_flight[key] = self.in_flight.get(key, 0) + 1
+            self.in_flight_max[key] = max(self.in_flight_max.get(key, 0), self.in_flight[key])
+
+    def finish(self, kind, name, seconds, outcome="ok"):
+        with self.lock:
+            key = (kind, name)
+            self.in_flight[key] = self.in_flight.get(key, 1) - 1
+            self.histograms.setdefault(key, Histogram()).observe(seconds)
+            self.outcomes[(kind, name, outcome)] = self.outcomes.get((kind, name, outcome), 0) + 1
+
+    def set_gauge(self, name, label, value):
+        with self.lock:
+            self.gauges[(name, label)] = value
+
+    def inc(self, name, event, value=1):
+        with self.lock:
+            self.counters[(name, event)] = self.counters.get((name, event), 0) + value
+
+    def summary(self) -> dict:
+        """
+        per-stage summary: counts per outcome, latency percentiles [ms] and max in-flight items
+        """
+        with self.lock:
+            stages = {}
+            for (kind, name), histogram in sorted(self.histograms.items()):
+                stages[f"{kind}/{name}"] = {
+                    "count": histogram.count,
+                    "errors": self.outcomes.get((kind, name, "error"), 0),
+                    "dropped": self.outcomes.get((kind, name, "dropped"), 0),
+                    "mean_ms": round(histogram.sum / histogram.count * 1000, 3),
+                    "p50_ms": round(histogram.quantile(0.5) * 1000, 3),
+                    "p95_ms": round(histogram.quantile(0.95) * 1000, 3),
+                    "p99_ms": round(histogram.quantile(0.99) * 1000, 3),
+                    "max_ms": round(histogram.max * 1000, 3),
+                    "in_flight_max": self.in_flight_max.get((kind, name), 0)
+                }
+            gauges = {f"{name}/{label}": value for (name, label), value in sorted(self.gauges.items())}
+            counters = {f"{name}/{event}": value for (name, event), value in sorted(self.counters.items())}
+        return {"stages": stages, "gauges": gauges, "counters": counters}
+
+    def render(self) -> str:
+        """
+        prometheus text exposition format
+        """
+        lines = [
+            "# HELP scraper_stage_duration_seconds Time spent in item pipelines and spider callbacks.",
+            "# TYPE scraper_stage_duration_seconds histogram"
+        ]
+        with self.lock:
+            for (kind, name), histogram in sorted(self.histograms.items()):
+                labels = f'kind="{kind}",stage="{name}"'
+                cumulative = 0
+                for bound, bucket_count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'scraper_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"scraper_stage_duration_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"scraper_stage_duration_seconds_count{{{labels}}} {histogram.count}")
+
+            lines += [
+                "# HELP scraper_stage_outcomes_total Processed items/responses by outcome (ok, error, dropped).",
+                "# TYPE scraper_stage_outcomes_total counter"
+            ]
+            for (kind, name, outcome), value in sorted(self.outcomes.items()):
+                lines.append(f'scraper_stage_outcomes_total{{kind="{kind}",stage="{name}",outcome="{outcome}"}} {value}')
+
+            lines += [
+                "# HELP scraper_stage_in_flight Items/responses currently processed by the stage.",
+                "# TYPE scraper_stage_in_flight gauge"
+            ]
+            for (kind, name), value in sorted(self.in_flight.items()):
+                lines.append(f'scraper_stage_in_flight{{kind="{kind}",stage="{name}"}} {value}')
+
+            lines += [
+                "# HELP scraper_queue_depth Requests/items waiting in scrapy queues.",
+                "# TYPE scraper_queue_depth gauge"
+            ]
+            for (name, label), value in sorted(self.gauges.items()):
+                lines.append(f'scraper_{name}{{queue="{label}"}} {value}')
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines += [
+                    f"# HELP scraper_{name}_total Events of {name} (e.g. opened, closed, dropped database connections).",
+                    f"# TYPE scraper_{name}_total counter"
+                ]
+                for (counter, event), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f'scraper_{name}_total{{event="{event}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry() # process-wide, reset at the start of every crawl
+
+def timed_pipeline(process_item):
+    """
+    decorator of pipeline process_item - records latency (until the returned deferred fires),
+    outcome and number of items in flight under the pipeline class name
+    """
+    @functools.wraps(process_item)
+    def wrapper(self, item, spider):
+        name = type(self).__name__
+        start = time.perf_counter()
+        registry.start("pipeline", name)
+        try:
+            result = process_item(self, item, spider)
+        except DropItem:
+            registry.finish("pipeline", name, time.perf_counter() - start, "dropped")
+            raise
+        except Exception:
+            registry.finish("pipeline", name, time.perf_counter() - start, "error")
+            raise
+
+        if isinstance(result, defer.Deferred):
+            def done(result):
+                outcome = "ok"
+                if isinstance(result, Failure):
+                    outcome = "dropped" if result.check(DropItem) else "error"
+                registry.finish("pipeline", name, time.perf_counter() - start, outcome)
+                return result
+            return result.addBoth(done)
+
+        registry.finish("pipeline", name, time.perf_counter() - start)
+        return result
+
+    return wrapper
+
+def timed_callback(callback):
+    """
+    decorator of spider callbacks (generators) - records time spent inside the callback,
+    without the time its output spends in the rest of the crawl
+    """
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        name = callback.__name__
+        elapsed = 0.0
+        outcome = "ok"
+        registry.start("callback", name)
+        try:
+            outputs = iter(callback(*args, **kwargs) or ())
+            while True:
+                start = time.perf_counter()
+                try:
+                    output = next(outputs)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield output
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            registry.finish("callback", name, elapsed, outcome)
+
+    return wrapper
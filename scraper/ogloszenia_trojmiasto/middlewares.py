@@ -3,7 +3,22 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from functools import partial
+from itertools import count
+
+import mysql.connector
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.utils.spider import iterate_spider_output
+from twisted.internet import defer, threads
+from ogloszenia_trojmiasto.db_helper import DatabaseHelper
+from ogloszenia_trojmiasto.frontier import CrawlFrontier
+from ogloszenia_trojmiasto.signals import listings_dropped, listings_stored
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -101,3 +116,408 @@ class OgloszeniaTrojmiastoDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class ConditionalRequestMiddleware:
+    """
+    stores ETag/Last-Modified headers and body hash of responses to requests with
+    meta["conditional_request"] and sends If-None-Match/If-Modified-Since on the next crawl.
+
+    Responses with 304 status or with the same body hash as the last time are flagged with
+    meta["not_modified"], so the spider can skip parsing them. That is done only for listings
+    already in the database (meta["crawl_class"] == "refresh"), and validators are saved only
+    once DatabasePipeline stored the item (listings_stored signal) - a listing whose item was
+    lost is parsed again on the next crawl instead of being skipped forever
+    """
+
+    def __init__(self, path, stats):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS http_validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT
+            )
+        """)
+        self.stats = stats
+        self.pending = {} # url -> (etag, last_modified, body_hash) of responses whose items aren't stored yet
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("CONDITIONAL_REQUESTS_ENABLED"):
+            raise NotConfigured
+        s = cls(settings.get("CONDITIONAL_REQUESTS_PATH"), crawler.stats)
+        crawler.signals.connect(s.listings_stored, signal=listings_stored)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    @staticmethod
+    def is_refresh(request):
+        return request.meta.get("conditional_request") and request.meta.get("crawl_class") == "refresh"
+
+    def process_request(self, request, spider):
+        if not self.is_refresh(request):
+            return None
+
+        row = self.conn.execute(
+            "SELECT etag, last_modified FROM http_validators WHERE url = ?", (request.url,)
+        ).fetchone()
+        if row:
+            etag, last_modified = row
+            if etag:
+                request.headers.setdefault("If-None-Match", etag)
+            if last_modified:
+                request.headers.setdefault("If-Modified-Since", last_modified)
+            # let 304 responses through HttpErrorMiddleware to the spider
+            request.meta["handle_httpstatus_list"] = [*request.meta.get("handle_httpstatus_list", []), 304]
+
+        return None
+
+    def process_response(self, request, response, spider):
+        if not request.meta.get("conditional_request"):
+            return response
+
+        if response.status == 304 and self.is_refresh(request):
+            request.meta["not_modified"] = True
+            self.stats.inc_value("conditional_requests/not_modified")
+            return response
+
+        if response.status == 200:
+            body_hash = hashlib.sha1(response.body).hexdigest()
+            if self.is_refresh(request):
+                row = self.conn.execute("SELECT body_hash FROM http_validators WHERE url = ?", (request.url,)).fetchone()
+                if row and row[0] == body_hash:
+                    request.meta["not_modified"] = True
+                    self.stats.inc_value("conditional_requests/body_unchanged")
+                    return response
+            self.stats.inc_value("conditional_requests/modified")
+
+            # saved when the item of the page is stored (items are keyed by response url)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            self.pending[response.url] = (
+                etag.decode("latin-1") if etag else None,
+                last_modified.decode("latin-1") if last_modified else None,
+                body_hash
+            )
+
+        return response
+
+    def listings_stored(self, urls, spider):
+        rows = [(url, *self.pending.pop(url)) for url in urls if url in self.pending]
+        if not rows:
+            return
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO http_validators (url, etag, last_modified, body_hash) VALUES (?, ?, ?, ?)", rows
+        )
+        self.conn.commit()
+        self.stats.inc_value("conditional_requests/validators_saved", len(rows))
+
+    def spider_closed(self, spider):
+        # validators of items that weren't stored are dropped - their pages are parsed again next time
+        self.pending.clear()
+        self.conn.close()
+
+
+class CrawlFrontierMiddleware:
+    """
+    shares the crawl between scraper workers through CrawlFrontier (crawl_frontier table).
+
+    Requests yielded by the spider (including start requests) are not scheduled locally but
+    added to the frontier; the worker claims batches of urls from the frontier and schedules
+    them itself. Claimed urls are marked as done after their callback finished and released
+    on failure; urls whose callback yielded items stay leased until DatabasePipeline stored
+    the items (listings_stored) and are released when the items are lost (pipeline error,
+    listings_dropped). The spider stays open while other workers still hold leases.
+
+    Frontier queries run in the reactor's thread pool, so downloads and parsing don't wait for
+    the database; only the has_work check of an idle spider (every 5 s) runs on the reactor thread
+    """
+
+    def __init__(self, crawler, frontier, claim_size):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.frontier = frontier
+        self.claim_size = claim_size
+        self.in_flight = {} # url -> lease number of urls claimed by this worker
+        self.unstored = {} # item url -> claimed url whose item isn't in the database yet
+        self.leases = count()
+        self.pending = set() # deferreds of frontier calls running in the thread pool
+        self.seeded = defer.succeed(None) # start requests added to the frontier
+        self.claiming = False
+        self.closing = False
+        self.spider = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("FRONTIER_ENABLED"):
+            raise NotConfigured
+
+        frontier = CrawlFrontier(
+            DatabaseHelper(),
+            crawl_id=settings.get("FRONTIER_CRAWL_ID") or datetime.now().strftime("%Y-%m-%d"), # one crawl per day
+            worker_id=settings.get("SCRAPER_WORKER_ID"),
+            lease_seconds=settings.getint("FRONTIER_LEASE_SECONDS", 600),
+            max_attempts=settings.getint("FRONTIER_MAX_ATTEMPTS", 3)
+        )
+        s = cls(crawler, frontier, settings.getint("FRONTIER_CLAIM_SIZE", 16))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.listings_stored, signal=listings_stored)
+        crawler.signals.connect(s.listings_dropped, signal=listings_dropped)
+        crawler.signals.connect(s.item_error, signal=signals.item_error)
+        crawler.signals.connect(s.item_dropped, signal=signals.item_dropped)
+        return s
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.run(self.frontier.purge)
+        spider.logger.info(f"Worker {self.frontier.worker_id} joined crawl {self.frontier.crawl_id}")
+        # first claim once the start requests are in the frontier
+        return self.seeded.addCallback(lambda _: self.fill())
+
+    def process_start_requests(self, start_requests, spider):
+        self.spider = spider
+        self.seeded = self.add(start_requests)
+        return []
+
+    def process_spider_output(self, response, result, spider):
+        meta = response.meta
+        requests = []
+        items = False
+        try:
+            for output in result:
+                if isinstance(output, Request):
+                    requests.append(output)
+                else:
+                    items = self.expect_item(meta, output) or items
+                    yield output
+        except Exception:
+            self.finish(meta, failed=True)
+            raise
+
+        # the url stays leased until the requests it yielded are in the frontier
+        self.add(requests, finished=lambda failed: self.finish(meta, failed=failed, items=items))
+
+    async def process_spider_output_async(self, response, result, spider):
+        meta = response.meta
+        requests = []
+        items = False
+        try:
+            async for output in result:
+                if isinstance(output, Request):
+                    requests.append(output)
+                else:
+                    items = self.expect_item(meta, output) or items
+                    yield output
+        except Exception:
+            self.finish(meta, failed=True)
+            raise
+
+        # the url stays leased until the requests it yielded are in the frontier
+        self.add(requests, finished=lambda failed: self.finish(meta, failed=failed, items=items))
+
+    def expect_item(self, meta, item):
+        """
+        remember the claimed url of an item (before it reaches the pipelines), returns True for items of claimed urls
+        """
+        url = meta.get("frontier_url")
+        item_url = ItemAdapter(item).get("url") if is_item(item) else None
+        if url is None or item_url is None:
+            return False
+        self.unstored[item_url] = url
+        return True
+
+    def process_spider_exception(self, response, exception, spider):
+        self.finish(response.meta, failed=True)
+        return None
+
+    def request_failed(self, failure, errback=None):
+        """
+        errback of claimed requests - release the url and run the spider's own errback
+        """
+        self.finish(failure.request.meta, failed=True)
+        if errback is None:
+            return []
+
+        outputs = []
+        requests = []
+        for output in iterate_spider_output(errback(failure)):
+            (requests if isinstance(output, Request) else outputs).append(output)
+        self.add(requests)
+        return outputs
+
+    def add(self, requests, finished=None):
+        """
+        add requests to the frontier in the thread pool; finished(failed) is called once they're added (or lost)
+        """
+        entries = [
+            (request.url, request.callback.__name__ if request.callback else "parse", request.priority, to_entry(request))
+            for request in requests
+        ]
+
+        def added(count):
+            self.stats.inc_value("frontier/added", count)
+            self.stats.inc_value("frontier/duplicates", len(entries) - count)
+            if finished is not None:
+                finished(False)
+
+        def failed(failure):
+            if finished is not None:
+                finished(True)
+            return failure
+
+        if not entries:
+            added(0)
+            return defer.succeed(None)
+        return self.run(self.frontier.add, entries, callback=added, errback=failed)
+
+    def fill(self):
+        """
+        claim next batch of urls when the local queue runs low (one claim at a time)
+        """
+        if self.claiming or self.closing or len(self.in_flight) > self.claim_size // 2:
+            return
+        self.claiming = True
+        self.run(self.frontier.claim, self.claim_size, callback=self.schedule, errback=self.claim_failed)
+
+    def schedule(self, claimed):
+        self.claiming = False
+        if self.closing:
+            for url, _ in claimed:
+                self.run(self.frontier.release, url, False)
+            return
+        for url, entry in claimed:
+            self.in_flight[url] = next(self.leases)
+            self.crawler.engine.crawl(self.from_entry(url, entry, self.in_flight[url]))
+        self.stats.inc_value("frontier/claimed", len(claimed))
+
+    def claim_failed(self, failure):
+        self.claiming = False
+        return failure
+
+    def run(self, method, *args, callback=None, errback=None):
+        """
+        call a frontier method in the reactor's thread pool; failures are logged after errback,
+        spider_idle and spider_closed wait for calls still running
+        """
+        d = threads.deferToThread(method, *args)
+        if callback is not None:
+            d.addCallback(callback)
+        if errback is not None:
+            d.addErrback(errback)
+        d.addErrback(lambda failure: self.spider.logger.error(f"Frontier {method.__name__} failed: {failure.getErrorMessage()}"))
+        self.pending.add(d)
+        d.addBoth(lambda _: self.pending.discard(d))
+        return d
+
+    def finish(self, meta, failed, items=False):
+        """
+        mark claimed url as done or release it; outcomes of an older lease of the same url are ignored.
+        A url with items is settled when its items are stored or lost
+        """
+        url = meta.get("frontier_url")
+        if url is None or self.in_flight.get(url) != meta.get("frontier_lease"):
+            return
+        del self.in_flight[url]
+        if failed or not items:
+            self.settle(url, failed)
+        self.fill()
+
+    def settle(self, url, failed):
+        if failed:
+            self.run(self.frontier.release, url)
+            self.stats.inc_value("frontier/released")
+        else:
+            self.run(self.frontier.done, url)
+            self.stats.inc_value("frontier/done")
+
+    def item_finished(self, item_url, failed):
+        url = self.unstored.pop(item_url, None)
+        if url is not None:
+            self.settle(url, failed)
+
+    def listings_stored(self, urls, spider):
+        for url in urls:
+            self.item_finished(url, failed=False)
+
+    def listings_dropped(self, urls, spider):
+        for url in urls:
+            self.item_finished(url, failed=True)
+
+    def item_error(self, item, response, spider, failure):
+        self.item_finished(ItemAdapter(item).get("url"), failed=True)
+
+    def item_dropped(self, item, response, exception, spider):
+        self.item_finished(ItemAdapter(item).get("url"), failed=False) # dropped on purpose, not worth another attempt
+
+    def from_entry(self, url, entry, lease):
+        errback = getattr(self.spider, entry["errback"]) if entry["errback"] else None
+        return Request(
+            url,
+            callback=getattr(self.spider, entry["callback"]),
+            errback=partial(self.request_failed, errback=errback),
+            priority=entry["priority"],
+            meta={**entry["meta"], "frontier_url": url, "frontier_lease": lease},
+            dont_filter=True # deduplicated by the frontier
+        )
+
+    def spider_idle(self, spider):
+        if self.pending:
+            raise DontCloseSpider # frontier calls still running
+
+        # nothing is downloaded, processed or added - claimed urls still in flight were lost (e.g. dropped requests)
+        if self.in_flight:
+            for url, lease in list(self.in_flight.items()):
+                self.finish({"frontier_url": url, "frontier_lease": lease}, failed=True)
+            raise DontCloseSpider
+
+        # the only frontier query on the reactor thread, once per idle check
+        try:
+            has_work = self.frontier.has_work()
+        except mysql.connector.Error as error:
+            spider.logger.error(f"Frontier has_work failed: {error}")
+            raise DontCloseSpider # check again on the next idle signal
+        if has_work:
+            self.fill()
+            raise DontCloseSpider # wait for other workers (and their expired leases)
+
+    @defer.inlineCallbacks
+    def spider_closed(self, spider, reason):
+        self.closing = True
+        # unfinished work (e.g. crawl budget reached) and items that never reached the database go back to other workers
+        for url in {*self.in_flight, *self.unstored.values()}:
+            self.run(self.frontier.release, url, False)
+        self.in_flight.clear()
+        self.unstored.clear()
+
+        while self.pending: # a claim still running releases its urls
+            yield defer.DeferredList(list(self.pending))
+
+        counts = yield threads.deferToThread(self.frontier.status_counts)
+        for status, count in counts.items():
+            self.stats.set_value(f"frontier/status_{status}", count)
+
+def to_entry(request):
+    """
+    json-serializable request description stored in the frontier
+    """
+    meta = {}
+    for key, value in request.meta.items():
+        try:
+            json.dumps(value)
+        except TypeError:
+            continue
+        meta[key] = value
+
+    return {
+        "callback": request.callback.__name__ if request.callback else "parse",
+        "errback": request.errback.__name__ if request.errback else None,
+        "priority": request.priority,
+        "meta": meta
+    }
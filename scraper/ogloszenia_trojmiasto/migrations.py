@@ -0,0 +1,110 @@
+"""
+versioned schema migrations: db/migrations/NNNN_name.sql applied in version order and recorded
+in schema_migrations. The database container applies them on first start (db/01-migrate.sh),
+the scraper on every start (DatabaseHelper.create_table), so existing databases catch up
+"""
+import hashlib
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# mounted into the scraper container (see docker-compose.yml), repository directory otherwise
+MIGRATIONS_DIR = os.getenv(
+    "MIGRATIONS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "db", "migrations")
+)
+
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    checksum CHAR(64) NOT NULL,
+    applied_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+LOCK_NAME = "schema_migrations"
+LOCK_TIMEOUT = 300 # [s] an index build on a large table can take a while
+
+def discover(directory: str) -> list:
+    """
+    (version, name, path) of migration files sorted by version
+    """
+    if not os.path.isdir(directory):
+        return []
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    return sorted(migrations)
+
+def checksum(path: str) -> str:
+    # same as sha256sum in db/01-migrate.sh
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def split_statements(sql: str) -> list:
+    """
+    statements of a migration file without "--" comments; migrations can't contain ";" or "--"
+    inside string literals (not needed for DDL)
+    """
+    sql = re.sub(r"--.*$", "", sql, flags=re.MULTILINE)
+    return [statement.strip() for statement in sql.split(";") if statement.strip()]
+
+def apply_migrations(conn, directory: str = MIGRATIONS_DIR) -> list:
+    """
+    apply pending migrations, returns their versions
+
+    scraper workers starting together are serialized with a named lock. DDL commits implicitly
+    in MySQL, so a migration failing halfway isn't rolled back - it stays unrecorded and has to
+    be fixed before the next start. A changed file of an applied migration is only reported
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+    (locked,) = cursor.fetchone()
+    if not locked:
+        cursor.close()
+        raise RuntimeError("timed out waiting for the schema migration lock")
+
+    applied = []
+    try:
+        cursor.execute(CREATE_MIGRATIONS_TABLE)
+        cursor.execute("SELECT version, checksum FROM schema_migrations")
+        recorded = dict(cursor.fetchall())
+
+        for version, name, path in discover(directory):
+            digest = checksum(path)
+            if version in recorded:
+                if recorded[version] != digest:
+                    print(f"Warning: migration {version} {name} changed after it was applied")
+                continue
+
+            print(f"Applying migration {version} {name}")
+            with open(path, encoding="utf-8") as f:
+                for statement in split_statements(f.read()):
+                    cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)", (version, name, digest)
+            )
+            conn.commit()
+            applied.append(version)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchone()
+        cursor.close()
+
+    return applied
+
+if __name__ == "__main__":
+    # python -m ogloszenia_trojmiasto.migrations
+    from ogloszenia_trojmiasto.db_helper import DatabaseHelper
+    db_helper = DatabaseHelper()
+    try:
+        print(f"applied migrations: {db_helper.create_table() or 'none'}")
+    finally:
+        db_helper.close()
@@ -1,11 +1,16 @@
-import unicodedata
 import logging
 
+from twisted.internet import defer, task, threads
+
 from geopy.geocoders.base import logger
-from ogloszenia_trojmiasto.geodistance import load_coastline, get_all_geodata 
-from ogloszenia_trojmiasto.db_helper import DatabaseHelper
+from ogloszenia_trojmiasto.geodistance import get_all_geodata, geocoding_cache, gazetteer, rate_limiter, address_locks
+from ogloszenia_trojmiasto.distance_grid import DistanceGrid
+from ogloszenia_trojmiasto.enrichment import CONVERSIONS, clean_address, enrich_items
+from ogloszenia_trojmiasto import state
+from ogloszenia_trojmiasto.metrics import timed_pipeline
+from ogloszenia_trojmiasto.signals import listings_dropped, listings_stored
 from datetime import datetime
-import re
+import time
 
 # Define your item pipelines here
 #
@@ -13,27 +18,17 @@ import re
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 class CleaningPipeline:
+    @timed_pipeline
     def process_item(self, item, spider):        
-        conversions = {
-            "address": self.clean_address,
-            "floor": lambda x: 0 if x == "Parter" else int(x),
-            "price": lambda x: float(x[:-2].replace(" ", "")),
-            "price_per_sqr_meter": lambda x: float(x.replace(",", ".")),
-            "rooms": int,
-            "square_meters": lambda x: float(x.replace(",", "."))
-          }
- 
         try:
-            item["address"] = conversions["address"](item["address"])
+            item["address"] = self.clean_address(item["address"])
         except Exception as e:
             logger.info(f"No address found in {item["url"]}: {e}")
             item["address"] = None
 
         item["created_ts"] = datetime.now()
 
-        for field, converter in conversions.items(): 
-            if field in ("address", "created_ts"):
-                continue 
+        for field, converter in CONVERSIONS.items(): 
             try:
                 item[field] = converter(item[field]) if item.get(field) else None
             except Exception:
@@ -41,21 +36,7 @@ class CleaningPipeline:
 
         return item
 
-    @staticmethod
-    def clean_address(x):
-        address = "".join(x).strip()
-        address = re.sub(r"\s*\([^)]*\)", "", address) # remove (gw), (gm) etc.
- 
-        # get rid of duplicates in address (e.g. Sopot Dolny Sopot -> Sopot Dolny):
-        words = address.split()
-        seen = set()
-        cleaned_words = []
-        for word in words:
-            if word not in seen:
-                cleaned_words.append(word)
-                seen.add(word)
-                
-        return unicodedata.normalize("NFKC", " ".join(cleaned_words))
+    clean_address = staticmethod(clean_address)
 
 
 class PricePipeline:
@@ -66,6 +47,7 @@ class PricePipeline:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
 
+    @timed_pipeline
     def process_item(self, item, spider):
         try:
             # 1. missing price but have price_per_sqr_meter and square_meters
@@ -85,44 +67,383 @@ class PricePipeline:
         return item
 
 class SyntheticFeaturesPipeline:
-    def __init__(self):
-        self.coastline = load_coastline() 
+    """
+    geocoding and distance calculations run in the reactor's thread pool, so the
+    crawl keeps downloading and parsing while items wait for the rate-limited geocoder.
+    Coastline is loaded lazily (in a worker thread) only when the distance grid can't be used
+    """
+    def __init__(self, stats=None, max_in_flight=8, distance_grid_path=None, distance_grid_max_error=0.05):
         self.logger = logging.getLogger(__name__)
+        self.distance_grid = DistanceGrid.load(distance_grid_path, distance_grid_max_error) if distance_grid_path else None
+        if self.distance_grid is None:
+            self.logger.info("No precomputed distance grid found. Using exact distance calculations")
+        self.stats = stats
+        self.semaphore = defer.DeferredSemaphore(max_in_flight) # bounded queue of items being geocoded
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        configure_geocoding(settings)
+        return cls(
+            stats=crawler.stats,
+            max_in_flight=settings.getint("GEOCODING_MAX_IN_FLIGHT", 8),
+            distance_grid_path=settings.get("DISTANCE_GRID_PATH"),
+            distance_grid_max_error=settings.getfloat("DISTANCE_GRID_MAX_ERROR", 0.05)
+        )
 
+    @timed_pipeline
     def process_item(self, item, spider):
         address = item.get("address", None)
         if not address:
             self.logger.warning("Item has no address. Skipping geocoding data")
 
-        distances = get_all_geodata(address, self.coastline)
+        d = self.semaphore.run(threads.deferToThread, get_all_geodata, address, None, self.distance_grid)
+        d.addCallback(self._update_item, item)
+        return d
+
+    @staticmethod
+    def _update_item(distances, item):
         item.update(distances)
         return item
 
+    def close_spider(self, spider):
+        close_geocoding(self.stats)
+
+class BatchEnrichmentPipeline:
+    """
+    replaces CleaningPipeline, PricePipeline and SyntheticFeaturesPipeline: items are buffered
+    and enriched in micro-batches - conversions and price backfill run column by column,
+    every distinct address is geocoded once and distances come from one vectorized grid lookup.
+    Output is the same as of the per-item pipelines (except created_ts, set once per batch).
+    Batch is released when it reaches BATCH_ENRICHMENT_SIZE items, when the oldest item
+    is older than BATCH_ENRICHMENT_MAX_AGE seconds, when no more responses are expected
+    (nothing downloading or scheduled) and when the spider closes
+    """
+    def __init__(self, crawler=None, stats=None, batch_size=64, max_batch_age=5, distance_grid_path=None, distance_grid_max_error=0.05):
+        self.logger = logging.getLogger(__name__)
+        self.distance_grid = DistanceGrid.load(distance_grid_path, distance_grid_max_error) if distance_grid_path else None
+        if self.distance_grid is None:
+            self.logger.info("No precomputed distance grid found. Using exact distance calculations")
+        self.crawler = crawler
+        self.stats = stats
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.buffer = [] # (item, deferred) pairs waiting for the batch
+        self.buffer_started = None
+        self.flush_task = None
+        self.pending = set() # batches being enriched
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        configure_geocoding(settings)
+        return cls(
+            crawler=crawler,
+            stats=crawler.stats,
+            batch_size=settings.getint("BATCH_ENRICHMENT_SIZE", 64),
+            max_batch_age=settings.getfloat("BATCH_ENRICHMENT_MAX_AGE", 5),
+            distance_grid_path=settings.get("DISTANCE_GRID_PATH"),
+            distance_grid_max_error=settings.getfloat("DISTANCE_GRID_MAX_ERROR", 0.05)
+        )
+
+    def open_spider(self, spider):
+        self.flush_task = task.LoopingCall(self.flush_if_stale)
+        self.flush_task.start(min(self.max_batch_age, 1.0), now=False)
+
+    @timed_pipeline
+    def process_item(self, item, spider):
+        if not self.buffer:
+            self.buffer_started = time.monotonic()
+        d = defer.Deferred()
+        self.buffer.append((item, d))
+
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return d
+
+    def flush_if_stale(self):
+        if self.buffer and (time.monotonic() - self.buffer_started >= self.max_batch_age or self.crawl_drained()):
+            self.flush()
+
+    def crawl_drained(self):
+        """
+        check if no more items can arrive soon - buffered items would otherwise wait for the age flush
+        """
+        engine = getattr(self.crawler, "engine", None)
+        if engine is None or engine.slot is None:
+            return False
+        return not engine.downloader.active and not engine.slot.scheduler.has_pending_requests()
+
+    def flush(self):
+        if not self.buffer:
+            return None
+
+        batch, self.buffer = self.buffer, []
+        items = [item for item, _ in batch]
+        for item in items:
+            if not item.get("address"):
+                self.logger.warning("Item has no address. Skipping geocoding data")
+
+        d = threads.deferToThread(enrich_items, items, self.distance_grid)
+        d.addCallbacks(self._release, self._fail, callbackArgs=(batch,), errbackArgs=(batch,))
+        self.pending.add(d)
+        d.addBoth(self._done, d)
+        return d
+
+    def _release(self, results, batch):
+        if self.stats is not None:
+            self.stats.inc_value("enrichment/batches")
+            self.stats.inc_value("enrichment/items", len(batch))
+            self.stats.max_value("enrichment/batch_size_max", len(batch))
+        for (_, d), result in zip(batch, results):
+            if isinstance(result, Exception):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def _fail(self, failure, batch):
+        self.logger.error(f"Failed to enrich batch of {len(batch)} items: {failure.getErrorMessage()}")
+        for _, d in batch:
+            d.errback(failure)
+
+    def _done(self, result, d):
+        self.pending.discard(d)
+        return result
+
+    def close_spider(self, spider):
+        if self.flush_task is not None and self.flush_task.running:
+            self.flush_task.stop()
+        self.flush()
+        # the scraper waits for the items anyway - close the cache after the last batch
+        d = defer.DeferredList(list(self.pending))
+        d.addBoth(lambda _: close_geocoding(self.stats))
+        return d
+
+def configure_geocoding(settings):
+    """
+    shared geocoding setup of SyntheticFeaturesPipeline and BatchEnrichmentPipeline
+    """
+    geocoding_cache.configure(
+        path=settings.get("GEOCODING_CACHE_PATH"),
+        ttl=settings.getint("GEOCODING_CACHE_TTL_DAYS", 90) * 24 * 3600,
+        negative_ttl=settings.getint("GEOCODING_CACHE_NEGATIVE_TTL_DAYS", 7) * 24 * 3600,
+        max_entries=settings.getint("GEOCODING_CACHE_MAX_ENTRIES", 100_000)
+    )
+    rate_limiter.rate = settings.getfloat("GEOCODING_RATE", 1.0) # nominatim limit is shared by all workers
+    gazetteer.configure(path=settings.get("GAZETTEER_PATH"), min_score=settings.getfloat("GAZETTEER_MIN_SCORE", 0.8))
+
+def close_geocoding(stats=None):
+    if stats is not None:
+        for key, value in {**geocoding_cache.stats(), **gazetteer.stats()}.items():
+            stats.set_value(key, value)
+        stats.set_value("geocoding/in_flight_waits", address_locks.waits) # lookups deduplicated while in flight
+    geocoding_cache.close()
+
 class DatabasePipeline:
-    def __init__(self):
-        self.db_helper = DatabaseHelper()
+    """
+    buffers items and writes them in batches - one transaction per batch. Change detection
+    uses the spider's in-memory listing index, which is updated in place after every write.
+    Batch is flushed when it reaches DB_BATCH_SIZE items, when the oldest item is older
+    than DB_BATCH_MAX_AGE seconds and when the spider closes. Items of a failed batch are buffered
+    again and retried; an item is dropped after DB_BATCH_MAX_ATTEMPTS failed writes. Aggregate tables
+    of the cities written during the crawl are refreshed when the spider closes (AGGREGATES_* settings).
+    Database calls (pool waits, reconnect backoff) run in the reactor's thread pool, one batch at a time
+    """
+    def __init__(self, stats=None, batch_size=100, max_batch_age=30, aggregates_enabled=True, aggregates_full_refresh_days=7,
+                 signals=None, max_attempts=3):
+        self.db_helper = state.get_db_helper() # shared connection pool, kept open between sessions
+        self.stats = stats
+        self.signals = signals # listings_stored is sent after every written batch, listings_dropped for given up items
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.max_attempts = max_attempts
+        self.aggregates_enabled = aggregates_enabled
+        self.aggregates_full_refresh_days = aggregates_full_refresh_days
+        self.buffer = {} # url -> item, latest scraped item wins
+        self.buffer_started = None
+        self.failed_attempts = {} # url -> failed writes of its buffered item
+        self.write_lock = defer.DeferredLock() # batches are classified against the index updated by the previous one
+        self.flush_task = None
+        self.touched_cities = set() # cities of new and changed listings
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            stats=crawler.stats,
+            batch_size=settings.getint("DB_BATCH_SIZE", 100),
+            max_batch_age=settings.getfloat("DB_BATCH_MAX_AGE", 30),
+            aggregates_enabled=settings.getbool("AGGREGATES_ENABLED", True),
+            aggregates_full_refresh_days=settings.getfloat("AGGREGATES_FULL_REFRESH_DAYS", 7),
+            signals=crawler.signals,
+            max_attempts=settings.getint("DB_BATCH_MAX_ATTEMPTS", 3)
+        )
+
+    def open_spider(self, spider):
+        # flush stale batches also when no new items arrive
+        self.flush_task = task.LoopingCall(self.flush_if_stale, spider)
+        self.flush_task.start(self.max_batch_age, now=False)
 
+    @timed_pipeline
     def process_item(self, item, spider):
-        url = item["url"]
-        
-        if url in self.db_helper.get_existing_urls():
-            if self.db_helper.is_changed(url, item):
-                # data changed - update old record and insert new one:
-                self.db_helper.update_is_latest(url) # set old item to is_latest = 0
-                item["is_latest"] = 1 # set current item to is_latest = 1
-                self.db_helper.insert_item(item)
-                spider.logger.info(f"Data changed for {url} - inserted new row and updated is_latest")
+        if not self.buffer:
+            self.buffer_started = time.monotonic()
+        self.buffer[item["url"]] = item
+
+        if len(self.buffer) >= self.batch_size:
+            d = self.flush(spider)
+        else:
+            d = self.flush_if_stale(spider)
+        if d is None:
+            return item
+
+        # item is done when its batch is written - the crawl slows down with the database
+        d.addCallback(lambda _: item)
+        return d
+
+    def flush_if_stale(self, spider):
+        if self.buffer and time.monotonic() - self.buffer_started >= self.max_batch_age:
+            return self.flush(spider)
+        return None
+
+    def flush(self, spider):
+        """
+        write the buffered items after the batch being written (if any); the returned deferred
+        fires when they are written or buffered again
+        """
+        return self.write_lock.run(self.write_buffer, spider)
+
+    def write_buffer(self, spider):
+        if not self.buffer:
+            return None
+
+        items = list(self.buffer.values())
+        self.buffer = {}
+        start = time.monotonic()
+
+        # listing index is loaded by the spider and kept up to date in _stored - no lookup queries needed
+        index = spider.listing_index
+        new_items, changed_items, unchanged_urls = [], [], []
+        for item in items:
+            url = item["url"]
+            if url not in index:
+                # new listing - insert current row and first version
+                new_items.append(item)
+                spider.logger.info(f"New entry for {url} - inserting into database")
+            elif index.is_changed(item):
+                # data changed - update current row in place and append a version
+                changed_items.append(item)
+                spider.logger.info(f"Data changed for {url} - updating listing and appending version")
             else:
                 # data unchanged - update scraped_ts
-                self.db_helper.update_scraped_ts(url)
-                spider.logger.info(f"No data change for {url} - updated scraped_ts")
-        else:
-            # new listing - insert and set is_latest = 1
-            item["is_latest"] = 1
-            self.db_helper.insert_item(item)
-            spider.logger.info(f"New entry for {url} - inserted into database")
-            
-        return item
+                unchanged_urls.append(url)
+                spider.logger.info(f"No data change for {url} - updating scraped_ts")
+
+        d = threads.deferToThread(self.db_helper.write_batch, new_items, changed_items, unchanged_urls)
+        d.addCallbacks(
+            self._stored, self._failed,
+            callbackArgs=(items, new_items, changed_items, unchanged_urls, start, spider), errbackArgs=(items, spider)
+        )
+        return d
+
+    def _stored(self, result, items, new_items, changed_items, unchanged_urls, start, spider):
+        counts, ids = result
+        index = spider.listing_index
+        for url in unchanged_urls:
+            self.failed_attempts.pop(url, None)
+        for item in changed_items:
+            index.record_change(item["url"]) # volatile listings get shorter recrawl intervals
+        for item in (*new_items, *changed_items):
+            self.failed_attempts.pop(item["url"], None)
+            index.upsert(
+                item["url"], ids.get(item["url"]), item["scraped_ts"],
+                item["price"], item["price_per_sqr_meter"], item["square_meters"]
+            )
+        for url in unchanged_urls:
+            index.touch(url)
+        self.touched_cities.update(item["city"] for item in (*new_items, *changed_items) if item.get("city"))
+        if self.signals is not None:
+            self.signals.send_catch_log(signal=listings_stored, urls=[item["url"] for item in items], spider=spider)
+
+        latency_ms = (time.monotonic() - start) * 1000
+        spider.logger.info(
+            f"Wrote batch of {len(items)} items in {latency_ms:.0f} ms "
+            f"({len(new_items)} new, {len(changed_items)} changed, {len(unchanged_urls)} unchanged)"
+        )
+
+        if self.stats is not None:
+            self.stats.inc_value("db/batches")
+            self.stats.inc_value("db/items", len(items))
+            for key, value in counts.items():
+                self.stats.inc_value(f"db/rows_{key}", value)
+            self.stats.inc_value("db/batch_latency_ms_total", round(latency_ms))
+            self.stats.max_value("db/batch_latency_ms_max", round(latency_ms))
+
+    def _failed(self, failure, items, spider):
+        spider.logger.error(f"Failed to write batch of {len(items)} items: {failure.getErrorMessage()}")
+        if self.stats is not None:
+            self.stats.inc_value("db/batch_errors")
+        self.retry_later(items, spider)
 
+    def retry_later(self, items, spider):
+        """
+        buffer the items of a failed batch again (a newer item of the same url wins), dropping
+        the ones that failed DB_BATCH_MAX_ATTEMPTS times
+        """
+        retry = {}
+        dropped = []
+        for item in items:
+            url = item["url"]
+            attempts = self.failed_attempts.get(url, 0) + 1
+            if attempts >= self.max_attempts:
+                self.failed_attempts.pop(url, None)
+                dropped.append(url)
+                spider.logger.error(f"Dropping {url} after {attempts} failed write attempts")
+                if self.stats is not None:
+                    self.stats.inc_value("db/items_dropped")
+            else:
+                self.failed_attempts[url] = attempts
+                retry[url] = item
+
+        if dropped and self.signals is not None:
+            self.signals.send_catch_log(signal=listings_dropped, urls=dropped, spider=spider)
+        if not retry:
+            return
+        if not self.buffer:
+            # retried with the next batch or by flush_if_stale after DB_BATCH_MAX_AGE
+            self.buffer_started = time.monotonic()
+        retry.update(self.buffer)
+        self.buffer = retry
+        if self.stats is not None:
+            self.stats.inc_value("db/items_retried", len(retry))
+
+    @defer.inlineCallbacks
     def close_spider(self, spider):
-        self.db_helper.close()
+        if self.flush_task is not None and self.flush_task.running:
+            self.flush_task.stop()
+        # waits for a batch still being written; failed items are buffered again until written or dropped
+        yield self.flush(spider)
+        while self.buffer:
+            yield self.flush(spider)
+        if self.aggregates_enabled:
+            yield self.refresh_aggregates(spider)
+
+    @defer.inlineCallbacks
+    def refresh_aggregates(self, spider):
+        start = time.monotonic()
+        try:
+            mode, cities = yield threads.deferToThread(
+                self.db_helper.refresh_aggregates, self.touched_cities, self.aggregates_full_refresh_days
+            )
+        except Exception as e:
+            spider.logger.error(f"Failed to refresh aggregates: {e}")
+            if self.stats is not None:
+                self.stats.inc_value("aggregates/errors")
+            return
+
+        latency_ms = (time.monotonic() - start) * 1000
+        spider.logger.info(f"Refreshed aggregates ({mode}) of {cities} cities in {latency_ms:.0f} ms")
+        if self.stats is not None:
+            self.stats.set_value("aggregates/mode", mode)
+            self.stats.set_value("aggregates/cities", cities)
+            self.stats.set_value("aggregates/refresh_ms", round(latency_ms))
@@ -7,6 +7,7 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 import os
+import socket
 from datetime import datetime
 
 BOT_NAME = "ogloszenia_trojmiasto"
@@ -27,7 +28,10 @@ ROBOTSTXT_OBEY = True
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
-DOWNLOAD_DELAY = 2
+# Sharded crawl: SCRAPER_WORKERS containers share one politeness budget (global cap of 1 request per 2 s),
+# so every worker waits DOWNLOAD_DELAY * SCRAPER_WORKERS between its own requests
+SCRAPER_WORKERS = int(os.getenv("SCRAPER_WORKERS", "1"))
+DOWNLOAD_DELAY = 2 * SCRAPER_WORKERS
 # The download delay setting will honor only one of:
 #CONCURRENT_REQUESTS_PER_DOMAIN = 16
 #CONCURRENT_REQUESTS_PER_IP = 16
@@ -49,18 +53,29 @@ DOWNLOAD_DELAY = 2
 #SPIDER_MIDDLEWARES = {
 #    "ogloszenia_trojmiasto.middlewares.OgloszeniaTrojmiastoSpiderMiddleware": 543,
 #}
+SPIDER_MIDDLEWARES = {
+    # closest to the engine, so requests are sent to the frontier after offsite/depth filtering
+    "ogloszenia_trojmiasto.middlewares.CrawlFrontierMiddleware": 100,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #DOWNLOADER_MIDDLEWARES = {
 #    "ogloszenia_trojmiasto.middlewares.OgloszeniaTrojmiastoDownloaderMiddleware": 543,
 #}
+DOWNLOADER_MIDDLEWARES = {
+    # runs after HttpCompressionMiddleware (590), so the body hash is calculated on decompressed content
+    "ogloszenia_trojmiasto.middlewares.ConditionalRequestMiddleware": 580,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
 #}
+EXTENSIONS = {
+    "ogloszenia_trojmiasto.extensions.MetricsExtension": 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -71,6 +86,17 @@ ITEM_PIPELINES = {
     "ogloszenia_trojmiasto.pipelines.DatabasePipeline": 400
     }
 
+# Micro-batch enrichment: BatchEnrichmentPipeline replaces the cleaning, price and geodata pipelines and
+# processes items in batches of BATCH_ENRICHMENT_SIZE (released after BATCH_ENRICHMENT_MAX_AGE seconds at the latest)
+BATCH_ENRICHMENT_ENABLED = os.getenv("BATCH_ENRICHMENT_ENABLED", "0") == "1"
+BATCH_ENRICHMENT_SIZE = 64
+BATCH_ENRICHMENT_MAX_AGE = 5
+if BATCH_ENRICHMENT_ENABLED:
+    ITEM_PIPELINES = {
+        "ogloszenia_trojmiasto.pipelines.BatchEnrichmentPipeline": 100,
+        "ogloszenia_trojmiasto.pipelines.DatabasePipeline": 400
+        }
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -97,9 +123,97 @@ REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8-sig"
 
+# Per-crawl budget: stop after CLOSESPIDER_PAGECOUNT downloaded pages or CLOSESPIDER_TIMEOUT seconds (0 = no limit).
+# Requests are prioritized (new listings first, then the stalest ones), so a cut-short crawl still covers the most valuable urls
+CLOSESPIDER_PAGECOUNT = 0
+CLOSESPIDER_TIMEOUT = 0
+
+# Fan-out pagination: number of list pages of each start url requested in parallel
+LIST_PAGE_CONCURRENCY = 4
+
+# Adaptive recrawl intervals: listing is scraped again when the estimated probability that it changed
+# since the last scrape reaches RECRAWL_CHANGE_PROBABILITY (interval clamped to RECRAWL_MIN_DAYS..RECRAWL_MAX_DAYS).
+# Listings with short history use a prior of RECRAWL_PRIOR_CHANGES changes per RECRAWL_PRIOR_DAYS days (~7 day interval)
+RECRAWL_MIN_DAYS = 1
+RECRAWL_MAX_DAYS = 60
+RECRAWL_CHANGE_PROBABILITY = 0.5
+RECRAWL_PRIOR_CHANGES = 1
+RECRAWL_PRIOR_DAYS = 10
+
+# Interval between scheduled scraping sessions (scraper/main.py); only listings due for recrawl are fetched
+SCHEDULE_INTERVAL_DAYS = 1
+
+# Batched database writes: flush after DB_BATCH_SIZE items or when the oldest buffered item is DB_BATCH_MAX_AGE seconds old
+DB_BATCH_SIZE = 100
+DB_BATCH_MAX_AGE = 30
+# Items of a failed batch are buffered again and retried with the next batch; dropped (and logged) after this many failed writes
+DB_BATCH_MAX_ATTEMPTS = 3
+
+# Aggregate tables served to the frontend (agg_*), refreshed when the crawl closes: cities of new and changed
+# listings only, all cities when the last full refresh is older than AGGREGATES_FULL_REFRESH_DAYS
+AGGREGATES_ENABLED = True
+AGGREGATES_FULL_REFRESH_DAYS = 7
+
+# Listing history retention (run by the scheduler after every session): listing_versions is partitioned by month,
+# partitions are added ARCHIVE_PARTITIONS_AHEAD months in advance. With ARCHIVE_ENABLED, months older than
+# ARCHIVE_RETENTION_MONTHS are exported to Parquet files in ARCHIVE_DIR and dropped from the database
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "0") == "1"
+ARCHIVE_DIR = "/scraper/archive"
+ARCHIVE_RETENTION_MONTHS = 12
+ARCHIVE_PARTITIONS_AHEAD = 2
+
+# Local state shared between scraping sessions (caches, precomputed artifacts)
+CACHE_DIR = "/scraper/cache"
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Conditional requests for detail pages (ETag/Last-Modified/body hash stored in CONDITIONAL_REQUESTS_PATH)
+CONDITIONAL_REQUESTS_ENABLED = True
+CONDITIONAL_REQUESTS_PATH = os.path.join(CACHE_DIR, "http_validators.sqlite")
+
+# Persistent geocoding cache
+GEOCODING_CACHE_PATH = os.path.join(CACHE_DIR, "geocoding.sqlite")
+GEOCODING_CACHE_TTL_DAYS = 90
+GEOCODING_CACHE_NEGATIVE_TTL_DAYS = 7
+GEOCODING_CACHE_MAX_ENTRIES = 100_000
+# Max number of items geocoded concurrently in worker threads (nominatim itself is rate limited to 1 req/s)
+GEOCODING_MAX_IN_FLIGHT = 8
+GEOCODING_RATE = 1.0 / SCRAPER_WORKERS # requests per second of one worker
+
+# Offline gazetteer built from an OSM address extract (python -m ogloszenia_trojmiasto.gazetteer extract.csv),
+# looked up before nominatim; matches scoring below GAZETTEER_MIN_SCORE (share of the address matched) are misses
+GAZETTEER_PATH = os.path.join(CACHE_DIR, "gazetteer.sqlite")
+GAZETTEER_MIN_SCORE = 0.8
+
+# Precomputed distance grid (build with: python -m ogloszenia_trojmiasto.distance_grid)
+# cells with interpolation error above DISTANCE_GRID_MAX_ERROR (km) fall back to exact calculations
+DISTANCE_GRID_PATH = os.path.join(CACHE_DIR, "distance_grid")
+DISTANCE_GRID_MAX_ERROR = 0.05
+
+# Shared crawl frontier (crawl_frontier table) - enable when running more than one scraper worker.
+# Workers of the same crawl (FRONTIER_CRAWL_ID, defaults to the current date) claim batches of
+# FRONTIER_CLAIM_SIZE urls leased for FRONTIER_LEASE_SECONDS; urls failing FRONTIER_MAX_ATTEMPTS times are skipped
+FRONTIER_ENABLED = os.getenv("FRONTIER_ENABLED", "0") == "1"
+FRONTIER_CRAWL_ID = os.getenv("FRONTIER_CRAWL_ID")
+SCRAPER_WORKER_ID = os.getenv("SCRAPER_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+FRONTIER_CLAIM_SIZE = 16
+FRONTIER_LEASE_SECONDS = 600
+FRONTIER_MAX_ATTEMPTS = 3
+
+# Reactor thread pool shared by geocoding (GEOCODING_MAX_IN_FLIGHT threads), database calls (batch writes,
+# crawl frontier, scraped_ts updates - at most DB_POOL_SIZE of them hold a connection) and DNS lookups
+REACTOR_THREADPOOL_MAXSIZE = GEOCODING_MAX_IN_FLIGHT + int(os.getenv("DB_POOL_SIZE", 5)) + 4
+
 LOG_DIR = "/scraper/logs"
 os.makedirs(LOG_DIR, exist_ok=True)
 
+# Per-stage metrics of item pipelines and spider callbacks (latency histograms, outcomes, in-flight items, queue depths):
+# prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics during the crawl (METRICS_PORT = 0 disables it),
+# copied into the crawl stats every METRICS_INTERVAL seconds and summarized in LOG_DIR/metrics_<timestamp>.json
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9410
+METRICS_INTERVAL = 15
+
 timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 LOG_FILE = os.path.join(LOG_DIR, f"spider_{timestamp}.log")
 LOG_LEVEL = "INFO"
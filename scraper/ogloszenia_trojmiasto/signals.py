@@ -0,0 +1,9 @@
+"""
+custom signals of the project (sent with crawler.signals.send_catch_log)
+"""
+
+# DatabasePipeline wrote a batch: listings_stored(urls, spider), urls of the stored items
+listings_stored = object()
+
+# DatabasePipeline gave up on items after DB_BATCH_MAX_ATTEMPTS failed writes: listings_dropped(urls, spider)
+listings_dropped = object()
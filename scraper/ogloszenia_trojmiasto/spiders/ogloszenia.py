@@ -1,9 +1,91 @@
 import scrapy
 from ogloszenia_trojmiasto import items
-from ogloszenia_trojmiasto.db_helper import DatabaseHelper
+from ogloszenia_trojmiasto import state
+from ogloszenia_trojmiasto.listing_index import RecrawlPolicy
+from ogloszenia_trojmiasto.metrics import timed_callback
 import os
+import re
 import logging
 from datetime import datetime, timedelta
+from twisted.internet import defer, threads
+from w3lib.url import add_or_replace_parameter
+
+PRICE_PATTERN = re.compile(r"(\d{1,3}(?:\s\d{3})+|\d+)(?:[.,]\d+)?\s*zł(?!\s*/)") # "350 000 zł", not "12 000 zł/m²"
+AREA_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*m(?:²|2)(?!\w)") # "45,5 m²"
+
+# request priorities (higher first): new listings, then list pages, then refreshes ordered by staleness
+PRIORITY_NEW = 100
+PRIORITY_LIST_PAGE = 50
+PRIORITY_REFRESH_MAX = 49
+
+# list pages are addressed with ?strona=<n>
+PAGE_PARAMETER = "strona"
+PAGE_PATTERN = re.compile(rf"[?&]{PAGE_PARAMETER}=(\d+)")
+NEXT_PAGE_SELECTOR = "div.pages__controls.pages__controls--right a::attr(href)"
+
+# detail page fields with their own selectors
+SELECTOR_FIELDS = {
+    "title": "h1.xogIndex__title::text",
+    "price": ".xogParams p::text"
+}
+ADDRESS_SELECTOR = "i.trm.trm-location + span::text" # address is split across multiple elements
+
+# parameter block of the detail page: <span>label</span><span>value</span>
+# label substring -> field
+PARAMETER_FIELDS = {
+    "Liczba pokoi": "rooms",
+    "Piętro": "floor",
+    "Rok budowy": "year",
+    "Cena za m": "price_per_sqr_meter",
+    "Pow. nieruchomości": "square_meters"
+}
+
+def next_element(element):
+    """
+    next sibling element (skipping comments and processing instructions)
+    """
+    for sibling in element.itersiblings():
+        if isinstance(sibling.tag, str):
+            return sibling
+    return None
+
+def extract_detail_fields(response):
+    """
+    extract listing fields from the detail page
+
+    the parameter block is read in a single pass over <span> elements into label -> value
+    instead of one :contains() query per field. Returns (fields, missing field names)
+    """
+    fields = {}
+    for field, selector in SELECTOR_FIELDS.items():
+        value = response.css(selector).get()
+        fields[field] = value.strip() if value else None # strip result for readability
+    fields["address"] = response.css(ADDRESS_SELECTOR).getall()
+
+    remaining = dict(PARAMETER_FIELDS)
+    for field in remaining.values():
+        fields[field] = None
+
+    for span in response.selector.root.iter("span"):
+        if not remaining:
+            break
+        value_span = next_element(span)
+        if value_span is None or value_span.tag != "span":
+            continue
+
+        label = "".join(span.itertext())
+        for label_part, field in remaining.items():
+            if label_part in label:
+                # first text node of the value span (same as "span::text" selector)
+                value = value_span.text if value_span.text is not None else next(
+                    (child.tail for child in value_span if child.tail is not None), None
+                )
+                fields[field] = value.strip() if value else None
+                del remaining[label_part]
+                break
+
+    missing = [field for field, value in fields.items() if not value]
+    return fields, missing
 
 class OgloszeniaSpider(scrapy.Spider):
     name = "ogloszenia"
@@ -15,55 +97,221 @@ class OgloszeniaSpider(scrapy.Spider):
     
     def __init__(self):
         super().__init__()
-        self.db_helper = DatabaseHelper()
-        self.existing_urls = self.db_helper.get_existing_urls()
-        self.logger.info(f"Fetched {len(self.existing_urls)} urls from the database")
+        self.db_helper = state.get_db_helper()
+        self.touched_urls = [] # unchanged listings (based on list card), scraped_ts updated in batches
+        self.pending_writes = set() # scraped_ts updates running in the thread pool
+        self.end_pages = {} # start url -> first empty list page
+        self.list_page_concurrency = 4
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # shared with DatabasePipeline, kept warm between sessions unless other workers write to the database
+        spider.listing_index = state.get_listing_index(reload=crawler.settings.getbool("FRONTIER_ENABLED"))
+        spider.logger.info(f"Fetched {len(spider.listing_index)} urls from the database")
+        spider.listing_index.recrawl_policy = RecrawlPolicy.from_settings(crawler.settings)
+        spider.list_page_concurrency = max(crawler.settings.getint("LIST_PAGE_CONCURRENCY", 4), 1)
+        return spider
 
+    def refresh_priority(self, scraped_ts):
+        """
+        the longer since the last scrape, the higher the priority (one step per day)
+        """
+        days = (datetime.now() - scraped_ts).days
+        return min(days, PRIORITY_REFRESH_MAX)
+
+    @timed_callback
     def parse(self, response):
+        self.crawler.stats.inc_value("budget/list_pages")
         listings = response.css('div.list__item') # main class showing all listings
         for listing in listings:
             relative_url = listing.css("h2.list__item__content__title a::attr(href)").get() # current site
             listing_url = response.urljoin(relative_url)
 
-            if listing_url in self.existing_urls: # check if listing is in db
-                scraped_ts = self.existing_urls[listing_url] # get timestamp of the last scrape
-                if scraped_ts >= datetime.now() - timedelta(days=7):
-                    self.logger.info(f"skipping {listing_url} - data scraped within last 7 days")
-                    continue
+            scraped_ts = self.listing_index.get_scraped_ts(listing_url) # get timestamp of the last scrape
+            if scraped_ts is not None and not self.listing_index.is_due(listing_url): # check if listing is in db
+                interval = self.listing_index.recrawl_interval(listing_url)
+                self.logger.info(f"skipping {listing_url} - data scraped within last {interval:.1f} days")
+                self.crawler.stats.inc_value("listings/not_due")
+                continue
 
-            yield response.follow(listing_url, callback = self.parse_subsite) # enter subsite
+            # price and area on the list card match the db - no need to fetch the detail page
+            card = self.parse_list_card(listing)
+            if self.listing_index.matches_card(listing_url, card["price"], card["square_meters"]):
+                self.logger.info(f"skipping {listing_url} - no changes on the listing card, updating scraped_ts")
+                self.touch_listing(listing_url, "listings/detail_skipped_unchanged")
+                continue
 
-        next_page = response.css("div.pages__controls.pages__controls--right a::attr(href)").get()
-        if next_page is not None:
-            next_page_url = response.urljoin(next_page)
-            yield response.follow(next_page_url, callback = self.parse)
+            self.crawler.stats.inc_value("listings/detail_fetched")
+            crawl_class = "new" if scraped_ts is None else "refresh"
+            priority = PRIORITY_NEW if scraped_ts is None else self.refresh_priority(scraped_ts)
+            yield response.follow(
+                listing_url,
+                callback = self.parse_subsite,
+                priority = priority,
+                meta = {"conditional_request": True, "crawl_class": crawl_class}
+            ) # enter subsite
 
+        yield from self.follow_list_pages(response, has_listings = bool(listings))
 
-    def parse_subsite(self, response):
-        ogloszenie = items.OgloszenieItem()
+    def follow_list_pages(self, response, has_listings):
+        """
+        fan-out pagination: the first page of each start url reads the page count and opens
+        a window of LIST_PAGE_CONCURRENCY pages, every parsed page then schedules the page
+        one window ahead. Pages are requested in parallel instead of as a next-page chain
+        """
+        page = response.meta.get("page", 1)
+        base_url = response.meta.get("base_url", response.url)
+        last_page = response.meta.get("last_page")
+
+        if not has_listings: # past the end (listings removed since the page count was read)
+            self.logger.info(f"empty list page {response.url} - stopping pagination of {base_url}")
+            self.crawler.stats.inc_value("pagination/empty_pages")
+            self.end_pages[base_url] = min(self.end_pages.get(base_url, page), page)
+            return
+
+        if page == 1:
+            last_page = self.parse_page_count(response)
+            if last_page is None: # no page links - fall back to following the next page link
+                self.crawler.stats.inc_value("pagination/fallback_chain")
+            else:
+                self.logger.info(f"{base_url}: {last_page} list pages")
+                self.crawler.stats.inc_value("pagination/pages_total", last_page)
+                for next_page in range(2, min(1 + self.list_page_concurrency, last_page) + 1):
+                    yield from self.list_page_request(base_url, next_page, last_page)
+                return
+
+        if last_page is not None:
+            next_page = page + self.list_page_concurrency
+            if next_page <= last_page:
+                yield from self.list_page_request(base_url, next_page, last_page)
+                return
+            if page < last_page:
+                return
+            # last known page - keep chaining below if new pages appeared during the crawl
 
-        fields = {
-            "title": "h1.xogIndex__title::text",
-            "price": ".xogParams p::text",
-            "rooms": "span:contains('Liczba pokoi') + span::text",
-            "floor": "span:contains('Piętro') + span::text",
-            "year": "span:contains('Rok budowy') + span::text",
-            "price_per_sqr_meter": "span:contains('Cena za m') + span::text",
-            "square_meters": "span:contains('Pow. nieruchomości') + span::text",
-            "address": "i.trm.trm-location + span::text"
+        next_page_link = response.css(NEXT_PAGE_SELECTOR).get()
+        if next_page_link is not None:
+            yield response.follow(
+                response.urljoin(next_page_link),
+                callback = self.parse,
+                priority = PRIORITY_LIST_PAGE,
+                meta = {"page": page + 1, "base_url": base_url}
+            )
+
+    @staticmethod
+    def parse_page_count(response):
+        """
+        highest page number linked from the pagination of the first list page
+        """
+        pages = [
+            int(match.group(1))
+            for href in response.css("div.pages a::attr(href)").getall()
+            if (match := PAGE_PATTERN.search(href))
+        ]
+        return max(pages) if pages else None
+
+    def list_page_request(self, base_url, page, last_page):
+        """
+        request for the n-th list page; pages behind an already seen empty page are skipped
+        """
+        if page >= self.end_pages.get(base_url, page + 1):
+            return
+        self.crawler.stats.inc_value("pagination/pages_scheduled")
+        yield scrapy.Request(
+            add_or_replace_parameter(base_url, PAGE_PARAMETER, str(page)),
+            callback = self.parse,
+            errback = self.list_page_failed,
+            priority = PRIORITY_LIST_PAGE,
+            meta = {"page": page, "base_url": base_url, "last_page": last_page}
+        )
+
+    def list_page_failed(self, failure):
+        """
+        keep the window moving when a list page could not be downloaded
+        """
+        meta = failure.request.meta
+        self.logger.warning(f"list page {failure.request.url} failed: {failure.value!r}")
+        self.crawler.stats.inc_value("pagination/failed_pages")
+        yield from self.list_page_request(meta["base_url"], meta["page"] + self.list_page_concurrency, meta["last_page"])
+
+
+    @staticmethod
+    def parse_list_card(listing):
+        """
+        extract price and area shown on the listing card of the list page
+        """
+        text = " ".join(listing.css("*::text").getall()).replace("\xa0", " ")
+        price = PRICE_PATTERN.search(text)
+        area = AREA_PATTERN.search(text)
+
+        return {
+            "price": float(re.sub(r"\s", "", price.group(1))) if price else None,
+            "square_meters": float(area.group(1).replace(",", ".")) if area else None
+        }
+
+    def touch_listing(self, url, stat):
+        """
+        mark listing as scraped without parsing its detail page
+        """
+        self.listing_index.touch(url)
+        self.touched_urls.append(url)
+        self.crawler.stats.inc_value(stat)
+        if len(self.touched_urls) >= 100:
+            self.flush_touched_urls()
+
+    def flush_touched_urls(self):
+        """
+        update scraped_ts in the reactor's thread pool - the crawl doesn't wait for the database
+        """
+        if not self.touched_urls:
+            return
+        urls, self.touched_urls = self.touched_urls, []
+        d = threads.deferToThread(self.db_helper.update_scraped_ts_many, urls)
+        d.addErrback(lambda failure: self.logger.error(f"Failed to update scraped_ts of {len(urls)} urls: {failure.getErrorMessage()}"))
+        self.pending_writes.add(d)
+        d.addBoth(lambda _: self.pending_writes.discard(d))
+
+    def closed(self, reason):
+        self.flush_touched_urls()
+
+        stats = self.crawler.stats
+        skipped = stats.get_value("listings/detail_skipped_unchanged", 0)
+        fetched = stats.get_value("listings/detail_fetched", 0)
+        if skipped + fetched:
+            stats.set_value("listings/detail_requests_saved_ratio", round(skipped / (skipped + fetched), 3))
+        self.logger.info(f"Skipped {skipped} detail pages with unchanged list cards, fetched {fetched}")
+
+        # share of the crawl budget (downloaded pages) spent on each class of requests
+        spent = {
+            crawl_class: stats.get_value(f"budget/{crawl_class}", 0)
+            for crawl_class in ("list_pages", "detail_pages_new", "detail_pages_refresh")
         }
+        total = sum(spent.values())
+        for crawl_class, pages in spent.items():
+            stats.set_value(f"budget/{crawl_class}_share", round(pages / total, 3) if total else 0)
+        self.logger.info(f"Crawl budget spent: {spent} (finished: {reason})")
+
+        # spider_closed handlers may return deferreds - the crawler waits for the last updates
+        return defer.DeferredList(list(self.pending_writes))
+
+    @timed_callback
+    def parse_subsite(self, response):
+        self.crawler.stats.inc_value(f"budget/detail_pages_{response.meta.get('crawl_class', 'new')}")
+
+        if response.meta.get("not_modified"): # set by ConditionalRequestMiddleware
+            self.logger.info(f"skipping {response.url} - page not modified since last crawl, updating scraped_ts")
+            self.touch_listing(response.url, "listings/detail_not_modified")
+            return
+
+        ogloszenie = items.OgloszenieItem()
 
-        for field, selector in fields.items():
-            try:
-                if field == "address":
-                    value = response.css(selector).getall() # use getall(); address is split across multiple elements
-                    ogloszenie[field] = value
-                else:
-                    value = response.css(selector).get()
-                    ogloszenie[field] = value.strip() if value else None # strip result for readability 
-            except Exception as e:
-                self.logger.error(f"Error extracting {field}: {e}")
-                ogloszenie[field] = None
+        fields, missing = extract_detail_fields(response)
+        ogloszenie.update(fields)
+        for field in missing:
+            self.crawler.stats.inc_value(f"parse/missing/{field}")
+        if missing:
+            self.logger.debug(f"Missing fields in {response.url}: {', '.join(missing)}")
 
         ogloszenie["scraped_ts"] = datetime.now()
         ogloszenie["url"] = response.url
@@ -0,0 +1,53 @@
+"""
+process-wide state shared by the spider and pipelines
+
+scraper/main.py runs all scraping sessions in one long-lived process, so objects created
+here (db connection pool, listing index) stay warm between sessions. The coastline index and the
+geocoding cache are kept the same way in the geodistance module
+"""
+from ogloszenia_trojmiasto.db_helper import DatabaseHelper
+from ogloszenia_trojmiasto.listing_index import ListingIndex
+
+_db_helper = None
+_listing_index = None
+
+def get_db_helper() -> DatabaseHelper:
+    """
+    shared database helper on the process-wide connection pool, health-checked before every
+    session; the schema is migrated once per process when it's created
+    """
+    global _db_helper
+    if _db_helper is None:
+        _db_helper = DatabaseHelper()
+        _db_helper.create_table()
+    else:
+        _db_helper.ensure_connection()
+    return _db_helper
+
+def set_db_helper(db_helper):
+    """
+    use the given database helper (e.g. a stand-in in benchmarks); the listing index is reloaded from it
+    """
+    global _db_helper, _listing_index
+    _db_helper = db_helper
+    _listing_index = None
+
+def get_listing_index(reload: bool = False) -> ListingIndex:
+    """
+    listing index loaded once per process and updated in place by DatabasePipeline;
+    reload=True when other processes (scraper workers) write to the database too
+    """
+    global _listing_index
+    if _listing_index is None or reload:
+        _listing_index = ListingIndex.from_db(get_db_helper())
+    return _listing_index
+
+def reset():
+    """
+    drop warm state (e.g. when the database was modified by another process)
+    """
+    global _db_helper, _listing_index
+    if _db_helper is not None:
+        _db_helper.close()
+    _db_helper = None
+    _listing_index = None
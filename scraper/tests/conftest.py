@@ -0,0 +1,9 @@
+"""
+tests run from the scraper directory (python -m pytest) or from anywhere with pytest scraper/tests
+"""
+import os
+import sys
+
+SCRAPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRAPER_DIR not in sys.path:
+    sys.path.insert(0, SCRAPER_DIR)
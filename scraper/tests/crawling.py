@@ -0,0 +1,60 @@
+"""
+helpers of the tests running crawls against the fixture site of the crawl benchmark
+
+the twisted reactor can be started only once per process, so every crawl runs in its own
+interpreter (`python -m tests.<module> <output>`) and reports its results as json. The crawl
+uses a stand-in coastline, so no shapefiles (not tracked in git) are needed
+"""
+import json
+import os
+import subprocess
+import sys
+
+from geopy.geocoders import Nominatim
+from shapely.geometry import LineString
+from scrapy.utils.project import get_project_settings
+
+from ogloszenia_trojmiasto import geodistance
+
+SCRAPER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_crawl_process(module, tmp_path, *args, timeout=300, env=None):
+    """
+    run `python -m module output *args` from the scraper directory, returns the json it wrote to output
+    """
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    output = tmp_path / "result.json"
+    subprocess.run(
+        [sys.executable, "-m", module, str(output), *map(str, args)],
+        cwd=SCRAPER_DIR, check=True, timeout=timeout,
+        env={**os.environ, "SCRAPER_CACHE_DIR": str(tmp_path / "cache"), **(env or {})}
+    )
+    with open(output) as f:
+        return json.load(f)
+
+def use_test_geodata(nominatim_host):
+    """
+    geocode with the fake nominatim and measure distances to a straight line along the Gulf of Gdańsk
+    """
+    geodistance.geolocator = Nominatim(user_agent="tests", domain=nominatim_host, scheme="http")
+    geodistance._coastline = geodistance.CoastlineIndex(LineString([(18.40, 54.70), (18.60, 54.45), (18.85, 54.35)]))
+
+def crawl_settings(cache_dir, **overrides):
+    """
+    project settings for an offline crawl; caches go to cache_dir, metrics and telnet are off.
+    GEOCODING_RATE stays at the project value (divided between SCRAPER_WORKERS) unless overridden
+    """
+    settings = get_project_settings()
+    settings.set("LOG_FILE", None)
+    settings.set("LOG_LEVEL", "WARNING")
+    settings.set("TELNETCONSOLE_ENABLED", False)
+    settings.set("METRICS_ENABLED", False)
+    settings.set("DOWNLOAD_DELAY", 0)
+    settings.set("GEOCODING_CACHE_PATH", os.path.join(cache_dir, "geocoding.sqlite"))
+    settings.set("GAZETTEER_PATH", os.path.join(cache_dir, "gazetteer.sqlite")) # missing file - disabled
+    settings.set("DISTANCE_GRID_PATH", None) # exact distances to the stand-in coastline
+    settings.set("CONDITIONAL_REQUESTS_PATH", os.path.join(cache_dir, "http_validators.sqlite"))
+    settings.set("LOG_DIR", cache_dir)
+    for name, value in overrides.items():
+        settings.set(name, value)
+    return settings
@@ -0,0 +1,26 @@
+"""
+coastline artifact key: missing shapefiles change the hash and fail with a clear error
+"""
+import os
+
+import pytest
+
+from ogloszenia_trojmiasto import geodistance
+
+COASTLINE_SHAPEFILE = os.path.join(
+    os.path.dirname(os.path.abspath(geodistance.__file__)), "shapefiles", "Europe_coastline_shapefile", "Europe_coastline.shp"
+)
+
+def test_missing_file_changes_hash(tmp_path):
+    present = tmp_path / "coastline.shp"
+    present.write_bytes(b"shape")
+    missing = tmp_path / "coastline.shx"
+
+    assert geodistance.hash_files([str(present), str(missing)]) != geodistance.hash_files([str(present)])
+    missing.write_bytes(b"")
+    assert geodistance.hash_files([str(present), str(missing)]) != geodistance.hash_files([str(present)])
+
+@pytest.mark.skipif(os.path.exists(COASTLINE_SHAPEFILE), reason="coastline shapefile is present")
+def test_missing_shapefile_is_named(tmp_path):
+    with pytest.raises(FileNotFoundError, match="Europe_coastline.shp"):
+        geodistance.load_coastline(str(tmp_path))
@@ -0,0 +1,223 @@
+"""
+CrawlFrontierMiddleware in a sharded crawl: worker spiders of one process share a crawl frontier
+and run against the fixture site of the crawl benchmark. The frontier is an in-memory stand-in
+with the row states of CrawlFrontier, so the test runs without MySQL - the SQL of CrawlFrontier
+and separate worker processes are covered by test_frontier_mysql.py.
+
+The first database batch fails and is dropped (DB_BATCH_MAX_ATTEMPTS=1): the urls of its items
+have to be released and crawled again, not marked as done
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from benchmarks.crawl import MemoryDatabase, Recorder, benchmark_spider, make_nominatim_handler, make_site_handler, serve
+from ogloszenia_trojmiasto import middlewares, state
+from tests.crawling import crawl_settings, run_crawl_process, use_test_geodata
+
+WORKERS = 3
+PAGES = 2 # list pages per start url
+
+class FrontierStore:
+    """
+    crawl_frontier rows shared by the workers, with a log of every claim
+    """
+    def __init__(self):
+        self.rows = {} # url -> row
+        self.claims = [] # (worker_id, url)
+        self.reactor_calls = Counter() # frontier methods called on the reactor (main) thread
+        self.lock = threading.Lock() # one "transaction" at a time
+
+class MemoryFrontier:
+    """
+    in-memory stand-in for CrawlFrontier (same methods and row states)
+    """
+    def __init__(self, store, crawl_id, worker_id, lease_seconds=600, max_attempts=3):
+        self.store = store
+        self.crawl_id = crawl_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def record_call(self, method):
+        if threading.current_thread() is threading.main_thread():
+            with self.store.lock:
+                self.store.reactor_calls[method] += 1
+
+    def add(self, entries):
+        self.record_call("add")
+        added = 0
+        with self.store.lock:
+            for url, kind, priority, request in entries:
+                if url not in self.store.rows:
+                    self.store.rows[url] = {
+                        "kind": kind, "priority": priority, "request": json.dumps(request), "status": "pending",
+                        "lease_owner": None, "lease_expires": None, "attempts": 0
+                    }
+                    added += 1
+        return added
+
+    def claim(self, limit):
+        self.record_call("claim")
+        now = time.monotonic()
+        with self.store.lock:
+            candidates = [
+                url for url, row in self.store.rows.items()
+                if row["attempts"] < self.max_attempts
+                    and (row["status"] == "pending" or (row["status"] == "leased" and row["lease_expires"] < now))
+            ]
+            candidates.sort(key=lambda url: self.store.rows[url]["priority"], reverse=True)
+
+            claimed = []
+            for url in candidates[:limit]:
+                row = self.store.rows[url]
+                row.update(status="leased", lease_owner=self.worker_id, lease_expires=now + self.lease_seconds)
+                row["attempts"] += 1
+                self.store.claims.append((self.worker_id, url))
+                claimed.append((url, json.loads(row["request"])))
+        return claimed
+
+    def done(self, url):
+        self.record_call("done")
+        with self.store.lock:
+            self.store.rows[url].update(status="done", lease_owner=None, lease_expires=None)
+
+    def release(self, url, failed=True):
+        self.record_call("release")
+        with self.store.lock:
+            row = self.store.rows[url]
+            if row["lease_owner"] != self.worker_id:
+                return
+            if failed:
+                row["status"] = "failed" if row["attempts"] >= self.max_attempts else "pending"
+            else:
+                row["status"] = "pending"
+                row["attempts"] = max(row["attempts"] - 1, 0)
+            row.update(lease_owner=None, lease_expires=None)
+
+    def has_work(self):
+        self.record_call("has_work")
+        with self.store.lock:
+            return any(
+                row["status"] in ("pending", "leased") and row["attempts"] < self.max_attempts
+                for row in self.store.rows.values()
+            )
+
+    def status_counts(self):
+        with self.store.lock:
+            return dict(Counter(row["status"] for row in self.store.rows.values()))
+
+    def purge(self, keep_days=7):
+        pass
+
+class FlakyDatabase(MemoryDatabase):
+    """
+    in-memory database failing the first batch write
+    """
+    def __init__(self):
+        super().__init__()
+        self.failures = 1
+
+    def write_batch(self, new_items, changed_items, unchanged_urls):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database restarting")
+        return super().write_batch(new_items, changed_items, unchanged_urls)
+
+def worker_spider(site_url, worker_id):
+    class WorkerSpider(benchmark_spider(site_url, Recorder())):
+        custom_settings = {"SCRAPER_WORKER_ID": worker_id}
+
+    return WorkerSpider
+
+def run_sharded_crawl(output):
+    """
+    crawl with WORKERS worker spiders in this process, results are written to output as json
+    """
+    from scrapy.crawler import CrawlerProcess
+
+    store = FrontierStore()
+    database = FlakyDatabase()
+    site, site_host = serve(make_site_handler(PAGES, addresses=10))
+    nominatim, nominatim_host = serve(make_nominatim_handler(latency=0.0))
+    middlewares.DatabaseHelper = lambda: None # the frontier doesn't use it
+    middlewares.CrawlFrontier = lambda db_helper, **kwargs: MemoryFrontier(store, **kwargs)
+    use_test_geodata(nominatim_host)
+    state.set_db_helper(database)
+
+    settings = crawl_settings(
+        os.path.dirname(output),
+        DOWNLOAD_DELAY=0.4, # idle workers claim urls every 5 s (spider_idle) - crawl has to last longer
+        CONCURRENT_REQUESTS=4,
+        GEOCODING_RATE=1000.0,
+        FRONTIER_ENABLED=True,
+        FRONTIER_CRAWL_ID="test",
+        FRONTIER_CLAIM_SIZE=4, # small batches, so the workers take turns
+        DB_BATCH_MAX_AGE=1,
+        DB_BATCH_MAX_ATTEMPTS=1
+    )
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawlers = []
+    for worker in range(WORKERS):
+        crawler = process.create_crawler(worker_spider(f"http://{site_host}", f"worker-{worker}"))
+        process.crawl(crawler)
+        crawlers.append(crawler)
+    process.start()
+    site.shutdown()
+    nominatim.shutdown()
+
+    with open(output, "w") as f:
+        json.dump({
+            "rows": {url: {"kind": row["kind"], "status": row["status"]} for url, row in store.rows.items()},
+            "claims": store.claims,
+            "reactor_calls": store.reactor_calls,
+            "stored": sorted(database.rows),
+            "stats": [
+                {key: value for key, value in crawler.stats.get_stats().items() if isinstance(value, (int, float, str))}
+                for crawler in crawlers
+            ]
+        }, f)
+
+@pytest.fixture(scope="module")
+def sharded_crawl(tmp_path_factory):
+    return run_crawl_process("tests.test_frontier", tmp_path_factory.mktemp("sharded_crawl"))
+
+def total(stats, key):
+    return sum(worker_stats.get(key, 0) for worker_stats in stats)
+
+def test_every_url_done(sharded_crawl):
+    rows, stats = sharded_crawl["rows"], sharded_crawl["stats"]
+    assert rows
+    assert {row["status"] for row in rows.values()} == {"done"}
+    assert total(stats, "frontier/done") == len(rows)
+    assert all(worker_stats.get("finish_reason") == "finished" for worker_stats in stats)
+
+def test_dropped_items_are_crawled_again(sharded_crawl):
+    stats = sharded_crawl["stats"]
+    claims = Counter(url for _, url in sharded_crawl["claims"])
+    dropped = total(stats, "db/items_dropped")
+    assert dropped > 0
+    assert total(stats, "frontier/released") == dropped
+    # urls of the dropped batch were leased twice, all others once
+    assert Counter(claims.values()) == {1: len(claims) - dropped, 2: dropped}
+
+def test_work_is_shared_between_workers(sharded_crawl):
+    workers = {worker_id for worker_id, _ in sharded_crawl["claims"]}
+    assert len(workers) > 1
+
+def test_every_listing_stored(sharded_crawl):
+    detail_urls = {url for url, row in sharded_crawl["rows"].items() if row["kind"] == "parse_subsite"}
+    assert detail_urls
+    assert set(sharded_crawl["stored"]) == detail_urls
+
+def test_frontier_is_queried_from_thread_pool(sharded_crawl):
+    # only the idle check (every 5 s) waits for the database on the reactor thread
+    assert set(sharded_crawl["reactor_calls"]) <= {"has_work"}
+
+if __name__ == "__main__":
+    run_sharded_crawl(sys.argv[1])
@@ -0,0 +1,232 @@
+"""
+CrawlFrontier against a real MySQL database: the claim/lease SQL, and separate worker processes
+(each with its own frontier, pipelines and geocoding rate limit) sharing one crawl.
+
+Needs a disposable database - set SCRAPER_TEST_DB=1 and the DB_* variables (.env) pointing at it;
+the schema is migrated by the tests, frontier rows of every test crawl are deleted afterwards
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.crawl import Recorder, benchmark_spider, make_nominatim_handler, make_site_handler, serve
+from ogloszenia_trojmiasto.db_helper import DatabaseHelper
+from ogloszenia_trojmiasto.frontier import CrawlFrontier
+from tests.crawling import crawl_settings, run_crawl_process, use_test_geodata
+
+pytestmark = pytest.mark.skipif(
+    os.getenv("SCRAPER_TEST_DB") != "1", reason="needs a disposable MySQL database (SCRAPER_TEST_DB=1, DB_* variables)"
+)
+
+WORKERS = 3
+PAGES = 2 # list pages per start url
+
+@pytest.fixture(scope="module")
+def db_helper():
+    db_helper = DatabaseHelper()
+    db_helper.create_table() # migrations create crawl_frontier
+    yield db_helper
+    db_helper.close()
+
+@pytest.fixture
+def crawl_id(db_helper):
+    crawl_id = f"test-{uuid.uuid4().hex[:12]}"
+    yield crawl_id
+    db_helper.run_in_transaction(
+        lambda cursor: cursor.execute("DELETE FROM crawl_frontier WHERE crawl_id = %s", (crawl_id,))
+    )
+
+def entries(count):
+    return [
+        (f"https://example.com/ogl{i}.html", "parse_subsite", i % 3,
+         {"callback": "parse_subsite", "errback": None, "priority": i % 3, "meta": {}})
+        for i in range(count)
+    ]
+
+def rows(db_helper, crawl_id):
+    """
+    url -> (status, attempts, lease_owner)
+    """
+    return {
+        url: (status, attempts, lease_owner)
+        for url, status, attempts, lease_owner in db_helper.fetch_all(
+            "SELECT url, status, attempts, lease_owner FROM crawl_frontier WHERE crawl_id = %s", (crawl_id,)
+        )
+    }
+
+def test_known_urls_are_not_added_again(db_helper, crawl_id):
+    assert CrawlFrontier(db_helper, crawl_id, "a").add(entries(5)) == 5
+    assert CrawlFrontier(db_helper, crawl_id, "b").add(entries(8)) == 3
+    assert len(rows(db_helper, crawl_id)) == 8
+
+def test_concurrent_claims_are_exclusive(db_helper, crawl_id):
+    CrawlFrontier(db_helper, crawl_id, "seed").add(entries(60))
+
+    def drain(worker_id):
+        frontier = CrawlFrontier(db_helper, crawl_id, worker_id)
+        urls = []
+        while batch := frontier.claim(5):
+            urls.extend(url for url, _ in batch)
+        return worker_id, urls
+
+    with ThreadPoolExecutor(4) as executor:
+        claimed = dict(executor.map(drain, [f"worker-{i}" for i in range(4)]))
+
+    urls = [url for worker_urls in claimed.values() for url in worker_urls]
+    assert len(urls) == len(set(urls)) == 60
+    for url, (status, attempts, lease_owner) in rows(db_helper, crawl_id).items():
+        assert status == "leased" and attempts == 1
+        assert url in claimed[lease_owner]
+
+def test_claim_takes_highest_priority_first(db_helper, crawl_id):
+    frontier = CrawlFrontier(db_helper, crawl_id, "a")
+    frontier.add(entries(9))
+    assert {request["priority"] for _, request in frontier.claim(3)} == {2}
+
+def test_expired_lease_is_claimed_again(db_helper, crawl_id):
+    dead = CrawlFrontier(db_helper, crawl_id, "dead", lease_seconds=1)
+    alive = CrawlFrontier(db_helper, crawl_id, "alive", lease_seconds=1)
+    dead.add(entries(3))
+    assert len(dead.claim(10)) == 3
+    assert alive.claim(10) == []
+
+    time.sleep(2.5)
+    assert {url for url, _ in alive.claim(10)} == {url for url, *_ in entries(3)}
+    assert set(rows(db_helper, crawl_id).values()) == {("leased", 2, "alive")}
+
+def test_release_needs_the_lease(db_helper, crawl_id):
+    owner = CrawlFrontier(db_helper, crawl_id, "owner")
+    owner.add(entries(2))
+    claimed = owner.claim(10)
+
+    other = CrawlFrontier(db_helper, crawl_id, "other")
+    for url, _ in claimed:
+        other.release(url)
+        other.release(url, failed=False)
+    assert set(rows(db_helper, crawl_id).values()) == {("leased", 1, "owner")}
+
+def test_released_unfinished_urls_keep_their_attempts(db_helper, crawl_id):
+    frontier = CrawlFrontier(db_helper, crawl_id, "a", max_attempts=1)
+    frontier.add(entries(2))
+    for url, _ in frontier.claim(10):
+        frontier.release(url, failed=False)
+    assert set(rows(db_helper, crawl_id).values()) == {("pending", 0, None)}
+    assert len(CrawlFrontier(db_helper, crawl_id, "b", max_attempts=1).claim(10)) == 2
+
+def test_failing_urls_give_up_after_max_attempts(db_helper, crawl_id):
+    frontier = CrawlFrontier(db_helper, crawl_id, "a", max_attempts=2)
+    frontier.add(entries(2))
+    for _ in range(2):
+        assert frontier.has_work()
+        for url, _ in frontier.claim(10):
+            frontier.release(url)
+
+    assert frontier.claim(10) == []
+    assert not frontier.has_work()
+    assert frontier.status_counts() == {"failed": 2}
+
+def test_done_urls_end_the_crawl(db_helper, crawl_id):
+    frontier = CrawlFrontier(db_helper, crawl_id, "a")
+    frontier.add(entries(3))
+    claimed = frontier.claim(10)
+    other = CrawlFrontier(db_helper, crawl_id, "b")
+    assert other.has_work() # leased by another worker
+
+    for url, _ in claimed:
+        frontier.done(url)
+    assert not other.has_work()
+    assert frontier.status_counts() == {"done": 3}
+
+def run_worker(output, site_url, nominatim_host):
+    """
+    one scraper worker with the real frontier and database (FRONTIER_* and SCRAPER_WORKER* come from the
+    env, like in production), results are written to output as json
+    """
+    from scrapy.crawler import CrawlerProcess
+
+    use_test_geodata(nominatim_host)
+    settings = crawl_settings(
+        os.path.dirname(output),
+        DOWNLOAD_DELAY=0.2, # GEOCODING_RATE stays divided between the workers
+        DB_BATCH_MAX_AGE=1
+    )
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler(benchmark_spider(site_url, Recorder()))
+    process.crawl(crawler)
+    process.start()
+
+    with open(output, "w") as f:
+        json.dump(
+            {key: value for key, value in crawler.stats.get_stats().items() if isinstance(value, (int, float, str))}, f
+        )
+
+@pytest.fixture
+def nominatim():
+    """
+    fake nominatim recording the arrival time of every request
+    """
+    arrivals = []
+    lock = threading.Lock()
+
+    class RecordingHandler(make_nominatim_handler(latency=0.0)):
+        def do_GET(self):
+            with lock:
+                arrivals.append(time.monotonic())
+            super().do_GET()
+
+    server, host = serve(RecordingHandler)
+    yield host, arrivals
+    server.shutdown()
+    server.server_close()
+
+def test_worker_processes_share_the_crawl(db_helper, crawl_id, nominatim, tmp_path):
+    nominatim_host, arrivals = nominatim
+    site, site_host = serve(make_site_handler(PAGES, addresses=6))
+    env = {"FRONTIER_ENABLED": "1", "FRONTIER_CRAWL_ID": crawl_id, "SCRAPER_WORKERS": str(WORKERS)}
+    try:
+        with ThreadPoolExecutor(WORKERS) as executor:
+            stats = list(executor.map(
+                lambda worker: run_crawl_process(
+                    "tests.test_frontier_mysql", tmp_path / f"worker-{worker}", f"http://{site_host}", nominatim_host,
+                    env={**env, "SCRAPER_WORKER_ID": f"worker-{worker}"}
+                ),
+                range(WORKERS)
+            ))
+    finally:
+        site.shutdown()
+        site.server_close()
+
+    frontier = CrawlFrontier(db_helper, crawl_id, "test")
+    counts = frontier.status_counts()
+    assert set(counts) == {"done"}
+    assert all(worker_stats.get("finish_reason") == "finished" for worker_stats in stats)
+    # every url leased once (nothing failed, no lease expired) and crawled by more than one worker
+    assert sum(worker_stats.get("frontier/claimed", 0) for worker_stats in stats) == counts["done"]
+    assert sum(worker_stats.get("frontier/done", 0) for worker_stats in stats) == counts["done"]
+    assert sum(1 for worker_stats in stats if worker_stats.get("frontier/done")) > 1
+
+    detail_urls = {
+        url for (url,) in db_helper.fetch_all(
+            "SELECT url FROM crawl_frontier WHERE crawl_id = %s AND kind = 'parse_subsite'", (crawl_id,)
+        )
+    }
+    assert detail_urls
+    placeholders = ", ".join(["%s"] * len(detail_urls))
+    stored = db_helper.fetch_all(f"SELECT url FROM listings_current WHERE url IN ({placeholders})", tuple(detail_urls))
+    assert {url for (url,) in stored} == detail_urls
+
+    # global geocoding cap of 1 request/s: each worker bursts 1 request, then 1/WORKERS per second
+    arrivals = sorted(arrivals)
+    assert arrivals
+    for i in range(len(arrivals)):
+        for j in range(i + 1, len(arrivals)):
+            assert j - i + 1 <= WORKERS + (arrivals[j] - arrivals[i]) + 0.5
+
+if __name__ == "__main__":
+    run_worker(*sys.argv[1:4])
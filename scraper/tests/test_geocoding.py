@@ -0,0 +1,171 @@
+"""
+geocoding against the fake nominatim of the crawl benchmark: requests respect GEOCODING_RATE,
+repeated addresses (and their spelling variants) are answered by the cache, and a crawl through
+the item pipelines keeps downloading while items wait for a slow nominatim
+"""
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from geopy.geocoders import Nominatim
+
+from benchmarks.crawl import MemoryDatabase, Recorder, benchmark_spider, make_nominatim_handler, make_site_handler, serve
+from ogloszenia_trojmiasto import geodistance, state
+from ogloszenia_trojmiasto.address_keys import address_key
+from ogloszenia_trojmiasto.gazetteer import Gazetteer
+from ogloszenia_trojmiasto.geocoding_cache import GeocodingCache
+from tests.crawling import crawl_settings, run_crawl_process, use_test_geodata
+
+GEOCODING_RATE = 20.0 # requests per second, burst of 1 (RateLimiter default capacity)
+NOMINATIM_LATENCY = 0.5 # seconds per request of the slow nominatim in the crawl test
+PAGES = 4 # list pages per start url, 5 listings each
+ADDRESSES_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks", "fixtures", "addresses.txt")
+
+@pytest.fixture
+def nominatim():
+    """
+    fake nominatim recording the arrival time of every request
+    """
+    arrivals = []
+    lock = threading.Lock()
+
+    class RecordingHandler(make_nominatim_handler(latency=0.0)):
+        def do_GET(self):
+            with lock:
+                arrivals.append(time.monotonic())
+            super().do_GET()
+
+    server, host = serve(RecordingHandler)
+    yield host, arrivals
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def geocoder(monkeypatch, tmp_path, nominatim):
+    host, arrivals = nominatim
+    monkeypatch.setattr(geodistance, "geolocator", Nominatim(user_agent="tests", domain=host, scheme="http"))
+    monkeypatch.setattr(geodistance, "geocoding_cache", GeocodingCache(path=str(tmp_path / "geocoding.sqlite")))
+    monkeypatch.setattr(geodistance, "gazetteer", Gazetteer(path=str(tmp_path / "missing.sqlite"))) # disabled
+    monkeypatch.setattr(geodistance, "rate_limiter", geodistance.RateLimiter(rate=GEOCODING_RATE))
+    monkeypatch.setattr(geodistance, "address_locks", geodistance.KeyedLock())
+    yield arrivals
+    geodistance.geocoding_cache.close()
+
+def load_addresses():
+    with open(ADDRESSES_PATH, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def geocode_all(addresses, workers=8):
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(geodistance.get_location_data, addresses))
+
+def test_requests_respect_rate(geocoder):
+    addresses = [f"Gdańsk Grunwaldzka {number}" for number in range(1, 21)]
+    geocode_all(addresses)
+
+    arrivals = sorted(geocoder)
+    assert len(arrivals) == len(addresses)
+    # token bucket: any window of t seconds holds at most 1 + t * rate requests (small slack for network jitter)
+    for i in range(len(arrivals)):
+        for j in range(i + 1, len(arrivals)):
+            assert j - i + 1 <= 1 + (arrivals[j] - arrivals[i]) * GEOCODING_RATE + 0.5
+    assert arrivals[-1] - arrivals[0] >= (len(arrivals) - 1) / GEOCODING_RATE * 0.9
+
+def test_repeated_addresses_hit_cache(geocoder):
+    addresses = load_addresses()
+    keys = {address_key(address) for address in addresses}
+    assert len(keys) < len(addresses) # fixture has duplicates and spelling variants
+
+    first = geocode_all(addresses)
+    assert len(geocoder) == len(keys) # one request per canonical address, also for concurrent lookups
+    misses = geodistance.geocoding_cache.stats()["geocoding_cache/misses"]
+    hits = geodistance.geocoding_cache.stats()["geocoding_cache/hits"]
+    assert misses == len(keys)
+
+    second = geocode_all(addresses)
+    assert len(geocoder) == len(keys) # no new requests
+    assert second == first
+    stats = geodistance.geocoding_cache.stats()
+    assert stats["geocoding_cache/misses"] == misses
+    assert stats["geocoding_cache/hits"] == hits + len(addresses)
+
+def run_slow_geocoding_crawl(output):
+    """
+    crawl the benchmark site through all item pipelines against a slow nominatim (every listing has
+    its own address), results are written to output as json
+    """
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+
+    requests = [] # (start, end) of every nominatim request
+    lock = threading.Lock()
+
+    class SlowHandler(make_nominatim_handler(latency=NOMINATIM_LATENCY)):
+        def do_GET(self):
+            start = time.monotonic()
+            super().do_GET()
+            with lock:
+                requests.append((start, time.monotonic()))
+
+    database = MemoryDatabase()
+    site, site_host = serve(make_site_handler(PAGES, addresses=100_000))
+    nominatim, nominatim_host = serve(SlowHandler)
+    use_test_geodata(nominatim_host)
+    state.set_db_helper(database)
+
+    settings = crawl_settings(os.path.dirname(output), GEOCODING_RATE=GEOCODING_RATE, DOWNLOAD_DELAY=0.05)
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler(benchmark_spider(f"http://{site_host}", Recorder()))
+    responses = []
+
+    def response_received(response, request, spider): # signal receivers are weak references - keep a named function
+        responses.append(time.monotonic())
+
+    crawler.signals.connect(response_received, signal=signals.response_received)
+    process.crawl(crawler)
+
+    start = time.monotonic()
+    process.start()
+    elapsed = time.monotonic() - start
+    site.shutdown()
+    nominatim.shutdown()
+
+    with open(output, "w") as f:
+        json.dump({
+            "elapsed": elapsed,
+            "items": crawler.stats.get_value("item_scraped_count", 0),
+            "stored": len(database.rows),
+            "requests": requests,
+            "responses": responses
+        }, f)
+
+@pytest.fixture(scope="module")
+def slow_geocoding_crawl(tmp_path_factory):
+    return run_crawl_process("tests.test_geocoding", tmp_path_factory.mktemp("slow_geocoding_crawl"))
+
+def test_crawl_doesnt_wait_for_geocoding(slow_geocoding_crawl):
+    crawl = slow_geocoding_crawl
+    items = crawl["items"]
+    assert items == crawl["stored"] == len(crawl["requests"]) == 2 * PAGES * 5
+
+    # a pipeline blocking the reactor geocodes one item after another (items * latency);
+    # requests overlap up to the rate limit instead
+    assert crawl["elapsed"] < items * NOMINATIM_LATENCY / 2
+    arrivals = sorted(start for start, _ in crawl["requests"])
+    for i in range(len(arrivals)):
+        for j in range(i + 1, len(arrivals)):
+            assert j - i + 1 <= 1 + (arrivals[j] - arrivals[i]) * GEOCODING_RATE + 0.5
+
+    # pages are downloaded while nominatim answers (nothing is received while the reactor is blocked)
+    first_request = arrivals[0]
+    later = [received for received in crawl["responses"] if received > first_request]
+    during = [received for received in later if any(start < received < end for start, end in crawl["requests"])]
+    assert later
+    assert len(during) > len(later) / 2
+
+if __name__ == "__main__":
+    run_slow_geocoding_crawl(sys.argv[1])